@@ -0,0 +1,134 @@
+"""
+Admission control for the GPU API server (api_server.py): bounded in-flight work and priority lanes.
+
+Every /predict request is admitted into a lane before any work starts - "interactive" for small requests,
+"bulk" for the rest - and released when its response has been sent. The texts admitted across all lanes
+are capped at max_texts, and bulk requests may only fill max_texts - interactive_reserve of it, so a burst
+of large chunks never locks small requests out. A request that does not fit is turned away at once (429
+with a Retry-After estimated from the recent completion rate) instead of queueing until the client times
+out. Inside the micro-batcher interactive texts are taken ahead of bulk ones (micro_batching.py lanes), so
+a small request waits for at most one batch of a large one.
+"""
+
+import collections
+import math
+import threading
+import time
+
+LANES = ("interactive", "bulk")  # in priority order
+
+
+class Ticket:
+    """One admitted request; hand it back to AdmissionController.release when the response is done"""
+
+    def __init__(self, lane, count):
+        self.lane = lane
+        self.count = count
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Caps the texts being worked on (max_texts, 0 = no cap) and sorts requests into lanes.
+    Requests of up to interactive_max_texts texts are interactive unless they ask for bulk.
+    """
+
+    def __init__(self, max_texts, interactive_reserve=0, interactive_max_texts=256, rate_window=30.0):
+        self.max_texts = max_texts
+        self.interactive_reserve = min(interactive_reserve, max_texts) if max_texts else 0
+        self.interactive_max_texts = interactive_max_texts
+        self.rate_window = rate_window  # seconds of completions the Retry-After estimate looks at
+
+        self._lock = threading.Lock()
+        self._in_flight = {lane: {'requests': 0, 'texts': 0} for lane in LANES}
+        self._counters = {lane: {'admitted': 0, 'rejected': 0} for lane in LANES}
+        self._completed = collections.deque()  # (monotonic time, texts) of recently released requests
+
+    def lane_for(self, count, requested=None):
+        """Lane of a request of count texts; a large request is bulk whatever it asks for"""
+        if count > self.interactive_max_texts:
+            return "bulk"
+        return requested if requested in LANES else "interactive"
+
+    def _capacity(self, lane):
+        return self.max_texts if lane == "interactive" else self.max_texts - self.interactive_reserve
+
+    def _in_flight_texts(self):
+        return sum(state['texts'] for state in self._in_flight.values())
+
+    def admit(self, count, lane):
+        """Ticket if count texts fit into lane now, else None. An idle server admits any request."""
+        with self._lock:
+            in_flight = self._in_flight_texts()
+            if self.max_texts and in_flight and in_flight + count > self._capacity(lane):
+                self._counters[lane]['rejected'] += 1
+                return None
+            self._in_flight[lane]['requests'] += 1
+            self._in_flight[lane]['texts'] += count
+            self._counters[lane]['admitted'] += 1
+        return Ticket(lane, count)
+
+    def release(self, ticket):
+        """Return a ticket's capacity (None and already released tickets are ignored)"""
+        if ticket is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            # Streamed responses release from two places, so check and mark under the lock
+            if ticket.released:
+                return
+            ticket.released = True
+            self._in_flight[ticket.lane]['requests'] -= 1
+            self._in_flight[ticket.lane]['texts'] -= ticket.count
+            self._completed.append((now, ticket.count))
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._completed and now - self._completed[0][0] > self.rate_window:
+            self._completed.popleft()
+
+    def texts_per_second(self):
+        """Texts completed per second over the last rate_window seconds (None before anything completed)"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if not self._completed:
+                return None
+            texts = sum(count for _, count in self._completed)
+            span = max(now - self._completed[0][0], 1.0)
+        return texts / span
+
+    def retry_after(self, count, lane, fallback_rate=None, max_seconds=60):
+        """Whole seconds until count texts should fit into lane at the recent completion rate"""
+        with self._lock:
+            excess = self._in_flight_texts() + count - self._capacity(lane)
+        rate = self.texts_per_second() or fallback_rate
+        if not rate or excess <= 0:
+            return 1
+        return max(1, min(max_seconds, math.ceil(excess / rate)))
+
+    def in_flight(self):
+        """{lane: texts} being worked on, for the metrics gauge"""
+        with self._lock:
+            return {(lane,): state['texts'] for lane, state in self._in_flight.items()}
+
+    def stats(self):
+        """Limits, per-lane in-flight work and admitted/rejected counts for /health"""
+        rate = self.texts_per_second()
+        with self._lock:
+            in_flight = self._in_flight_texts()
+            lanes = {
+                lane: {**self._in_flight[lane], **self._counters[lane],
+                       'capacity': self._capacity(lane) if self.max_texts else None}
+                for lane in LANES
+            }
+        return {
+            'max_texts': self.max_texts,
+            'interactive_reserve': self.interactive_reserve,
+            'interactive_max_texts': self.interactive_max_texts,
+            'in_flight_texts': in_flight,
+            'saturated': bool(self.max_texts) and in_flight >= self._capacity("bulk"),
+            'texts_per_second': round(rate, 1) if rate else None,
+            'lanes': lanes
+        }
@@ -0,0 +1,767 @@
+"""
+HTTP client for the GPU API server (api_server.py).
+
+PredictClient keeps one pooled requests.Session, keeps several chunks in flight at once so the GPU
+never waits for a network round trip, sizes chunks from the observed server latency, retries failed
+chunks with exponential backoff (re-sending only the rows not yet received) and reassembles results
+in input order. The wire format is negotiated from /health: servers that list "binary" get gzipped
+binary bodies (wire_protocol.py) with results streamed back in frames, older servers get streamed JSON. Very large inputs can instead go
+through the server's job API (run_job), which survives client disconnects and server restarts.
+MultiEndpointClient spreads chunks over several servers, fails over and hedges slow chunks per chunk,
+and hands whatever no server could answer to a local fallback.
+Keep this file free of Streamlit imports so headless jobs can use it.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from wire_protocol import (CONTENT_TYPE_BATCH, CONTENT_TYPE_LABEL_STREAM, compress, decode_response, encode_request,
+                           iter_frames)
+
+# HTTP statuses worth retrying (overload / gateway / transient server errors)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# A server still warming up is asked again after this many seconds, whatever the health max_age
+WARMING_UP_RECHECK_SECONDS = 2.0
+
+
+class GpuApiError(Exception):
+    """GPU API call failed; partial_predictions holds the rows (in order) received before the failure"""
+
+    def __init__(self, message, partial_predictions=None):
+        super().__init__(message)
+        self.partial_predictions = partial_predictions or []
+
+
+class _ChunkFailed(Exception):
+    """A chunk ran out of retries; carries the rows it did receive"""
+
+    def __init__(self, error, received):
+        super().__init__(str(error))
+        self.error = error
+        self.received = received
+
+
+def describe_error(error):
+    """Short, user-facing description of a requests error"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return "GPU API connection timeout"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "GPU API connection failed - check if server is running and accessible"
+    return f"GPU API error: {error}"
+
+
+def read_streamed_predictions(response, on_predictions):
+    """Read an NDJSON /predict response, calling on_predictions(list) for each line as it arrives"""
+    for line in response.iter_lines():
+        if not line:
+            continue
+        message = json.loads(line)
+        if 'error' in message:
+            raise requests.exceptions.RequestException(f"Server error: {message['error']}")
+        if message.get('done'):
+            return
+        on_predictions(message['predictions'])
+    raise requests.exceptions.RequestException("Stream ended before all predictions were received")
+
+
+def read_streamed_labels(response, on_predictions):
+    """Read a binary streamed /predict response (wire_protocol.py frames), calling on_predictions per frame"""
+    for message in iter_frames(response.iter_content(chunk_size=64 * 1024)):
+        meta = message['meta']
+        if 'error' in meta:
+            raise requests.exceptions.RequestException(f"Server error: {meta['error']}")
+        if meta.get('done'):
+            return
+        on_predictions(message['labels'])
+    raise requests.exceptions.RequestException("Stream ended before all predictions were received")
+
+
+def is_ready(health):
+    """True for a health_state() result of a server that can take /predict requests right now"""
+    return health is not None and health.get('status') != 'warming_up'
+
+
+def wait_until_ready(client, timeout, max_age=30.0, poll_interval=WARMING_UP_RECHECK_SECONDS):
+    """
+    Poll client.health_state() while its server reports "warming_up", for up to timeout seconds.
+    Returns the ready health state, or None if the server went away or is still warming up.
+    """
+    deadline = time.monotonic() + timeout
+    health = client.health_state(max_age)
+    while health is not None and not is_ready(health) and time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        health = client.health_state(max_age)
+    return health if is_ready(health) else None
+
+
+def parse_endpoints(spec):
+    """'http://a:5000, http://b:5000' (commas or whitespace) -> ['http://a:5000', 'http://b:5000']"""
+    return [part.rstrip('/') for part in re.split(r"[,\s]+", spec or "") if part]
+
+
+def job_key(texts):
+    """Stable key for a list of texts, so resubmitting the same upload re-attaches to its job"""
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class PredictClient:
+    """Pipelined, pooled /predict client with adaptive chunk sizes and per-chunk retries"""
+
+    def __init__(self, endpoint, max_in_flight=2, chunk_size=2000, min_chunk_size=250, max_chunk_size=8000,
+                 target_chunk_seconds=10.0, max_retries=3, backoff=1.0, timeout=300, wire_format="auto"):
+        self.endpoint = endpoint.rstrip('/')
+        self.max_in_flight = max(1, max_in_flight)
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_chunk_seconds = target_chunk_seconds
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout  # seconds between bytes of a streamed response, not for the whole chunk
+        self.wire_format = wire_format  # "auto" (negotiated from /health), "json" or "binary"
+        self.server_wire = {}  # "wire" section of the last /health response
+        self.jobs_available = False  # server has the /jobs API enabled
+        self.server_max_texts = None  # largest /predict request the server admits (None = no limit)
+        self._health = None  # last /health JSON (None = unreachable or unhealthy)
+        self._health_checked_at = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_in_flight, 4))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._seconds_per_text = None  # moving average of observed server latency
+        self.retries = 0
+
+    def health(self, timeout=5):
+        """GET /health; returns the response (raises on connection errors) and records the server's wire formats"""
+        response = self.session.get(f"{self.endpoint}/health", timeout=timeout)
+        if response.status_code == 200:
+            try:
+                health = response.json()
+            except ValueError:
+                health = {}
+            self.server_wire = health.get('wire') or {}
+            self.jobs_available = bool(health.get('jobs'))
+            self.server_max_texts = (health.get('admission') or {}).get('max_request_texts') or None
+            # The server's tuned throughput seeds chunk sizing until real latencies have been observed
+            texts_per_second = (health.get('tuning') or {}).get('texts_per_second')
+            with self._lock:
+                if self._seconds_per_text is None and texts_per_second:
+                    self._seconds_per_text = 1 / texts_per_second
+        return response
+
+    def health_state(self, max_age=30.0, timeout=5):
+        """
+        /health JSON, or None if the server is unreachable or unhealthy. The result (either way) is reused
+        for max_age seconds, so callers can check on every rerun without paying a round trip or a timeout.
+        A server still warming up (503, status "warming_up") is returned as such (see is_ready) and
+        asked again after WARMING_UP_RECHECK_SECONDS, so callers can wait for it instead of giving up.
+        """
+        with self._lock:
+            if self._health_checked_at is not None:
+                if not is_ready(self._health):
+                    max_age = min(max_age, WARMING_UP_RECHECK_SECONDS)
+                if time.monotonic() - self._health_checked_at < max_age:
+                    return self._health
+        try:
+            response = self.health(timeout=timeout)
+            if response.status_code == 200:
+                health = response.json()
+            elif response.status_code == 503 and response.json().get('status') == 'warming_up':
+                health = response.json()
+            else:
+                health = None
+        except (requests.exceptions.RequestException, ValueError, AttributeError):
+            health = None
+        with self._lock:
+            self._health = health
+            self._health_checked_at = time.monotonic()
+        return health
+
+    def invalidate_health(self):
+        """Force the next health_state() call to ask the server again"""
+        with self._lock:
+            self._health_checked_at = None
+
+    def negotiated_format(self):
+        """Wire format for the next chunk: the configured one, or binary if the server offers it, else JSON"""
+        if self.wire_format != "auto":
+            return self.wire_format
+        return "binary" if "binary" in self.server_wire.get('formats', ()) else "json"
+
+    def can_send_tokens(self, tokenizer):
+        """Pre-tokenized requests need a server that accepts them with the same vocabulary and max_length"""
+        return (
+            tokenizer is not None
+            and self.server_wire.get('pretokenized', False)
+            and self.server_wire.get('vocab_size') == len(tokenizer)
+            and self.server_wire.get('max_length') is not None
+        )
+
+    def next_chunk_size(self):
+        """
+        Chunk size that should take about target_chunk_seconds at the observed latency,
+        never above the server's request limit
+        """
+        with self._lock:
+            seconds_per_text = self._seconds_per_text
+        if not seconds_per_text:
+            size = self.chunk_size
+        else:
+            size = max(self.min_chunk_size, min(self.max_chunk_size, int(self.target_chunk_seconds / seconds_per_text)))
+        return min(size, self.server_max_texts) if self.server_max_texts else size
+
+    def _record_latency(self, count, elapsed):
+        rate = elapsed / count
+        with self._lock:
+            if self._seconds_per_text is None:
+                self._seconds_per_text = rate
+            else:
+                self._seconds_per_text = 0.7 * self._seconds_per_text + 0.3 * rate
+
+    def _post_chunk(self, texts, on_predictions, tokenizer=None):
+        if self.negotiated_format() == "binary":
+            self._post_binary_chunk(texts, on_predictions, tokenizer)
+            return
+        response = self.session.post(
+            f"{self.endpoint}/predict",
+            json={'texts': texts, 'stream': True},
+            stream=True,
+            timeout=self.timeout
+        )
+        try:
+            response.raise_for_status()
+            if response.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+                read_streamed_predictions(response, on_predictions)
+            else:
+                # Servers without streaming answer with one JSON body
+                on_predictions(response.json()['predictions'])
+        finally:
+            response.close()
+
+    def _post_binary_chunk(self, texts, on_predictions, tokenizer=None):
+        """
+        One gzipped binary request; label ids stream back in frames as segments finish
+        (servers without binary streaming answer with a single body)
+        """
+        if self.can_send_tokens(tokenizer):
+            token_ids = tokenizer(texts, truncation=True, max_length=self.server_wire['max_length'])['input_ids']
+            body = encode_request(token_ids=token_ids, stream=True)
+        else:
+            body = encode_request(texts=texts, stream=True)
+        response = self.session.post(
+            f"{self.endpoint}/predict",
+            data=compress(body),
+            headers={
+                'Content-Type': CONTENT_TYPE_BATCH,
+                'Content-Encoding': 'gzip',
+                'Accept-Encoding': 'gzip'
+            },
+            stream=True,
+            timeout=self.timeout
+        )
+        try:
+            if response.status_code in (400, 415) and self.wire_format == "auto":
+                # Server does not understand the binary body after all: use JSON from now on
+                self.wire_format = "json"
+                raise requests.exceptions.RequestException("Binary format rejected by server, retrying as JSON")
+            response.raise_for_status()
+            if response.headers.get('Content-Type', '').startswith(CONTENT_TYPE_LABEL_STREAM):
+                read_streamed_labels(response, on_predictions)
+            else:
+                on_predictions(decode_response(response.content)['labels'])
+        finally:
+            response.close()
+
+    def _retry_delay(self, attempt, error):
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get('Retry-After', ''))
+            except ValueError:
+                pass
+        delay = self.backoff * 2 ** (attempt - 1) * (1 + random.random() * 0.25)
+        return max(delay, retry_after or 0)
+
+    def _run_chunk(self, texts, tokenizer=None):
+        """Send one chunk, retrying with backoff; only rows not yet received are re-sent"""
+        received = []
+        attempt = 0
+        while True:
+            attempt_start = time.monotonic()
+            sent = len(texts) - len(received)
+            try:
+                self._post_chunk(texts[len(received):], received.extend, tokenizer)
+                self._record_latency(sent, time.monotonic() - attempt_start)
+                return received
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    raise _ChunkFailed(e, received)
+                error = e
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if attempt >= self.max_retries:
+                    raise _ChunkFailed(e, received)
+                error = e
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            time.sleep(self._retry_delay(attempt, error))
+
+    def predict(self, texts, progress_callback=None, tokenizer=None):
+        """
+        Predict labels for texts, keeping up to max_in_flight chunks in flight.
+        With a tokenizer matching the server's (see can_send_tokens) binary chunks are sent pre-tokenized,
+        moving tokenization off the GPU server.
+        progress_callback(progress, chunk_idx, total_chunks, processed, total) is called as the
+        in-order prefix of results grows (total_chunks is an estimate while chunk sizes adapt).
+        Raises GpuApiError with the in-order partial predictions if a chunk runs out of retries.
+        """
+        total = len(texts)
+        predictions = []
+        results = {}  # offset -> predictions of finished chunks not yet in the in-order prefix
+        pending = {}  # future -> offset
+        next_offset = 0
+        chunks_done = 0
+
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="predict-client")
+        try:
+            while next_offset < total or pending:
+                while next_offset < total and len(pending) < self.max_in_flight:
+                    chunk = texts[next_offset:next_offset + self.next_chunk_size()]
+                    pending[executor.submit(self._run_chunk, chunk, tokenizer)] = next_offset
+                    next_offset += len(chunk)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset = pending.pop(future)
+                    try:
+                        results[offset] = future.result()
+                    except _ChunkFailed as e:
+                        self._collect_prefix(predictions, results)
+                        if offset == len(predictions):
+                            predictions.extend(e.received)
+                        raise GpuApiError(describe_error(e.error), predictions) from e.error
+                    chunks_done += 1
+
+                self._collect_prefix(predictions, results)
+                if progress_callback and predictions:
+                    remaining = total - next_offset
+                    total_chunks = chunks_done + len(pending) + (remaining + self.next_chunk_size() - 1) // self.next_chunk_size()
+                    progress_callback(len(predictions) / total, chunks_done, total_chunks, len(predictions), total)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return predictions
+
+    def _job_request(self, method, path, **kwargs):
+        """One /jobs call, retried with backoff on connection errors and retryable statuses"""
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, f"{self.endpoint}{path}", timeout=self.timeout, **kwargs)
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    raise
+                error = e
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            time.sleep(self._retry_delay(attempt, error))
+
+    def submit_job(self, texts, key=None, dedupe=True):
+        """POST /jobs (gzipped JSON); returns the job status, an existing job's if key matches one"""
+        body = json.dumps({'texts': texts, 'dedupe': dedupe, 'key': key}, ensure_ascii=False).encode("utf-8")
+        return self._job_request(
+            'POST',
+            '/jobs',
+            data=compress(body),
+            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        )
+
+    def job_status(self, job_id):
+        return self._job_request('GET', f"/jobs/{job_id}")
+
+    def job_results(self, job_id, offset=0, limit=None):
+        params = {'offset': offset}
+        if limit is not None:
+            params['limit'] = limit
+        return self._job_request('GET', f"/jobs/{job_id}/results", params=params)
+
+    def run_job(self, texts, progress_callback=None, key=None, poll_interval=2.0, page_size=50000):
+        """
+        Classify texts through the server's job API and return predictions in input order.
+        The job is keyed by job_key(texts), so calling this again after a disconnect or a server restart
+        re-attaches to the same job and only waits for the chunks that are still missing.
+        Finished rows are fetched while the job runs; on failure GpuApiError carries them.
+        progress_callback(progress, chunk_idx, total_chunks, processed, total) is called on every poll.
+        """
+        predictions = []
+        try:
+            job = self.submit_job(texts, key=key or job_key(texts))
+            while True:
+                while len(predictions) < job['processed']:
+                    page = self.job_results(job['job_id'], offset=len(predictions), limit=page_size)
+                    if not page['predictions']:
+                        break
+                    predictions.extend(page['predictions'])
+                if progress_callback and job['total']:
+                    progress_callback(len(predictions) / job['total'], job['completed_chunks'], job['total_chunks'],
+                                      len(predictions), job['total'])
+                if job['status'] == 'done' and len(predictions) == job['total']:
+                    return predictions
+                if job['status'] == 'failed':
+                    raise GpuApiError(f"GPU API job failed: {job.get('error')}", predictions)
+                time.sleep(poll_interval)
+                job = self.job_status(job['job_id'])
+        except requests.exceptions.RequestException as e:
+            raise GpuApiError(describe_error(e), predictions) from e
+
+    @staticmethod
+    def _collect_prefix(predictions, results):
+        """Move finished chunks that continue the in-order prefix into predictions"""
+        while len(predictions) in results:
+            predictions.extend(results.pop(len(predictions)))
+
+    def stats(self):
+        return {
+            'endpoint': self.endpoint,
+            'max_in_flight': self.max_in_flight,
+            'next_chunk_size': self.next_chunk_size(),
+            'seconds_per_text': self._seconds_per_text,
+            'retries': self.retries,
+            'wire_format': self.negotiated_format()
+        }
+
+
+class MultiEndpointClient:
+    """
+    /predict across several GPU API endpoints, one PredictClient (own session, chunk sizing, retries) each.
+
+    Chunks go to the endpoint with the most free capacity: healthy endpoints are weighted by their observed
+    throughput, discounted by the micro-batching backlog their last /health reported; endpoints that failed
+    recently are skipped for failover_cooldown seconds. When a chunk runs out of retries on one endpoint,
+    only its unanswered rows are queued again for the others. A chunk still running after the
+    hedge_percentile latency of finished chunks (scaled to its size) is also sent to a second endpoint
+    and the first answer wins. Rows no endpoint could answer go to fallback(texts) at the end.
+    Offers the same predict/run_job/health_state interface as PredictClient.
+    """
+
+    def __init__(self, endpoints, hedge_percentile=95.0, hedge_min_samples=5, failover_cooldown=30.0,
+                 health_ttl=30.0, **client_kwargs):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.clients = [PredictClient(endpoint, **client_kwargs) for endpoint in endpoints]
+        self.hedge_percentile = hedge_percentile  # 0 disables hedging
+        self.hedge_min_samples = hedge_min_samples
+        self.failover_cooldown = failover_cooldown
+        self.health_ttl = health_ttl
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)  # slots are shared by every caller of this client
+        self._in_flight = [0] * len(self.clients)
+        self._down_until = [0.0] * len(self.clients)
+        self._latencies = deque(maxlen=200)  # seconds per text of recently finished chunks
+        self.counters = [
+            {'chunks': 0, 'rows': 0, 'failures': 0, 'hedges': 0, 'hedges_won': 0} for _ in self.clients
+        ]
+        self.fallback_rows = 0
+
+    @property
+    def endpoint(self):
+        return ", ".join(client.endpoint for client in self.clients)
+
+    @property
+    def jobs_available(self):
+        return self._job_client() is not None
+
+    def health_state(self, max_age=30.0, timeout=5):
+        """
+        /health JSON of the first healthy endpoint plus an "endpoints" summary, or None if none is healthy.
+        If the only reachable endpoints are still warming up, the first of those is returned (status "warming_up").
+        Endpoints are checked in parallel and each result is cached for max_age seconds.
+        """
+        if len(self.clients) == 1:
+            states = [self.clients[0].health_state(max_age, timeout)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+                states = list(executor.map(lambda client: client.health_state(max_age, timeout), self.clients))
+        healthy = [state for state in states if is_ready(state)]
+        reachable = healthy or [state for state in states if state is not None]
+        if not reachable:
+            return None
+        return dict(
+            reachable[0],
+            endpoints=[
+                {'index': i, 'healthy': is_ready(state), 'warming_up': state is not None and not is_ready(state)}
+                for i, state in enumerate(states)
+            ],
+            healthy_endpoints=len(healthy)
+        )
+
+    def invalidate_health(self):
+        for client in self.clients:
+            client.invalidate_health()
+
+    def _available(self, index, now):
+        return is_ready(self.clients[index]._health) and now >= self._down_until[index]
+
+    def _weight(self, index):
+        """Expected texts per second of an endpoint, discounted by the backlog its last /health reported"""
+        speeds = [1 / client._seconds_per_text for client in self.clients if client._seconds_per_text]
+        client = self.clients[index]
+        # Untried endpoints get the best observed speed, so they are tried early
+        speed = 1 / client._seconds_per_text if client._seconds_per_text else max(speeds, default=1.0)
+        backlog = (client._health or {}).get('micro_batching') or {}
+        if backlog.get('max_batch_size'):
+            speed /= 1 + backlog.get('queue_texts', 0) / backlog['max_batch_size']
+        return speed
+
+    def _pick(self, exclude=None):
+        """Reserve a slot on the endpoint with the most free capacity; None if every endpoint is busy or down"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                i for i in range(len(self.clients))
+                if i != exclude and self._available(i, now) and self._in_flight[i] < self.clients[i].max_in_flight
+            ]
+            if not candidates:
+                return None
+            index = max(candidates, key=lambda i: self._weight(i) / (self._in_flight[i] + 1))
+            self._in_flight[index] += 1
+            return index
+
+    def _release(self, index):
+        with self._slot_freed:
+            self._in_flight[index] -= 1
+            self._slot_freed.notify_all()
+
+    def _wait_for_slot(self, timeout=1.0):
+        """
+        Block until some endpoint has a free slot (True) - other callers may hold them all - or until
+        none is healthy any more (False). Rechecked every timeout seconds, as cooldowns expire on their own.
+        """
+        with self._slot_freed:
+            while True:
+                now = time.monotonic()
+                available = [i for i in range(len(self.clients)) if self._available(i, now)]
+                if not available:
+                    return False
+                if any(self._in_flight[i] < self.clients[i].max_in_flight for i in available):
+                    return True
+                self._slot_freed.wait(timeout)
+
+    def _mark_down(self, index):
+        with self._lock:
+            self._down_until[index] = time.monotonic() + self.failover_cooldown
+            self.counters[index]['failures'] += 1
+        self.clients[index].invalidate_health()
+
+    def _hedge_deadline(self, rows):
+        """Seconds after which a chunk of this many rows is hedged, or None while there are too few samples"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not self.hedge_percentile or len(self.clients) < 2 or len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))] * rows
+
+    def predict(self, texts, progress_callback=None, tokenizer=None, fallback=None):
+        """
+        Predict labels for texts across the endpoints, in input order.
+        fallback(texts) -> predictions classifies the rows no endpoint answered (e.g. local CPU inference);
+        without it GpuApiError is raised with the in-order partial predictions.
+        progress_callback(progress, chunk_idx, total_chunks, processed, total) is called as chunks finish.
+        """
+        total = len(texts)
+        self.health_state(self.health_ttl)
+        predictions = []
+        results = {}  # offset -> predictions of answered rows not yet in the in-order prefix
+        requeued = deque()  # (offset, length) of rows whose endpoint failed
+        running = {}  # future -> (offset, length, endpoint, started, is_hedge)
+        copies = {}  # offset -> futures still running for an unanswered chunk
+        next_offset = 0
+        answered = 0
+        chunks_done = 0
+        last_error = None
+
+        executor = ThreadPoolExecutor(
+            max_workers=2 * sum(client.max_in_flight for client in self.clients),
+            thread_name_prefix="predict-pool"
+        )
+
+        def submit(offset, length, endpoint, is_hedge=False):
+            chunk = texts[offset:offset + length]
+            future = executor.submit(self.clients[endpoint]._run_chunk, chunk, tokenizer)
+            running[future] = (offset, length, endpoint, time.monotonic(), is_hedge)
+            copies[offset] = copies.get(offset, 0) + 1
+
+        def drop_losers(offset):
+            # Other copies of an answered chunk are not waited for; each frees its slot when it really
+            # ends (at once if it already has), so waiting for a slot never stalls on a finished loser
+            for future, entry in list(running.items()):
+                if entry[0] == offset:
+                    del running[future]
+                    future.add_done_callback(lambda _, endpoint=entry[2]: self._release(endpoint))
+
+        try:
+            while True:
+                # Fill free endpoint slots: failed rows first, then new chunks
+                while requeued or next_offset < total:
+                    endpoint = self._pick()
+                    if endpoint is None:
+                        break
+                    if requeued:
+                        offset, length = requeued.popleft()
+                    else:
+                        offset = next_offset
+                        length = min(self.clients[endpoint].next_chunk_size(), total - next_offset)
+                        next_offset += length
+                    submit(offset, length, endpoint)
+
+                # Hedge chunks running past the latency percentile on a different endpoint
+                now = time.monotonic()
+                hedged = {entry[0] for entry in running.values() if entry[4]}
+                for offset, length, endpoint, started, is_hedge in list(running.values()):
+                    if is_hedge or offset in hedged:
+                        continue
+                    deadline = self._hedge_deadline(length)
+                    if deadline is None or now - started < deadline:
+                        continue
+                    other = self._pick(exclude=endpoint)
+                    if other is None:
+                        break
+                    submit(offset, length, other, is_hedge=True)
+                    hedged.add(offset)
+                    with self._lock:
+                        self.counters[other]['hedges'] += 1
+
+                if not copies:
+                    if not requeued and next_offset >= total:
+                        break  # every row answered
+                    # Rows left but no slot: wait while a healthy endpoint is only busy with other callers
+                    if not self._wait_for_slot():
+                        break  # no endpoint left for the rest
+                    continue
+
+                hedging = self.hedge_percentile and len(self.clients) > 1
+                done, _ = wait(running, timeout=0.25 if hedging else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset, length, endpoint, started, is_hedge = running.pop(future)
+                    self._release(endpoint)
+                    copies[offset] -= 1
+                    try:
+                        received = future.result()
+                    except _ChunkFailed as e:
+                        last_error = e.error
+                        self._mark_down(endpoint)
+                        if copies[offset]:
+                            continue  # its other copy may still answer
+                        del copies[offset]
+                        # Keep the rows this endpoint did answer, queue only the rest for the others
+                        if e.received:
+                            results[offset] = e.received
+                            answered += len(e.received)
+                        requeued.append((offset + len(e.received), length - len(e.received)))
+                        continue
+                    del copies[offset]
+                    drop_losers(offset)
+                    results[offset] = received
+                    answered += length
+                    chunks_done += 1
+                    with self._lock:
+                        self._latencies.append((time.monotonic() - started) / length)
+                        self.counters[endpoint]['chunks'] += 1
+                        self.counters[endpoint]['rows'] += length
+                        if is_hedge:
+                            self.counters[endpoint]['hedges_won'] += 1
+
+                self._collect_prefix(predictions, results)
+                if progress_callback and answered:
+                    chunk_size = self.clients[0].next_chunk_size()
+                    total_chunks = chunks_done + len(copies) + (total - answered + chunk_size - 1) // chunk_size
+                    progress_callback(answered / total, chunks_done, total_chunks, answered, total)
+
+            # Rows no endpoint could take
+            remaining = list(requeued)
+            if next_offset < total:
+                remaining.append((next_offset, total - next_offset))
+            if remaining:
+                if fallback is None:
+                    self._collect_prefix(predictions, results)
+                    message = describe_error(last_error) if last_error is not None else "No GPU API endpoint available"
+                    raise GpuApiError(message, predictions)
+                remaining_texts = [text for offset, length in remaining for text in texts[offset:offset + length]]
+                fallback_predictions = fallback(remaining_texts)
+                position = 0
+                for offset, length in remaining:
+                    results[offset] = fallback_predictions[position:position + length]
+                    position += length
+                with self._lock:
+                    self.fallback_rows += len(remaining_texts)
+                self._collect_prefix(predictions, results)
+        finally:
+            # Chunks still running when predict gives up finish in the background and are ignored;
+            # their slots are released when they really end
+            for future, entry in running.items():
+                future.add_done_callback(lambda _, endpoint=entry[2]: self._release(endpoint))
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return predictions
+
+    def _job_client(self):
+        """First healthy endpoint offering the job API (a job lives on the server it was submitted to)"""
+        now = time.monotonic()
+        for index, client in enumerate(self.clients):
+            if self._available(index, now) and client.jobs_available:
+                return client
+        return None
+
+    def run_job(self, texts, progress_callback=None, key=None, poll_interval=2.0, page_size=50000):
+        """PredictClient.run_job on the first healthy endpoint with the job API"""
+        client = self._job_client()
+        if client is None:
+            raise GpuApiError("No GPU API endpoint offers the job API")
+        return client.run_job(texts, progress_callback, key=key, poll_interval=poll_interval, page_size=page_size)
+
+    _collect_prefix = staticmethod(PredictClient._collect_prefix)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'endpoints': [
+                    dict(
+                        client.stats(),
+                        endpoint=index,
+                        available=self._available(index, now),
+                        in_flight=self._in_flight[index],
+                        **self.counters[index]
+                    )
+                    for index, client in enumerate(self.clients)
+                ],
+                'hedge_percentile': self.hedge_percentile,
+                'fallback_rows': self.fallback_rows
+            }
@@ -5,20 +5,39 @@ Deploy this on vast.ai GPU server to handle predictions with GPU acceleration.
 Setup:
 1. SSH into vast.ai GPU server: ssh -p 54754 root@143.55.45.86
 2. Install dependencies: pip install flask transformers torch
-3. Run: python api_server.py
-4. API will be available at: http://143.55.45.86:5000
+3. Upload batching.py, inference.py, prediction_cache.py, micro_batching.py, metrics.py, wire_protocol.py, jobs.py, cascade.py, warmup.py, replicas.py, autotune.py, low_memory.py, admission.py and onnx_backend.py next to api_server.py
+4. Run: python api_server.py (CPU host, several replicas sharing one copy of the weights: python replicas.py --workers 4)
+5. API will be available at: http://143.55.45.86:5000
 
 Note: If you rent a new GPU, update:
 - IP address in this file (API_HOST)
 - IP address in Streamlit Cloud environment variable (GPU_API_ENDPOINT)
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
+import json
 import os
+import threading
 import time
+import traceback
+
+from batching import dedupe_texts, expand_predictions, dedup_ratio, batch_shapes
+from inference import predict_labels
+from prediction_cache import PredictionCache
+from micro_batching import MicroBatcher
+from metrics import Registry, CONTENT_TYPE, SIZE_BUCKETS, BYTES_BUCKETS, RATIO_BUCKETS
+from jobs import JobManager, JobStore
+from cascade import NgramClassifier, run_cascade
+from admission import LANES, AdmissionController
+from autotune import DEFAULT_TOKEN_BUDGETS, autotune, load_settings, save_settings, tuning_key
+from onnx_backend import BACKENDS
+from replicas import take_preloaded
+from warmup import COMPILE_MODES, DEFAULT_LENGTH_BUCKETS, compile_model, parse_length_buckets, warmup
+from wire_protocol import (CONTENT_TYPE_BATCH, CONTENT_TYPE_LABEL_STREAM, CONTENT_TYPE_LABELS, WIRE_FORMATS, compress,
+                           decompress, decode_request, encode_frame, encode_response)
 
 app = Flask(__name__)
 CORS(app)  # Allow cross-origin requests from Streamlit Cloud
@@ -26,101 +45,708 @@ CORS(app)  # Allow cross-origin requests from Streamlit Cloud
 # Configuration
 MODEL_NAME = "aluha501/xlm-roberta-base-fabric"
 VALID_LABELS = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+LABEL_IDS = {label: label_id for label_id, label in enumerate(VALID_LABELS)}
+MODEL_REVISION = os.getenv("MODEL_REVISION", "main")
 MAX_LENGTH = 128
 BATCH_SIZE = 128  # Larger batch size for GPU (increased for better throughput)
+LENGTH_BUCKETING = os.getenv("LENGTH_BUCKETING", "1").lower() in ("1", "true", "yes")  # Batch texts of similar token length together
+MAX_BATCH_TOKENS = int(os.getenv("MAX_BATCH_TOKENS", "0"))  # Padded-token budget per batch (0 = use BATCH_SIZE only)
+PREFETCH_BATCHES = int(os.getenv("PREFETCH_BATCHES", "2"))  # Batches tokenized ahead by a background thread (0 = inline)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "pytorch").lower()  # "pytorch", "onnx" or "onnx-int8" (CPU, see onnx_backend.py)
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "1").lower() in ("1", "true", "yes")  # Coalesce concurrent requests in one inference queue
+MICRO_BATCH_MAX_TEXTS = int(os.getenv("MICRO_BATCH_MAX_TEXTS", "0"))  # Texts per coalesced batch (0 = 4 x the tuned BATCH_SIZE)
+MICRO_BATCH_WAIT_MS = float(os.getenv("MICRO_BATCH_WAIT_MS", "5"))  # Max wait for more texts before running a partial batch
+STREAM_SEGMENT_SIZE = int(os.getenv("STREAM_SEGMENT_SIZE", "0"))  # Unique texts per streamed segment (0 = 2 x the tuned BATCH_SIZE)
+WARMUP = os.getenv("WARMUP", "1").lower() in ("1", "true", "yes")  # Run every batch shape once before reporting ready
+COMPILE_MODE = os.getenv("COMPILE_MODE", "none").lower()  # "none", "compile" (torch.compile) or "trace" (TorchScript per shape)
+SHAPE_BUCKETS = os.getenv("SHAPE_BUCKETS", "")  # Padded lengths batches snap to, e.g. "16,32,64" (default with COMPILE_MODE: 16,32,64,128)
+AUTOTUNE = os.getenv("AUTOTUNE", "0").lower()  # "1": probe batch sizes at startup if nothing is stored for this device/model, "force": always
+AUTOTUNE_TOKEN_BUDGET = os.getenv("AUTOTUNE_TOKEN_BUDGET", "0").lower() in ("1", "true", "yes")  # Tune a padded-token cap instead of a row count
+MAX_REQUEST_TEXTS = int(os.getenv("MAX_REQUEST_TEXTS", "20000"))  # Larger /predict requests get 413 (split them or use /jobs); 0 = no limit
+MAX_REQUEST_MB = float(os.getenv("MAX_REQUEST_MB", "64"))  # /predict body size limit as sent (compressed); 0 = no limit
+ADMISSION_MAX_TEXTS = int(os.getenv("ADMISSION_MAX_TEXTS", "50000"))  # Texts in flight across /predict requests before 429 + Retry-After (0 = no cap)
+INTERACTIVE_MAX_TEXTS = int(os.getenv("INTERACTIVE_MAX_TEXTS", "256"))  # Requests up to this size take the interactive lane
+INTERACTIVE_RESERVE_TEXTS = int(os.getenv("INTERACTIVE_RESERVE_TEXTS", "2048"))  # In-flight capacity kept free of bulk requests
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # gzip binary responses at least this big if the client accepts it
 API_HOST = "0.0.0.0"  # Listen on all interfaces
 API_PORT = 5000  # API port (use port forwarding if needed)
+PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH", ".cache/prediction_cache.sqlite3")  # Empty string disables the cache
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "5000000"))
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH", ".cache/cascade.npz")  # n-gram model from `python cascade.py train`
+CASCADE_DEFAULT = os.getenv("CASCADE_DEFAULT", "0").lower() in ("1", "true", "yes")  # Use the cascade when requests don't say
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0"))  # 0 = threshold calibrated at training time
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", "0.02"))  # Share of cascade answers re-checked by the transformer
+JOB_DIR = os.getenv("JOB_DIR", ".cache/jobs")  # Checkpoints of async jobs (/jobs); empty string disables the job API
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "5000"))  # Texts per checkpointed job chunk
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))  # Finished jobs are deleted after this long
+
+if INFERENCE_BACKEND not in BACKENDS:
+    print(f"⚠️ Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}', using pytorch")
+    INFERENCE_BACKEND = "pytorch"
 
-# Check GPU availability
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Check GPU availability (the ONNX backends always run on CPU)
+device = torch.device("cuda" if torch.cuda.is_available() and INFERENCE_BACKEND == "pytorch" else "cpu")
 print(f"🚀 Initializing API Server...")
 print(f"📱 Using device: {device}")
 if torch.cuda.is_available():
     print(f"🎮 GPU: {torch.cuda.get_device_name(0)}")
     print(f"💾 GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.2f} GB")
 
-# Load model on GPU
-print(f"📥 Loading model: {MODEL_NAME}...")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-model = model.to(device)
-model.eval()
+def load_pytorch_model():
+    print(f"📥 Loading model: {MODEL_NAME}...")
+    pytorch_model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    pytorch_model.eval()
+    return pytorch_model
+
+# Load model on GPU (or take the copy shared by replicas.py when running as one of its replicas).
+# The ONNX backends only need the PyTorch weights to export them, so those load them lazily.
+preloaded = take_preloaded()
+if preloaded is not None:
+    tokenizer, model = preloaded
+    print(f"♻️ Using the weights shared by replicas.py: {MODEL_NAME}")
+else:
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    model = load_pytorch_model() if INFERENCE_BACKEND == "pytorch" else None
+del preloaded
 
+if INFERENCE_BACKEND in ("onnx", "onnx-int8"):
+    # ONNX Runtime on CPU, exported (and quantized) on first start
+    from onnx_backend import load_onnx_classifier
+    pytorch_model = model
+    model = load_onnx_classifier(
+        tokenizer,
+        lambda: pytorch_model if pytorch_model is not None else load_pytorch_model(),
+        MODEL_NAME,
+        MODEL_REVISION,
+        quantize=INFERENCE_BACKEND == "onnx-int8"
+    )
+    del pytorch_model
+    print(f"✅ Model loaded with {INFERENCE_BACKEND} backend ({model.path})")
 # Use half precision (FP16) for faster inference if GPU supports it
-if torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+elif torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+    model = model.to(device)
     try:
         model = model.half()  # Use FP16 for faster inference
         print(f"✅ Model loaded with FP16 precision for faster inference")
     except Exception as e:
         print(f"⚠️ Could not use FP16, using FP32: {e}")
 else:
+    model = model.to(device)
     print(f"✅ Model loaded successfully on {device}")
 
+# Autotune probes the uncompiled model, so POST /autotune never recompiles the serving graph at new shapes
+eager_model = model
+
+# Batch settings tuned for this device and model (autotune.py) replace the defaults above;
+# an explicit MAX_BATCH_TOKENS still wins
+TUNING_KEY = tuning_key(device, MODEL_NAME, MODEL_REVISION, INFERENCE_BACKEND, MAX_LENGTH)
+tuning_report = {'status': 'default', 'key': TUNING_KEY}
+
+def apply_tuning(settings, source):
+    global BATCH_SIZE, MAX_BATCH_TOKENS
+    BATCH_SIZE = settings['batch_size']
+    if settings.get('max_tokens') and not os.getenv("MAX_BATCH_TOKENS"):
+        MAX_BATCH_TOKENS = settings['max_tokens']
+    size_from_batch()
+    tuning_report.update(
+        status=source,
+        batch_size=BATCH_SIZE,
+        max_tokens=MAX_BATCH_TOKENS,
+        texts_per_second=settings['texts_per_second'],
+        peak_memory_mb=settings['peak_memory_mb'],
+        tuned_at=settings.get('tuned_at')
+    )
+    print(f"🔧 Batch settings ({source}): batch_size={BATCH_SIZE}, max_tokens={MAX_BATCH_TOKENS}, "
+          f"{settings['texts_per_second']:,.0f} texts/s")
+
+def size_from_batch():
+    """Micro-batch and stream segment sizes follow BATCH_SIZE unless set explicitly"""
+    global MICRO_BATCH_MAX_TEXTS, STREAM_SEGMENT_SIZE
+    MICRO_BATCH_MAX_TEXTS = int(os.getenv("MICRO_BATCH_MAX_TEXTS", "0")) or BATCH_SIZE * 4
+    STREAM_SEGMENT_SIZE = int(os.getenv("STREAM_SEGMENT_SIZE", "0")) or BATCH_SIZE * 2
+
+def run_autotune():
+    settings = autotune(
+        tokenizer,
+        eager_model,
+        VALID_LABELS,
+        max_length=MAX_LENGTH,
+        token_budgets=DEFAULT_TOKEN_BUDGETS if AUTOTUNE_TOKEN_BUDGET else None
+    )
+    save_settings(TUNING_KEY, settings)
+    return settings
+
+stored_tuning = load_settings(TUNING_KEY) if AUTOTUNE != "force" else None
+if stored_tuning is not None:
+    apply_tuning(stored_tuning, 'stored')
+elif AUTOTUNE in ("1", "true", "yes", "force"):
+    print("🔧 Autotuning batch size for this device...")
+    try:
+        apply_tuning(run_autotune(), 'probed')
+    except Exception as e:
+        traceback.print_exc()
+        tuning_report.update(status='failed', error=str(e))
+        print(f"⚠️ Autotune failed, using BATCH_SIZE={BATCH_SIZE}: {e}")
+del stored_tuning
+size_from_batch()
+
+# Fixed batch shapes: with a compiled model (or SHAPE_BUCKETS) every batch is snapped to one of
+# these (rows, padded length) shapes, so nothing is compiled after startup
+if COMPILE_MODE not in COMPILE_MODES:
+    print(f"⚠️ Unknown COMPILE_MODE '{COMPILE_MODE}', using none")
+    COMPILE_MODE = "none"
+if COMPILE_MODE != "none" and INFERENCE_BACKEND != "pytorch":
+    print(f"⚠️ COMPILE_MODE={COMPILE_MODE} only applies to the pytorch backend, using none")
+    COMPILE_MODE = "none"
+serving_shapes = None
+if SHAPE_BUCKETS or COMPILE_MODE != "none":
+    serving_shapes = batch_shapes(
+        parse_length_buckets(SHAPE_BUCKETS or ",".join(map(str, DEFAULT_LENGTH_BUCKETS)), MAX_LENGTH),
+        BATCH_SIZE,
+        MAX_BATCH_TOKENS
+    )
+
+# Set once the model is compiled and warmed up; /health reports "warming_up" (503) until then
+model_ready = threading.Event()
+warmup_report = {'status': 'pending' if WARMUP or COMPILE_MODE != "none" else 'skipped'}
+
+def prepare_model():
+    """Compile the model for the serving shapes (if asked) and run each shape once, then mark the server ready"""
+    global model
+    start_time = time.time()
+    try:
+        warmup_report['status'] = 'running'
+        model = compile_model(model, tokenizer, COMPILE_MODE, serving_shapes, device)
+        if WARMUP or COMPILE_MODE != "none":
+            shapes = serving_shapes or batch_shapes(
+                parse_length_buckets(",".join(map(str, DEFAULT_LENGTH_BUCKETS)), MAX_LENGTH),
+                BATCH_SIZE,
+                MAX_BATCH_TOKENS
+            )
+            warmup_report['first_run_seconds'] = warmup(model, tokenizer, shapes, device)
+        warmup_report['status'] = 'done'
+        print(f"🔥 Warmup done in {time.time() - start_time:.1f}s (compile: {COMPILE_MODE})")
+    except Exception as e:
+        # Serving eagerly beats not serving at all
+        traceback.print_exc()
+        warmup_report.update(status='failed', error=str(e))
+        print(f"⚠️ Warmup failed, serving without it: {e}")
+    warmup_report['seconds'] = round(time.time() - start_time, 2)
+    model_ready.set()
+
+if warmup_report['status'] == 'pending':
+    threading.Thread(target=prepare_model, name="warmup", daemon=True).start()
+else:
+    model_ready.set()
+
+# Persistent prediction cache (optional - server works without it)
+prediction_cache = None
+if PREDICTION_CACHE_PATH:
+    try:
+        prediction_cache = PredictionCache(
+            PREDICTION_CACHE_PATH,
+            model_name=MODEL_NAME,
+            revision=MODEL_REVISION,
+            backend=INFERENCE_BACKEND,
+            max_length=MAX_LENGTH,
+            max_entries=PREDICTION_CACHE_MAX_ENTRIES
+        )
+        print(f"💾 Prediction cache: {PREDICTION_CACHE_PATH}")
+    except Exception as e:
+        print(f"⚠️ Prediction cache disabled: {e}")
+
+# Prometheus-style metrics, scraped from /metrics
+metrics = Registry()
+REQUESTS = metrics.counter('classifier_requests_total', 'Prediction requests received', ('endpoint', 'mode'))
+REQUEST_ERRORS = metrics.counter('classifier_request_errors_total', 'Prediction requests that failed', ('endpoint', 'kind'))
+REQUEST_LATENCY = metrics.histogram('classifier_request_seconds', 'End-to-end request latency', ('endpoint', 'mode'))
+REQUEST_TEXTS = metrics.histogram('classifier_request_texts', 'Texts per request', ('endpoint',), buckets=SIZE_BUCKETS)
+REQUEST_BYTES = metrics.histogram('classifier_request_bytes', 'Request body size', ('endpoint',), buckets=BYTES_BUCKETS)
+STAGE_LATENCY = metrics.histogram('classifier_stage_seconds', 'Per-batch tokenize/transfer/forward time and per-response serialize time', ('stage',))
+TEXTS_ANSWERED = metrics.counter('classifier_texts_total', 'Texts answered, by where the label came from', ('source',))
+THROUGHPUT = metrics.gauge('classifier_last_request_texts_per_second', 'Throughput of the most recent non-streamed request')
+BATCH_FILL = metrics.histogram('classifier_micro_batch_fill_ratio', 'Coalesced batch size / MICRO_BATCH_MAX_TEXTS', buckets=RATIO_BUCKETS)
+QUEUE_WAIT = metrics.histogram('classifier_queue_wait_seconds', 'Time a request waited in the micro-batching queue')
+REJECTED = metrics.counter('classifier_rejected_requests_total', 'Requests turned away before any work (413 too large, 429 busy)', ('lane', 'reason'))
+
+# Admission control: bounded in-flight work, priority lanes, 429 + Retry-After when saturated (admission.py)
+admission = AdmissionController(
+    ADMISSION_MAX_TEXTS,
+    interactive_reserve=INTERACTIVE_RESERVE_TEXTS,
+    interactive_max_texts=INTERACTIVE_MAX_TEXTS
+)
+metrics.gauge('classifier_in_flight_texts', 'Texts admitted and not yet answered', ('lane',), callback=admission.in_flight)
+
+def observe_stage(stage, seconds):
+    STAGE_LATENCY.observe(seconds, stage=stage)
+
+def gpu_memory_bytes():
+    if not torch.cuda.is_available():
+        return {}
+    return {
+        ('allocated',): torch.cuda.memory_allocated(0),
+        ('reserved',): torch.cuda.memory_reserved(0),
+        ('max_allocated',): torch.cuda.max_memory_allocated(0)
+    }
+
+metrics.gauge('classifier_gpu_memory_bytes', 'CUDA memory held by the model process', ('kind',), callback=gpu_memory_bytes)
+
+# Confidence-gated cascade (optional - only if a trained n-gram model is present)
+cascade_classifier = None
+if CASCADE_MODEL_PATH and os.path.exists(CASCADE_MODEL_PATH):
+    try:
+        cascade_classifier = NgramClassifier.load(CASCADE_MODEL_PATH)
+        print(f"🪜 Cascade model loaded ({CASCADE_MODEL_PATH}, threshold {CASCADE_THRESHOLD or cascade_classifier.threshold:.4f})")
+    except Exception as e:
+        print(f"⚠️ Cascade disabled: {e}")
+
+def print_progress(progress, batch_idx, total_batches, processed, total):
+    if batch_idx % 10 == 0:
+        print(f"  Processed {batch_idx}/{total_batches} batches ({processed}/{total} texts)")
+
+def predict_texts(texts):
+    """
+    Run the model over texts (length-bucketed if enabled) and return (label, probabilities) per text in input order.
+    Rows may be token id tuples from clients that tokenize themselves.
+    Blocks until startup warmup has finished.
+    """
+    model_ready.wait()
+    timings = {}
+    probabilities = []
+    predictions = predict_labels(
+        texts,
+        tokenizer,
+        model,
+        VALID_LABELS,
+        batch_size=BATCH_SIZE,
+        max_length=MAX_LENGTH,
+        length_bucketing=LENGTH_BUCKETING,
+        max_tokens=MAX_BATCH_TOKENS,
+        prefetch=PREFETCH_BATCHES,
+        progress_callback=print_progress,
+        timings=timings,
+        observer=observe_stage,
+        probabilities=probabilities,
+        shapes=serving_shapes
+    )
+    TEXTS_ANSWERED.inc(len(texts), source='model')
+    if texts:
+        print(f"⏱️ Tokenize {timings['tokenize_seconds']:.2f}s ({timings['overlap_ratio']*100:.0f}% overlapped), "
+              f"model {timings['model_seconds']:.2f}s, waited {timings['wait_seconds']:.2f}s")
+    return list(zip(predictions, probabilities))
+
+# Central inference queue: one worker thread runs the model for all concurrent requests
+micro_batcher = None
+
+def observe_micro_batch(taken, fill_ratio, queue_waits):
+    BATCH_FILL.observe(fill_ratio)
+    for wait in queue_waits:
+        QUEUE_WAIT.observe(wait)
+
+if MICRO_BATCHING:
+    micro_batcher = MicroBatcher(
+        predict_texts,
+        max_batch_size=MICRO_BATCH_MAX_TEXTS,
+        max_wait=MICRO_BATCH_WAIT_MS / 1000,
+        on_batch=observe_micro_batch,
+        lanes=LANES
+    )
+    metrics.gauge(
+        'classifier_queue_texts',
+        'Texts waiting in the micro-batching queue',
+        callback=lambda: micro_batcher.stats()['queue_texts']
+    )
+    print(f"🧺 Micro-batching enabled (up to {MICRO_BATCH_MAX_TEXTS} texts, {MICRO_BATCH_WAIT_MS:.0f} ms max wait)")
+
+def lookup_and_predict(texts, with_probabilities=False, lane="bulk"):
+    """
+    Answer cached texts from the prediction cache and run the model on the rest; returns (predictions, cache_hits).
+    With with_probabilities each prediction is a (label, probabilities) pair and cache lookups are skipped,
+    since the cache only stores labels. Pre-tokenized rows have no text to key on and bypass the cache.
+    lane is the micro-batching queue the texts wait in (interactive ones are batched first).
+    """
+    use_cache = prediction_cache is not None and all(isinstance(text, str) for text in texts)
+    label_by_text = prediction_cache.get_many(texts) if use_cache and not with_probabilities else {}
+    texts_to_predict = [text for text in texts if text not in label_by_text]
+    
+    if micro_batcher is not None:
+        rows = micro_batcher.submit(texts_to_predict, lane).result()
+    else:
+        rows = predict_texts(texts_to_predict)
+    predictions = [label for label, _ in rows]
+    
+    if use_cache and texts_to_predict:
+        prediction_cache.put_many(zip(texts_to_predict, predictions))
+    TEXTS_ANSWERED.inc(len(texts) - len(texts_to_predict), source='cache')
+    if with_probabilities:
+        row_by_text = dict(zip(texts_to_predict, rows))
+        return [row_by_text[text] for text in texts], 0
+    label_by_text.update(zip(texts_to_predict, predictions))
+    return [label_by_text[text] for text in texts], len(texts) - len(texts_to_predict)
+
+def cascade_and_predict(texts, stats, lane="bulk"):
+    """
+    Let the n-gram model answer the texts it is confident about and send the rest through lookup_and_predict.
+    Returns (predictions, cache_hits); stats['cascade'] receives the escalation rate and audited agreement.
+    """
+    cache_hits = []
+    
+    def escalate(escalated_texts):
+        predictions, hits = lookup_and_predict(escalated_texts, lane=lane)
+        cache_hits.append(hits)
+        return predictions
+    
+    predictions = run_cascade(
+        texts,
+        cascade_classifier,
+        escalate,
+        threshold=CASCADE_THRESHOLD or None,
+        audit_rate=CASCADE_AUDIT_RATE,
+        stats=stats
+    )
+    cascade_stats = stats['cascade']
+    TEXTS_ANSWERED.inc(cascade_stats['rows'] - cascade_stats['escalated'] - cascade_stats['audited'], source='cascade')
+    print(f"🪜 Cascade escalated {cascade_stats['escalated']}/{cascade_stats['rows']} texts "
+          f"({cascade_stats['escalation_rate']*100:.1f}%), agreement {cascade_stats['agreement']}")
+    return predictions, sum(cache_hits)
+
+def split_unique(texts, dedupe):
+    """Collapse identical texts so each one costs a single forward pass; returns (unique_texts, inverse)"""
+    if not dedupe:
+        return texts, list(range(len(texts)))
+    unique_texts, inverse = dedupe_texts(texts)
+    TEXTS_ANSWERED.inc(len(texts) - len(unique_texts), source='dedup')
+    print(f"🔁 {len(unique_texts)} unique texts ({dedup_ratio(len(texts), len(unique_texts))*100:.1f}% duplicates)")
+    return unique_texts, inverse
+
+def predict_job_chunk(texts, dedupe):
+    """One checkpointed chunk of an async job: same dedupe/cache/micro-batching path as /predict"""
+    unique_texts, inverse = split_unique(texts, dedupe)
+    unique_predictions, _ = lookup_and_predict(unique_texts)
+    return expand_predictions(unique_predictions, inverse)
+
+# Async job API: chunks are checkpointed to JOB_DIR, unfinished jobs resume after a restart
+job_manager = None
+if JOB_DIR:
+    try:
+        job_manager = JobManager(
+            JobStore(JOB_DIR),
+            predict_job_chunk,
+            chunk_size=JOB_CHUNK_SIZE,
+            retention_seconds=JOB_RETENTION_HOURS * 3600
+        )
+        resumed = job_manager.start()
+        print(f"🗂️ Job API enabled ({JOB_DIR}){f', resuming {resumed} jobs' if resumed else ''}")
+    except Exception as e:
+        job_manager = None
+        print(f"⚠️ Job API disabled: {e}")
+
+def ndjson_line(payload):
+    start = time.perf_counter()
+    line = json.dumps(payload, ensure_ascii=False) + "\n"
+    observe_stage('serialize', time.perf_counter() - start)
+    return line
+
+def binary_frame(payload):
+    """A stream_predictions message as a wire_protocol.py frame: predictions become label ids, the rest meta"""
+    start = time.perf_counter()
+    meta = {key: value for key, value in payload.items() if key != 'predictions'}
+    labels = payload.get('predictions', ())
+    frame = encode_frame(encode_response([LABEL_IDS[label] for label in labels], VALID_LABELS, meta=meta))
+    observe_stage('serialize', time.perf_counter() - start)
+    return frame
+
+def stream_predictions(texts, dedupe, lane, ticket, encode=ndjson_line):
+    """
+    Yield messages while inference runs: {"offset", "predictions"} for each ready prefix of rows,
+    then {"done": true, ...} - or {"error", "offset"} if inference fails part-way.
+    encode turns each message into NDJSON lines (ndjson_line) or binary frames (binary_frame).
+    Unique texts are classified in first-seen order, so every finished segment completes a prefix of rows.
+    The admission ticket is released when the stream ends or the client goes away.
+    """
+    start_time = time.time()
+    emitted = 0
+    try:
+        unique_texts, inverse = split_unique(texts, dedupe)
+        unique_predictions = []
+        cache_hits = 0
+        
+        for seg_start in range(0, len(unique_texts), STREAM_SEGMENT_SIZE):
+            segment_predictions, segment_hits = lookup_and_predict(
+                unique_texts[seg_start:seg_start + STREAM_SEGMENT_SIZE],
+                lane=lane
+            )
+            unique_predictions.extend(segment_predictions)
+            cache_hits += segment_hits
+            
+            ready = emitted
+            while ready < len(texts) and inverse[ready] < len(unique_predictions):
+                ready += 1
+            if ready > emitted:
+                yield encode({
+                    'offset': emitted,
+                    'predictions': [unique_predictions[inverse[i]] for i in range(emitted, ready)]
+                })
+                emitted = ready
+        
+        elapsed_time = time.time() - start_time
+        print(f"✅ Completed streamed prediction in {elapsed_time:.2f}s ({len(texts)/elapsed_time:.1f} texts/sec)")
+        REQUEST_LATENCY.observe(elapsed_time, endpoint='/predict', mode='stream')
+        yield encode({
+            'done': True,
+            'count': len(texts),
+            'unique_count': len(unique_texts),
+            'dedup_ratio': round(dedup_ratio(len(texts), len(unique_texts)), 4),
+            'cache_hits': cache_hits,
+            'processing_time': round(elapsed_time, 2)
+        })
+    except Exception as e:
+        traceback.print_exc()
+        REQUEST_ERRORS.inc(endpoint='/predict', kind='inference')
+        yield encode({'error': str(e), 'offset': emitted})
+    finally:
+        admission.release(ticket)
+
+def read_predict_request():
+    """Parse a JSON or binary (wire_protocol.py) /predict body, undoing any Content-Encoding; returns (data, wire_format)"""
+    body = decompress(request.get_data(), request.headers.get('Content-Encoding'))
+    if request.mimetype == CONTENT_TYPE_BATCH:
+        return decode_request(body), 'binary'
+    data = json.loads(body) if body else {}
+    if isinstance(data, dict) and isinstance(data.get('token_ids'), list):
+        data['token_ids'] = [tuple(ids) for ids in data['token_ids']]
+    return data, 'json'
+
+def binary_response(predictions, with_probabilities, meta):
+    """Label ids (+ float16 probabilities) in the wire_protocol.py format, gzipped if the client accepts it"""
+    labels = [label for label, _ in predictions] if with_probabilities else predictions
+    body = encode_response(
+        [LABEL_IDS[label] for label in labels],
+        VALID_LABELS,
+        probabilities=[row for _, row in predictions] if with_probabilities else None,
+        meta=meta
+    )
+    response = Response(body, content_type=CONTENT_TYPE_LABELS)
+    if len(body) >= COMPRESS_MIN_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/predict', methods=['POST'])
 def predict():
-    """Predict labels for a batch of texts"""
+    """
+    Predict labels for a batch of texts.
+    The body is JSON ({"texts": [...]} or pre-tokenized {"token_ids": [[...], ...]}) or the binary
+    wire_protocol.py format, optionally gzip-compressed. Binary requests get label ids back, with
+    float16 probabilities if asked for; "probabilities": true adds them to JSON responses.
+    "cascade": true lets the n-gram model answer confident texts first (not for streamed,
+    pre-tokenized or probability requests); the response then reports the escalation rate.
+    With "stream": true (FLAG_STREAM in binary requests) the response is NDJSON or binary frames, one per
+    finished segment (see stream_predictions).
+    Requests over MAX_REQUEST_TEXTS texts or MAX_REQUEST_MB get 413; when the server is saturated the
+    answer is 429 with Retry-After. Small requests are served ahead of bulk ones ("priority": "bulk" opts out).
+    """
+    ticket = None
     try:
-        data = request.json
-        texts = data.get('texts', [])
+        if MAX_REQUEST_MB and (request.content_length or 0) > MAX_REQUEST_MB * 2**20:
+            REJECTED.inc(lane='none', reason='too_large')
+            return jsonify({'error': f'Request body over {MAX_REQUEST_MB:g} MB, split it or use /jobs'}), 413
+        try:
+            data, wire_format = read_predict_request()
+        except (ValueError, OSError) as e:
+            REQUEST_ERRORS.inc(endpoint='/predict', kind='bad_request')
+            return jsonify({'error': f'Invalid request body: {e}'}), 400
+        texts = data.get('texts') or data.get('token_ids') or []
         
         if not texts:
+            REQUEST_ERRORS.inc(endpoint='/predict', kind='bad_request')
             return jsonify({'error': 'No texts provided'}), 400
         
         if not isinstance(texts, list):
+            REQUEST_ERRORS.inc(endpoint='/predict', kind='bad_request')
             return jsonify({'error': 'Texts must be a list'}), 400
         
-        print(f"📊 Received {len(texts)} texts for prediction")
-        start_time = time.time()
+        lane = admission.lane_for(len(texts), data.get('priority'))
+        if MAX_REQUEST_TEXTS and len(texts) > MAX_REQUEST_TEXTS:
+            REJECTED.inc(lane=lane, reason='too_large')
+            return jsonify({
+                'error': f'Too many texts in one request ({len(texts)} > {MAX_REQUEST_TEXTS}), split it or use /jobs',
+                'max_request_texts': MAX_REQUEST_TEXTS
+            }), 413
+        ticket = admission.admit(len(texts), lane)
+        if ticket is None:
+            retry_after = admission.retry_after(len(texts), lane, fallback_rate=tuning_report.get('texts_per_second'))
+            REJECTED.inc(lane=lane, reason='busy')
+            print(f"🚦 Busy: turned away {len(texts)} {lane} texts, retry after {retry_after}s")
+            response = jsonify({'error': 'Server busy, retry later', 'lane': lane, 'retry_after': retry_after})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
         
-        predictions = []
-        total_batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
+        print(f"📊 Received {len(texts)} {'token sequences' if 'token_ids' in data else 'texts'} for prediction ({wire_format})")
+        dedupe = data.get('dedupe', True)
+        with_probabilities = bool(data.get('probabilities', False))
+        stream = bool(data.get('stream', False))
+        REQUESTS.inc(endpoint='/predict', mode='stream' if stream else ('binary' if wire_format == 'binary' else 'batch'))
+        REQUEST_TEXTS.observe(len(texts), endpoint='/predict')
+        REQUEST_BYTES.observe(request.content_length or 0, endpoint='/predict')
         
-        for batch_idx, i in enumerate(range(0, len(texts), BATCH_SIZE), 1):
-            batch_texts = texts[i:i+BATCH_SIZE]
-            
-            # Tokenize (optimized: use padding=True for variable length, faster)
-            inputs = tokenizer(
-                batch_texts,
-                padding=True,  # 'longest' padding is faster than 'max_length'
-                truncation=True,
-                max_length=MAX_LENGTH,
-                return_tensors="pt"
+        if stream:
+            # The stream releases its own ticket when it ends (or on close, if it never started)
+            streamed_ticket, ticket = ticket, None
+            binary = wire_format == 'binary'
+            response = Response(
+                stream_with_context(stream_predictions(
+                    texts, dedupe, lane, streamed_ticket, encode=binary_frame if binary else ndjson_line
+                )),
+                mimetype=CONTENT_TYPE_LABEL_STREAM if binary else 'application/x-ndjson'
             )
-            
-            # Move to GPU (with non_blocking for faster transfer)
-            inputs = {k: v.to(device, non_blocking=True) for k, v in inputs.items()}
-            
-            # Predict
-            with torch.no_grad():
-                outputs = model(**inputs)
-                logits = outputs.logits
-                probabilities = torch.nn.functional.softmax(logits, dim=-1)
-                pred_ids = torch.argmax(probabilities, dim=-1).cpu().numpy()
-            
-            batch_predictions = [VALID_LABELS[pred_id] for pred_id in pred_ids]
-            predictions.extend(batch_predictions)
-            
-            if batch_idx % 10 == 0:
-                print(f"  Processed {batch_idx}/{total_batches} batches ({len(predictions)}/{len(texts)} texts)")
+            response.call_on_close(lambda: admission.release(streamed_ticket))
+            return response
+        
+        start_time = time.time()
+        unique_texts, inverse = split_unique(texts, dedupe)
+        
+        cascade_stats = {}
+        use_cascade = (
+            cascade_classifier is not None
+            and data.get('cascade', CASCADE_DEFAULT)
+            and not with_probabilities
+            and 'token_ids' not in data
+        )
+        if use_cascade:
+            unique_predictions, cache_hits = cascade_and_predict(unique_texts, cascade_stats, lane)
+        else:
+            unique_predictions, cache_hits = lookup_and_predict(unique_texts, with_probabilities, lane)
+        if cache_hits:
+            print(f"💾 {cache_hits} texts answered from cache")
+        predictions = expand_predictions(unique_predictions, inverse)
         
         elapsed_time = time.time() - start_time
         print(f"✅ Completed prediction in {elapsed_time:.2f}s ({len(texts)/elapsed_time:.1f} texts/sec)")
         
-        return jsonify({
-            'predictions': predictions,
+        serialize_start = time.perf_counter()
+        meta = {
             'count': len(predictions),
+            'unique_count': len(unique_texts),
+            'dedup_ratio': round(dedup_ratio(len(texts), len(unique_texts)), 4),
+            'cache_hits': cache_hits,
             'processing_time': round(elapsed_time, 2)
-        })
+        }
+        if cascade_stats:
+            meta['cascade'] = cascade_stats['cascade']
+        if wire_format == 'binary':
+            response = binary_response(predictions, with_probabilities, meta)
+        elif with_probabilities:
+            response = jsonify({
+                'predictions': [label for label, _ in predictions],
+                'probabilities': [[round(float(p), 4) for p in row] for _, row in predictions],
+                'labels': VALID_LABELS,
+                **meta
+            })
+        else:
+            response = jsonify({'predictions': predictions, **meta})
+        observe_stage('serialize', time.perf_counter() - serialize_start)
+        REQUEST_LATENCY.observe(time.time() - start_time, endpoint='/predict', mode='batch')
+        THROUGHPUT.set(len(texts) / max(elapsed_time, 1e-9))
+        return response
     
     except Exception as e:
-        import traceback
+        REQUEST_ERRORS.inc(endpoint='/predict', kind='server_error')
         error_msg = str(e)
         traceback.print_exc()
         return jsonify({'error': error_msg}), 500
+    finally:
+        admission.release(ticket)
+
+def job_urls(meta):
+    return {
+        'status_url': f"/jobs/{meta['job_id']}",
+        'results_url': f"/jobs/{meta['job_id']}/results"
+    }
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a large batch as a background job: {"texts": [...], "dedupe": true, "key": "optional client key"}.
+    Returns 202 with the job id right away; poll /jobs/<id> and fetch /jobs/<id>/results.
+    Resubmitting with the same key returns the existing job instead of starting over.
+    """
+    if job_manager is None:
+        return jsonify({'error': 'Job API disabled (JOB_DIR is empty)'}), 404
+    try:
+        try:
+            data, _ = read_predict_request()
+        except (ValueError, OSError) as e:
+            REQUEST_ERRORS.inc(endpoint='/jobs', kind='bad_request')
+            return jsonify({'error': f'Invalid request body: {e}'}), 400
+        texts = data.get('texts', [])
+        if not texts or not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            REQUEST_ERRORS.inc(endpoint='/jobs', kind='bad_request')
+            return jsonify({'error': 'Texts must be a non-empty list of strings'}), 400
+        
+        REQUESTS.inc(endpoint='/jobs', mode='submit')
+        REQUEST_TEXTS.observe(len(texts), endpoint='/jobs')
+        REQUEST_BYTES.observe(request.content_length or 0, endpoint='/jobs')
+        meta = job_manager.submit(texts, dedupe=data.get('dedupe', True), key=data.get('key'))
+        print(f"🗂️ Job {meta['job_id']} accepted ({len(texts)} texts, {meta['status']})")
+        return jsonify({**job_manager.status(meta['job_id']), **job_urls(meta)}), 202
+    except Exception as e:
+        REQUEST_ERRORS.inc(endpoint='/jobs', kind='server_error')
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and progress of a job (status: queued, running, done or failed)"""
+    if job_manager is None:
+        return jsonify({'error': 'Job API disabled (JOB_DIR is empty)'}), 404
+    try:
+        meta = job_manager.status(job_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({**meta, **job_urls(meta)})
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """
+    Predictions of a job in input order; ?offset=&limit= pages through them.
+    Rows already checkpointed can be fetched while the job is still running.
+    """
+    if job_manager is None:
+        return jsonify({'error': 'Job API disabled (JOB_DIR is empty)'}), 404
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    try:
+        meta = job_manager.status(job_id)
+        predictions = job_manager.results(job_id, offset=offset, limit=limit)
+    except KeyError:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({
+        'job_id': job_id,
+        'status': meta['status'],
+        'total': meta['total'],
+        'offset': offset,
+        'count': len(predictions),
+        'predictions': predictions
+    })
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Delete a job and its checkpoints"""
+    if job_manager is None:
+        return jsonify({'error': 'Job API disabled (JOB_DIR is empty)'}), 404
+    try:
+        job_manager.delete(job_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'job_id': job_id, 'deleted': True})
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (503 with status "warming_up" until the startup warmup has finished)"""
     gpu_info = {}
     if torch.cuda.is_available():
         gpu_info = {
@@ -129,12 +755,75 @@ def health():
             'memory_reserved': f"{torch.cuda.memory_reserved(0) / 1024**3:.2f} GB"
         }
     
+    ready = model_ready.is_set()
     return jsonify({
-        'status': 'healthy',
+        'status': 'healthy' if ready else 'warming_up',
+        'ready': ready,
+        'warmup': {
+            **warmup_report,
+            'compile_mode': COMPILE_MODE,
+            'shapes': [f"{rows}x{length}" for length, rows in serving_shapes.items()] if serving_shapes else None
+        },
         'device': str(device),
+        'backend': INFERENCE_BACKEND,
         'gpu': gpu_info,
-        'model': MODEL_NAME
-    })
+        'model': MODEL_NAME,
+        'revision': MODEL_REVISION,
+        'cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'micro_batching': micro_batcher.stats() if micro_batcher is not None else None,
+        'jobs': job_manager.stats() if job_manager is not None else None,
+        'admission': {**admission.stats(), 'max_request_texts': MAX_REQUEST_TEXTS, 'max_request_mb': MAX_REQUEST_MB},
+        'tuning': tuning_report,
+        'cascade': {
+            'threshold': CASCADE_THRESHOLD or cascade_classifier.threshold,
+            'default': CASCADE_DEFAULT,
+            'audit_rate': CASCADE_AUDIT_RATE,
+            'report': cascade_classifier.report
+        } if cascade_classifier is not None else None,
+        'wire': {
+            'formats': list(WIRE_FORMATS),
+            'encodings': ['gzip'],
+            'pretokenized': True,
+            'vocab_size': len(tokenizer),
+            'max_length': MAX_LENGTH,
+            'labels': VALID_LABELS
+        }
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (text exposition format)"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+autotune_lock = threading.Lock()
+
+def autotune_in_background():
+    try:
+        settings = run_autotune()
+        if serving_shapes:
+            # Compiled/traced graphs are fixed to the startup batch shapes; the stored settings apply on restart
+            tuning_report.update(status='probed', pending=settings)
+            print(f"🔧 Autotune stored batch_size={settings['batch_size']}, applies on restart (fixed batch shapes)")
+        else:
+            apply_tuning(settings, 'probed')
+            if micro_batcher is not None:
+                micro_batcher.max_batch_size = MICRO_BATCH_MAX_TEXTS
+    except Exception as e:
+        traceback.print_exc()
+        tuning_report.update(status='failed', error=str(e))
+    finally:
+        autotune_lock.release()
+
+@app.route('/autotune', methods=['POST'])
+def autotune_endpoint():
+    """Re-probe batch sizes on this device in the background (results show up in /health under 'tuning')"""
+    if not model_ready.is_set():
+        return jsonify({'error': 'Model is still warming up'}), 503
+    if not autotune_lock.acquire(blocking=False):
+        return jsonify({'status': 'running', 'tuning': tuning_report}), 409
+    tuning_report.update(status='running', error=None)
+    threading.Thread(target=autotune_in_background, name="autotune", daemon=True).start()
+    return jsonify({'status': 'running', 'key': TUNING_KEY}), 202
 
 @app.route('/', methods=['GET'])
 def index():
@@ -143,8 +832,14 @@ def index():
         'service': 'Fabric Product Classifier GPU API',
         'version': '1.0',
         'endpoints': {
-            '/health': 'GET - Health check',
-            '/predict': 'POST - Predict labels (send {"texts": ["text1", "text2", ...]})'
+            '/autotune': 'POST - Re-probe batch sizes on this device and store the fastest setting (best on an idle server)',
+            '/health': 'GET - Health check (includes the batch settings in use under "tuning")',
+            '/jobs': 'POST - Submit a background job ({"texts": [...], "key": "optional"}), returns a job id',
+            '/jobs/<id>': 'GET - Job status and progress, DELETE - remove the job',
+            '/jobs/<id>/results': 'GET - Job predictions (?offset=&limit=)',
+            '/metrics': 'GET - Prometheus metrics (request/stage latency histograms, batch fill, queue wait, GPU memory)',
+            '/predict': 'POST - Predict labels (send {"texts": ["text1", "text2", ...], "dedupe": true, "stream": false, "probabilities": false, "priority": "bulk"}, '
+                        'or {"token_ids": [[0, 123, 2], ...]} pre-tokenized, or the binary format from wire_protocol.py)'
         },
         'device': str(device)
     })
@@ -153,6 +848,7 @@ if __name__ == '__main__':
     print(f"\n🌐 Starting API server on {API_HOST}:{API_PORT}")
     print(f"📡 API endpoint: http://{API_HOST}:{API_PORT}")
     print(f"💡 Health check: http://{API_HOST}:{API_PORT}/health")
+    print(f"📈 Metrics: http://{API_HOST}:{API_PORT}/metrics")
     print(f"🔗 Predict endpoint: http://{API_HOST}:{API_PORT}/predict")
     print("\n⚠️  Note: If using port forwarding, access via forwarded port")
     print("=" * 60)
@@ -186,6 +882,7 @@ if __name__ == '__main__':
         # Development mode - Flask dev server
         print("\n⚠️  Running in development mode (Flask dev server)")
         print("💡 For production, use: gunicorn -w 1 -b 0.0.0.0:5001 api_server:app")
+        print("💡 Several CPU replicas sharing one copy of the weights: python replicas.py --workers 4")
         print("=" * 60)
         app.run(host=API_HOST, port=API_PORT, threaded=True)
 
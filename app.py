@@ -1,20 +1,31 @@
+import time
+_script_start = time.perf_counter()  # startup timing shown in debug mode
+
 import streamlit as st
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import gc
 import numpy as np
 import pandas as pd
-import re
 import os
-from pathlib import Path
+import sys
+import tempfile
 from io import BytesIO
-import requests
 
-# Try to load .env file if it exists (for local development)
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass  # dotenv not required on HF Spaces
+import classify
+from classify import (
+    API_WARMUP_WAIT_SECONDS, CASCADE_THRESHOLD, HEALTH_TTL_SECONDS, INFERENCE_BACKEND, MAX_LENGTH, MODEL_NAME,
+    MODEL_REVISION, PREPROCESS_WORKERS, STREAM_CHUNK_SIZE, VALID_LABELS, TableWriter, get_api_client,
+    get_cascade_classifier, get_prediction_cache, predict_batch, valid_rows
+)
+from batching import dedup_ratio
+from preprocessing import clean_product_series
+from api_client import is_ready, parse_endpoints, wait_until_ready
+from cascade import summarize
+from manifest import RowManifest, model_identity, row_fingerprints
+from low_memory import StageMemory, compact_strings, optimize_dtypes, write_xlsx
+from ingestion import SUPPORTED_EXTENSIONS, count_rows, iter_column_chunks, read_preview, read_table
+# torch/transformers (and inference.py, cpu_pool.py) are imported only when local inference is needed,
+# so GPU API sessions never pay for them
+_imports_seconds = time.perf_counter() - _script_start
 
 # Page configuration
 st.set_page_config(
@@ -24,234 +35,297 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Model configuration
-MODEL_NAME = os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric")
-MODEL_PATH = os.getenv("MODEL_PATH", None)
-VALID_LABELS = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
-MAX_LENGTH = int(os.getenv("MAX_LENGTH", "128"))
+# Model loading and prediction warnings (classify.py) are shown on the page
+classify.notify = st.warning
 
-# GPU API configuration (for vast.ai GPU server)
-# Set GPU_API_ENDPOINT environment variable in Streamlit Cloud to enable GPU acceleration
-# Example: GPU_API_ENDPOINT=http://143.55.45.86:5000
-# When renting new GPU, update this value in Streamlit Cloud Secrets
-# Current GPU: ssh -p 54754 root@143.55.45.86
-GPU_API_ENDPOINT = os.getenv("GPU_API_ENDPOINT", None)
+# Incremental mode: per file + product column, the fingerprint, cleaned text and label of every row of the
+# last run are kept here, so re-uploads only clean and classify new or changed rows
+MANIFEST_DIR = os.getenv("MANIFEST_DIR", ".cache/manifests")
 
-# Preprocessing function from preprocessing.ipynb
-def clean_product_string(s):
-    """Clean product string based on preprocessing.ipynb logic"""
-    if pd.isna(s) or s == '':
-        return ''
-    
-    s = str(s).strip()
-    
-    # 1. Xóa @ ở cuối
-    s = re.sub(r'\s*@$', '', s).strip()
-    
-    # 2. Xử lý các prefix/suffix có #&
-    for _ in range(3):
-        original_s = s
-        s = re.sub(r'\s*#&(?:VN|CN|KR|TW|IT|JP)\s*$', '', s, flags=re.IGNORECASE).strip()
-        if s == original_s:
-            break
-
-    s = re.sub(r'^[^\s]*#&\s*', '', s).strip()
-    s = re.sub(r'\s*#&\s*', ' ', s).strip()
+def load_model():
+    """classify.load_model (loaded once per process), stopping the page if the model cannot be loaded"""
+    try:
+        return classify.load_model()
+    except Exception as e:
+        st.error(f"❌ {str(e)}")
+        st.stop()
+        return None, None
 
-    # 3. Clean up ký tự đặc biệt thừa
-    s = s.strip('\"')
-    s = re.sub(r'[\s\.\,\-\']+$', '', s).strip()
-    s = re.sub(r'[\[\]\{\}]', ' ', s).strip()
+def show_results(df, product_column, filtered_count, dedup_stats, output, download_note, rows=None, label_counts=None):
+    """
+    Results summary, label distribution, sample rows and download button (rows: mask of the kept rows).
+    label_counts (labels -> rows) replaces counting df's labels when df only holds the sample rows.
+    """
+    if label_counts is None:
+        label_counts = df['label_predict'].value_counts()
+    st.markdown("---")
+    st.subheader("📊 Results Summary")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total Rows Processed", f"{filtered_count:,}")
+    with col2:
+        st.metric("Rows with Predictions", f"{int(label_counts.sum()):,}")
+    with col3:
+        st.metric("Unique Labels", int((label_counts > 0).sum()))
+    
+    if dedup_stats.get('cache_hits'):
+        st.caption(f"💾 {dedup_stats['cache_hits']:,} rows answered from the prediction cache")
+    if 'dedup_ratio' in dedup_stats:
+        st.caption(
+            f"🔁 Classified {dedup_stats['unique']:,} unique texts for {dedup_stats['total']:,} rows "
+            f"({dedup_stats['dedup_ratio']*100:.1f}% of forward passes skipped)"
+        )
+    if 'incremental' in dedup_stats:
+        incremental_stats = dedup_stats['incremental']
+        st.caption(
+            f"♻️ Reused {incremental_stats['reused']:,} labels from the last run of this file; "
+            f"cleaned {incremental_stats['cleaned']:,} and classified {incremental_stats['classified']:,} new or changed rows"
+        )
+    if 'cascade' in dedup_stats:
+        cascade_stats = dedup_stats['cascade']
+        agreement = cascade_stats['agreement']
+        st.caption(
+            f"🪜 Cascade answered {cascade_stats['rows'] - cascade_stats['escalated']:,} of {cascade_stats['rows']:,} rows, "
+            f"escalated {cascade_stats['escalation_rate']*100:.1f}% to the transformer"
+            + (f" ({agreement*100:.1f}% agreement on {cascade_stats['audited']:,} audited rows)" if agreement is not None else "")
+        )
+    if 'pipeline' in dedup_stats:
+        timings = dedup_stats['pipeline']
+        st.caption(
+            f"⏱️ Tokenization {timings['tokenize_seconds']:.1f}s "
+            f"({timings['overlap_ratio']*100:.0f}% overlapped with the model), "
+            f"model {timings.get('model_seconds', 0):.1f}s"
+        )
+    
+    if 'memory' in dedup_stats:
+        stages = dedup_stats['memory']
+        st.caption(
+            "🧠 Peak memory by stage: "
+            + ", ".join(f"{stage['stage']} {stage['peak_mb']:,.0f} MB" for stage in stages)
+            + ("" if all(stage['exact'] for stage in stages) else " (sampled)")
+        )
     
-    # 4. Xóa dấu phẩy/chấm kép thừa
-    s = re.sub(r'[,\.]{2,}', ',', s).strip()
+    # Show label distribution
+    st.markdown("**Label Distribution:**")
+    st.bar_chart(label_counts[label_counts > 0])
     
-    # 5. Xóa khoảng trắng thừa
-    s = re.sub(r'\s+', ' ', s).strip()
+    # Show sample results
+    st.markdown("**Sample Results (first 10 rows):**")
+    display_cols = [product_column, 'product_clean', 'label_predict']
+    available_cols = [col for col in display_cols if col in df.columns]
+    sample = df.head(10) if rows is None else df.iloc[np.flatnonzero(rows)[:10]]
+    st.dataframe(sample[available_cols], width='stretch')
     
-    return s
+    # Download button
+    st.markdown("---")
+    st.subheader("📥 Step 3: Download Results")
+    
+    filename = f"predictions_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    
+    st.download_button(
+        label="⬇️ Download Excel File with Predictions",
+        data=output,
+        file_name=filename,
+        mime="application/vnd.openpyxl.formats-officedocument.spreadsheetml.sheet",
+        type="primary",
+        width='stretch'
+    )
+    
+    st.info(download_note)
 
-# Cache the model and tokenizer for faster loading
-@st.cache_resource
-def load_model():
-    """Load the model and tokenizer from Hugging Face or local path"""
-    # Try loading from local path first if specified
-    if MODEL_PATH and Path(MODEL_PATH).exists():
-        try:
-            tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-            model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
-            model.eval()
-            return tokenizer, model
-        except Exception as e:
-            st.warning(f"⚠️ Failed to load from local path: {str(e)}")
-            st.info("🔄 Trying to load from Hugging Face instead...")
+def process_file_streaming(uploaded_file, product_column, tokenizer, model, use_gpu_api, gpu_api_endpoint, dedupe, cascade=None):
+    """
+    Large file mode: stream only the product column in chunks and clean/predict each chunk
+    as soon as it is read, so memory stays flat and predictions start before the file is parsed.
+    Each labeled chunk is appended to a write-only workbook on disk; only the label counts and
+    the sample rows stay in memory.
+    """
+    st.markdown("---")
+    st.subheader("🔄 Processing (large file mode)...")
     
-    # Try loading from Hugging Face with multiple fallback methods
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    status_text.text("Reading file in chunks...")
+    
+    total_rows = count_rows(uploaded_file, uploaded_file.name)
+    prediction_cache = get_prediction_cache()
+    dedup_stats = {'total': 0, 'unique': 0, 'cache_hits': 0}
+    cascade_totals = {'rows': 0, 'escalated': 0, 'audited': 0, 'agreed': 0}
+    label_counts = pd.Series(dtype=np.int64)
+    sample = None
+    rows_read = 0
+    rows_kept = 0
+    
+    fd, output_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
     try:
-        # Load tokenizer first
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        
-        # Try different methods to load the model
-        model = None
-        last_error = None
-        
-        # Method 1: Standard AutoModel load
-        try:
-            model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-        except Exception as e1:
-            last_error = e1
-            # Method 2: With trust_remote_code
-            try:
-                model = AutoModelForSequenceClassification.from_pretrained(
-                    MODEL_NAME, 
-                    trust_remote_code=True
-                )
-            except Exception as e2:
-                last_error = e2
-                # Method 3: Load with explicit XLM-RoBERTa class
-                try:
-                    from transformers import XLMRobertaForSequenceClassification
-                    model = XLMRobertaForSequenceClassification.from_pretrained(MODEL_NAME)
-                except Exception as e3:
-                    last_error = e3
-                    # Method 4: Load base model and configure
-                    try:
-                        from transformers import XLMRobertaConfig
-                        config = XLMRobertaConfig.from_pretrained(MODEL_NAME)
-                        config.num_labels = len(VALID_LABELS)
-                        from transformers import XLMRobertaForSequenceClassification
-                        model = XLMRobertaForSequenceClassification.from_pretrained(
-                            MODEL_NAME,
-                            config=config,
-                            ignore_mismatched_sizes=True
-                        )
-                    except Exception as e4:
-                        last_error = e4
-        
-        if model is None:
-            raise last_error
-        
-        model.eval()
-        return tokenizer, model
-        
-    except Exception as e:
-        error_msg = str(e)
-        st.error(f"❌ Error loading model: {error_msg}")
-        st.stop()
-        return None, None
-
-def predict_batch_api(texts, api_endpoint, progress_callback=None):
-    """Predict using GPU API endpoint (vast.ai)"""
-    total = len(texts)
-    predictions = []
-    
-    # Chia thành chunks lớn hơn cho API (2000 rows mỗi request để tối ưu throughput)
-    # Larger chunks = fewer HTTP requests = faster overall processing
-    chunk_size = 2000
-    total_chunks = (total + chunk_size - 1) // chunk_size
-    
-    for chunk_idx in range(total_chunks):
-        start_idx = chunk_idx * chunk_size
-        end_idx = min(start_idx + chunk_size, total)
-        chunk_texts = texts[start_idx:end_idx]
-        
-        try:
-            response = requests.post(
-                f"{api_endpoint}/predict",
-                json={'texts': chunk_texts},
-                timeout=300  # 5 minutes timeout per chunk
-            )
-            response.raise_for_status()
-            result = response.json()
-            chunk_predictions = result['predictions']
-            predictions.extend(chunk_predictions)
+        writer = TableWriter(output_path)
+        for chunk in iter_column_chunks(uploaded_file, uploaded_file.name, product_column, chunk_size=STREAM_CHUNK_SIZE):
+            rows_read += len(chunk)
+            
+            # Clean and filter this chunk only (same rules as the regular path)
+            clean = clean_product_series(chunk.astype(str), n_jobs=PREPROCESS_WORKERS)
+            valid = valid_rows(clean)
+            texts = clean[valid].tolist()
+            
+            chunk_stats = {}
+            predictions = predict_batch(
+                texts,
+                tokenizer,
+                model,
+                use_gpu_api=use_gpu_api,
+                gpu_api_endpoint=gpu_api_endpoint,
+                dedupe=dedupe,
+                stats=chunk_stats,
+                cache=prediction_cache,
+                cascade=cascade
+            ) if texts else []
+            for key in dedup_stats:
+                dedup_stats[key] += chunk_stats.get(key, 0)
+            if 'cascade' in chunk_stats:
+                for key in cascade_totals:
+                    cascade_totals[key] += chunk_stats['cascade'][key]
+                cascade_totals['threshold'] = chunk_stats['cascade']['threshold']
+            
+            labeled = pd.DataFrame({
+                'source_row': chunk.index[valid] + 2,  # 1-based file row, after the header
+                product_column: chunk[valid].to_numpy(),
+                'product_clean': texts,
+                'label_predict': predictions
+            })
+            writer.write(labeled)
+            label_counts = label_counts.add(labeled['label_predict'].value_counts(), fill_value=0).astype(np.int64)
+            if sample is None:
+                sample = labeled.head(10)
+            elif len(sample) < 10:
+                sample = pd.concat([sample, labeled.head(10 - len(sample))], ignore_index=True)
+            rows_kept += len(texts)
+            del labeled
             
-            if progress_callback:
-                progress = (chunk_idx + 1) / total_chunks
-                processed = len(predictions)
-                progress_callback(progress, chunk_idx + 1, total_chunks, processed, total)
+            if total_rows:
+                progress_bar.progress(min(rows_read / total_rows, 1.0) * 0.9)
+            status_text.text(f"Processed {rows_read:,}{f'/{total_rows:,}' if total_rows else ''} rows ({rows_kept:,} predicted)")
         
-        except requests.exceptions.ConnectTimeout:
-            error_msg = "GPU API connection timeout"
-            st.error(f"❌ {error_msg}")
-            raise Exception(error_msg)
-        except requests.exceptions.ConnectionError:
-            error_msg = "GPU API connection failed - check if server is running and accessible"
-            st.error(f"❌ {error_msg}")
-            raise Exception(error_msg)
-        except requests.exceptions.RequestException as e:
-            # Hide IP addresses from error messages
-            import re
-            error_msg = str(e)
-            error_msg = re.sub(r'\d+\.\d+\.\d+\.\d+', '[IP_HIDDEN]', error_msg)
-            st.error(f"❌ Error calling GPU API: {error_msg}")
-            raise Exception(f"GPU API error: {error_msg}")
-    
-    return predictions
+        if rows_kept == 0:
+            st.error("❌ No valid rows after preprocessing!")
+            st.stop()
+        
+        progress_bar.progress(0.9)
+        status_text.text("Preparing download file...")
+        writer.close()
+        # The download button holds the bytes it serves; the finished xlsx is compressed and much
+        # smaller than the labeled rows were
+        with open(output_path, "rb") as f:
+            output = BytesIO(f.read())
+    finally:
+        os.remove(output_path)
+    
+    if dedup_stats['total']:
+        dedup_stats['dedup_ratio'] = dedup_ratio(dedup_stats['total'], dedup_stats['unique'])
+    else:
+        del dedup_stats['total'], dedup_stats['unique']
+    if cascade_totals['rows']:
+        dedup_stats['cascade'] = summarize(cascade_totals)
+    
+    progress_bar.progress(1.0)
+    status_text.text(f"✅ Processing complete! Read {rows_read:,} rows, removed {rows_read - rows_kept:,} invalid rows")
+    
+    show_results(
+        sample,
+        product_column,
+        rows_kept,
+        dedup_stats,
+        output,
+        "💡 Large file mode: the downloaded file contains the source row number, the product column, 'product_clean' and 'label_predict'.",
+        label_counts=label_counts
+    )
 
-def predict_batch(texts, tokenizer, model, batch_size=32, progress_callback=None, use_gpu_api=False, gpu_api_endpoint=None):
+def process_file_low_memory(df, product_column, tokenizer, model, use_gpu_api, gpu_api_endpoint, dedupe, cascade, tracker):
     """
-    Predict labels for a batch of texts.
-    Uses GPU API if available, otherwise falls back to local model (CPU).
+    Low-memory mode for million-row files: invalid rows are dropped with a boolean mask instead of
+    copying the frame, labels and low-cardinality columns are categoricals, intermediates are freed
+    after each stage and the xlsx is streamed row by row. tracker (StageMemory) already holds the read
+    stage; the peak memory of every stage is shown with the results.
     """
-    # Priority: GPU API > Local Model
-    if use_gpu_api and gpu_api_endpoint:
-        try:
-            # Test API connection first
-            health_response = requests.get(f"{gpu_api_endpoint}/health", timeout=5)
-            if health_response.status_code == 200:
-                # Silently use GPU - no message to users
-                return predict_batch_api(texts, gpu_api_endpoint, progress_callback)
-            else:
-                # Silently fallback to CPU
-                pass
-        except (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError, Exception):
-            # Silently fallback to CPU - don't show errors to users
-            pass
-    
-    # Fallback to local model (CPU) - model must be loaded
-    if model is None or tokenizer is None:
-        raise ValueError("Model and tokenizer must be loaded when GPU API is not available")
-    
-    device = next(model.parameters()).device
-    predictions = []
-    total_batches = (len(texts) + batch_size - 1) // batch_size
-    
-    for batch_idx, i in enumerate(range(0, len(texts), batch_size), 1):
-        batch_texts = texts[i:i+batch_size]
-        
-        # Tokenize batch (optimized: use padding='longest' for variable length)
-        inputs = tokenizer(
-            batch_texts,
-            padding=True,  # 'longest' padding is faster than 'max_length'
-            truncation=True,
-            max_length=MAX_LENGTH,
-            return_tensors="pt"
+    st.markdown("---")
+    st.subheader("🔄 Processing (low-memory mode)...")
+    
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    status_text.text("Step 1/3: Preprocessing product texts...")
+    
+    with tracker.stage("clean"):
+        clean = clean_product_series(df[product_column].astype(str), n_jobs=PREPROCESS_WORKERS)
+        valid = valid_rows(clean).to_numpy()
+        filtered_count = int(valid.sum())
+    progress_bar.progress(0.3)
+    status_text.text(f"Step 1/3: Preprocessing complete. Processed {filtered_count} rows (removed {len(df) - filtered_count} invalid rows)")
+    
+    if filtered_count == 0:
+        st.error("❌ No valid rows after preprocessing!")
+        st.stop()
+    
+    status_text.text("Step 2/3: Predicting labels...")
+    prediction_progress_bar = st.progress(0)
+    prediction_status = st.empty()
+    
+    def update_prediction_progress(progress, batch_idx, total_batches, processed, total):
+        prediction_progress_bar.progress(progress)
+        prediction_status.text(
+            f"Processing batch {batch_idx}/{total_batches} "
+            f"({processed}/{total} rows predicted - {progress*100:.1f}%)"
         )
-        
-        # Move to device (with non_blocking for faster transfer if CUDA)
-        if device.type == 'cuda':
-            inputs = {k: v.to(device, non_blocking=True) for k, v in inputs.items()}
-        else:
-            inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        # Predict
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            probabilities = torch.nn.functional.softmax(logits, dim=-1)
-            pred_ids = torch.argmax(probabilities, dim=-1).cpu().numpy()
-        
-        # Convert to labels
-        batch_predictions = [VALID_LABELS[pred_id] for pred_id in pred_ids]
-        predictions.extend(batch_predictions)
-        
-        # Update progress if callback provided
-        if progress_callback:
-            progress = batch_idx / total_batches
-            progress_callback(progress, batch_idx, total_batches, len(predictions), len(texts))
+        progress_bar.progress(0.3 + progress * 0.5)
+    
+    dedup_stats = {}
+    with tracker.stage("predict"):
+        texts = clean[valid].tolist()
+        predictions = predict_batch(
+            texts,
+            tokenizer,
+            model,
+            progress_callback=update_prediction_progress,
+            use_gpu_api=use_gpu_api,
+            gpu_api_endpoint=gpu_api_endpoint,
+            dedupe=dedupe,
+            stats=dedup_stats,
+            cache=get_prediction_cache(),
+            cascade=cascade
+        )
+        del texts
+        # One int8 code per row instead of a Python string reference; filtered rows stay empty
+        categories = VALID_LABELS + sorted(set(predictions) - set(VALID_LABELS))
+        label_codes = np.full(len(df), -1, dtype=np.int8)
+        label_codes[valid] = pd.Categorical(predictions, categories=categories).codes
+        del predictions
+        df['product_clean'] = compact_strings(clean)
+        df['label_predict'] = pd.Categorical.from_codes(label_codes, categories=categories)
+        del clean, label_codes
+        gc.collect()
+    prediction_progress_bar.empty()
+    prediction_status.empty()
+    
+    progress_bar.progress(0.85)
+    status_text.text("Step 3/3: Preparing download file...")
+    with tracker.stage("write"):
+        output = BytesIO()
+        write_xlsx(df, output, rows=valid)
+        output.seek(0)
+    dedup_stats['memory'] = tracker.report()
     
-    return predictions
+    progress_bar.progress(1.0)
+    status_text.text("✅ Processing complete!")
+    
+    show_results(
+        df,
+        product_column,
+        filtered_count,
+        dedup_stats,
+        output,
+        "💡 The downloaded file contains all original columns plus the new 'label_predict' column.",
+        rows=valid
+    )
 
 def main():
     # Read GPU_API_ENDPOINT from environment (re-read each time to avoid UnboundLocalError)
@@ -266,7 +340,10 @@ def main():
     
     # Only show debug info locally, not on production
     if is_local and gpu_api_endpoint:
-        endpoint_preview = gpu_api_endpoint.split("://")[-1].split("/")[0] if "://" in gpu_api_endpoint else "[configured]"
+        endpoint_preview = ", ".join(
+            endpoint.split("://")[-1].split("/")[0] if "://" in endpoint else "[configured]"
+            for endpoint in parse_endpoints(gpu_api_endpoint)
+        )
         st.info(f"🔧 [DEBUG] GPU API endpoint configured: {endpoint_preview}")
     elif is_local:
         st.info("ℹ️ [DEBUG] GPU API endpoint not configured - using CPU mode")
@@ -316,56 +393,90 @@ def main():
     model = None
     use_gpu_api = False  # Track if we should use GPU API
     
+    health_start = time.perf_counter()
     if gpu_api_endpoint:
-        try:
-            health_response = requests.get(f"{gpu_api_endpoint}/health", timeout=5)
-            if health_response.status_code == 200:
-                health_data = health_response.json()
-                # Only show success message in local debug mode
-                if is_local:
-                    st.success(f"✅ [DEBUG] GPU acceleration available! ({health_data.get('device', 'GPU')})")
-                use_gpu_api = True  # GPU API is available
-            else:
-                # Only show warning in local debug mode
-                if is_local:
-                    st.warning("⚠️ [DEBUG] GPU API not responding, will use CPU fallback")
-                use_gpu_api = False
-        except requests.exceptions.ConnectTimeout:
-            # Silently fallback to CPU - don't show error to users
-            use_gpu_api = False
-        except requests.exceptions.ConnectionError:
-            # Silently fallback to CPU - don't show error to users
-            use_gpu_api = False
-        except Exception as e:
-            # Silently fallback to CPU - don't show error to users
+        # Cached for HEALTH_TTL_SECONDS, so reruns don't block on a round trip (or a timeout)
+        health_data = get_api_client(gpu_api_endpoint).health_state(HEALTH_TTL_SECONDS)
+        if health_data is not None and not is_ready(health_data):
+            # The server is up but still warming up: wait for it rather than loading the local model
+            with st.spinner("⏳ GPU server is warming up..."):
+                health_data = wait_until_ready(get_api_client(gpu_api_endpoint), API_WARMUP_WAIT_SECONDS, HEALTH_TTL_SECONDS)
+        if health_data is not None:
+            # Only show success message in local debug mode
+            if is_local:
+                st.success(
+                    f"✅ [DEBUG] GPU acceleration available! ({health_data.get('device', 'GPU')}, "
+                    f"{health_data['healthy_endpoints']}/{len(health_data['endpoints'])} endpoints healthy)"
+                )
+            use_gpu_api = True  # GPU API is available
+        else:
+            # Silently fallback to CPU - only warn in local debug mode
+            if is_local:
+                st.warning("⚠️ [DEBUG] GPU API not responding, will use CPU fallback")
             use_gpu_api = False
+    health_seconds = time.perf_counter() - health_start
     
     # Load model (only needed if GPU API is not available)
+    model_seconds = 0.0
     if not use_gpu_api:
+        model_start = time.perf_counter()
         with st.spinner("🔄 Loading AI model... This may take a moment on first run."):
             tokenizer, model = load_model()
+        model_seconds = time.perf_counter() - model_start
         
         if tokenizer is None or model is None:
             st.stop()
         
         st.success("✅ Model loaded successfully!")
     
+    if is_local:
+        st.caption(
+            f"⏱️ [DEBUG] Startup {time.perf_counter() - _script_start:.2f}s: imports {_imports_seconds:.2f}s, "
+            f"health check {health_seconds:.2f}s, model {model_seconds:.2f}s "
+            f"(torch {'loaded' if 'torch' in sys.modules else 'not loaded'})"
+        )
+    
     # File upload section
     st.markdown("---")
     st.subheader("📤 Step 1: Upload Excel File")
     
     uploaded_file = st.file_uploader(
-        "Choose an Excel file (.xlsx or .xls)",
-        type=['xlsx', 'xls'],
+        "Choose a file (.xlsx, .xls, .csv or .parquet)",
+        type=list(SUPPORTED_EXTENSIONS),
         help="Upload an Excel file containing product descriptions"
     )
     
+    large_file_mode = st.checkbox(
+        "⚡ Large file mode",
+        value=False,
+        help="Read only the product column in chunks and predict while the file is being read. "
+             "Keeps memory flat for very large files; the output contains the product column and predictions only."
+    )
+    
+    low_memory = not large_file_mode and st.checkbox(
+        "🪶 Low-memory mode",
+        value=False,
+        help="Keep all columns but avoid copies: categorical columns, mask-based filtering, streamed output "
+             "and a peak-memory report per stage. For million-row files on small containers."
+    )
+    
     if uploaded_file is not None:
         try:
-            # Read Excel file
-            df = pd.read_excel(uploaded_file)
-            
-            st.success(f"✅ File loaded successfully! ({len(df)} rows, {len(df.columns)} columns)")
+            tracker = StageMemory() if low_memory else None
+            if large_file_mode:
+                # Only the header and a preview are parsed up front
+                df = read_preview(uploaded_file, uploaded_file.name)
+                st.success(f"✅ File ready for streaming! ({len(df.columns)} columns)")
+            elif low_memory:
+                with tracker.stage("read"):
+                    df = optimize_dtypes(read_table(uploaded_file, uploaded_file.name))
+                st.success(
+                    f"✅ File loaded successfully! ({len(df)} rows, {len(df.columns)} columns, "
+                    f"{df.memory_usage(deep=True).sum() / 2**20:,.0f} MB in memory)"
+                )
+            else:
+                df = read_table(uploaded_file, uploaded_file.name)
+                st.success(f"✅ File loaded successfully! ({len(df)} rows, {len(df.columns)} columns)")
             
             # Show preview
             st.subheader("📋 File Preview")
@@ -376,7 +487,7 @@ def main():
             st.subheader("⚙️ Step 2: Configure Processing")
             
             # Auto-detect product column
-            product_column_candidates = [col for col in df.columns if any(keyword in col.lower() for keyword in ['product', 'name', 'description', 'text', 'mô tả', 'sản phẩm'])]
+            product_column_candidates = [col for col in df.columns if any(keyword in str(col).lower() for keyword in ['product', 'name', 'description', 'text', 'mô tả', 'sản phẩm'])]
             
             if product_column_candidates:
                 default_column = product_column_candidates[0]
@@ -390,12 +501,61 @@ def main():
                 help="Choose the column that contains product names/descriptions"
             )
             
+            dedupe = st.checkbox(
+                "Classify each unique product text only once",
+                value=True,
+                help="Identical cleaned texts are predicted once and the label is copied to every matching row"
+            )
+            
+            cascade_classifier = get_cascade_classifier()
+            use_cascade = cascade_classifier is not None and st.checkbox(
+                "🪜 Cascade mode (fast n-gram model first, transformer only when unsure)",
+                value=False,
+                help="Rows the n-gram model is confident about skip the transformer; a small sample is "
+                     "re-checked to report agreement"
+            )
+            cascade = cascade_classifier if use_cascade else None
+            
+            incremental = not large_file_mode and not low_memory and st.checkbox(
+                "♻️ Incremental mode (only new or changed rows since the last run of this file)",
+                value=False,
+                help="Rows whose product text is unchanged since the last time this file and column were processed "
+                     "reuse their cleaned text and label; only new or changed rows are cleaned and classified"
+            )
+            
             # Process button
             if st.button("🚀 Process File", type="primary", width='stretch'):
                 if product_column not in df.columns:
                     st.error(f"❌ Column '{product_column}' not found in the file!")
                     st.stop()
                 
+                if large_file_mode:
+                    process_file_streaming(
+                        uploaded_file,
+                        product_column,
+                        tokenizer,
+                        model,
+                        use_gpu_api,
+                        gpu_api_endpoint,
+                        dedupe,
+                        cascade
+                    )
+                    st.stop()
+                
+                if low_memory:
+                    process_file_low_memory(
+                        df,
+                        product_column,
+                        tokenizer,
+                        model,
+                        use_gpu_api,
+                        gpu_api_endpoint,
+                        dedupe,
+                        cascade,
+                        tracker
+                    )
+                    st.stop()
+                
                 # Step 1: Preprocessing
                 st.markdown("---")
                 st.subheader("🔄 Processing...")
@@ -407,7 +567,37 @@ def main():
                 progress_bar.progress(0.1)
                 
                 # Apply preprocessing
-                df['product_clean'] = df[product_column].astype(str).apply(clean_product_string)
+                raw_values = df[product_column].astype(str)
+                if incremental:
+                    # Diff against the manifest of the last run: unchanged rows keep their cleaned text and label.
+                    # Labels are only reused from a run with the same backend (the server's, on the GPU API)
+                    # and the same cascade model and threshold
+                    model_id = model_identity(
+                        MODEL_NAME,
+                        MODEL_REVISION,
+                        health_data.get('backend', 'pytorch') if use_gpu_api else INFERENCE_BACKEND,
+                        MAX_LENGTH,
+                        cascade=f"{cascade.fingerprint()}@{CASCADE_THRESHOLD or cascade.threshold}" if cascade is not None else None
+                    )
+                    fingerprints = row_fingerprints(raw_values)
+                    manifest = RowManifest.load(MANIFEST_DIR, uploaded_file.name, product_column, model_id)
+                    reused_labels = pd.Series(None, index=df.index, dtype=object)
+                    new_rows = np.ones(len(df), dtype=bool)
+                    df['product_clean'] = pd.Series('', index=df.index, dtype=object)
+                    if manifest is not None:
+                        found, found_clean, found_labels = manifest.lookup(fingerprints)
+                        new_rows = ~found
+                        df.loc[found, 'product_clean'] = found_clean
+                        reused_labels[found] = found_labels
+                    if new_rows.any():
+                        df.loc[new_rows, 'product_clean'] = clean_product_series(
+                            raw_values[new_rows],
+                            n_jobs=PREPROCESS_WORKERS
+                        ).to_numpy()
+                    all_rows = df.index
+                    all_clean = df['product_clean'].tolist()
+                else:
+                    df['product_clean'] = clean_product_series(raw_values, n_jobs=PREPROCESS_WORKERS)
                 
                 # Filter out rows with empty or '?' in cleaned text
                 initial_count = len(df)
@@ -443,21 +633,56 @@ def main():
                     main_progress = 0.4 + (progress * 0.45)
                     progress_bar.progress(main_progress)
                 
+                dedup_stats = {}
+                if incremental:
+                    # Only rows without a reused label go to the model
+                    reused = reused_labels.loc[df.index]
+                    to_classify = reused.isna().to_numpy()
+                    texts = [text for text, classify in zip(texts, to_classify) if classify]
+                
+                prediction_cache = get_prediction_cache()
                 predictions = predict_batch(
                     texts, 
                     tokenizer, 
                     model, 
-                    batch_size=32,
                     progress_callback=update_prediction_progress,
                     use_gpu_api=use_gpu_api,
-                    gpu_api_endpoint=gpu_api_endpoint
-                )
+                    gpu_api_endpoint=gpu_api_endpoint,
+                    dedupe=dedupe,
+                    stats=dedup_stats,
+                    cache=prediction_cache,
+                    cascade=cascade
+                ) if texts else []
                 
                 # Clear prediction progress bars
                 prediction_progress_bar.empty()
                 prediction_status.empty()
                 
-                df['label_predict'] = predictions
+                if incremental:
+                    merged = reused.to_numpy(copy=True)
+                    merged[to_classify] = predictions
+                    df['label_predict'] = merged
+                    
+                    # This run becomes the manifest for the next upload (filtered rows without a label)
+                    row_labels = pd.Series(None, index=all_rows, dtype=object)
+                    row_labels.loc[df.index] = merged
+                    RowManifest.save(
+                        MANIFEST_DIR,
+                        uploaded_file.name,
+                        product_column,
+                        model_id,
+                        fingerprints,
+                        all_clean,
+                        row_labels.tolist(),
+                        VALID_LABELS
+                    )
+                    dedup_stats['incremental'] = {
+                        'reused': int((~to_classify).sum()),
+                        'cleaned': int(new_rows.sum()),
+                        'classified': int(to_classify.sum())
+                    }
+                else:
+                    df['label_predict'] = predictions
                 
                 progress_bar.progress(0.9)
                 status_text.text("Step 3/3: Preparing download file...")
@@ -471,51 +696,20 @@ def main():
                 progress_bar.progress(1.0)
                 status_text.text("✅ Processing complete!")
                 
-                # Show results summary
-                st.markdown("---")
-                st.subheader("📊 Results Summary")
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Total Rows Processed", f"{filtered_count:,}")
-                with col2:
-                    st.metric("Rows with Predictions", f"{len(predictions):,}")
-                with col3:
-                    st.metric("Unique Labels", df['label_predict'].nunique())
-                
-                # Show label distribution
-                st.markdown("**Label Distribution:**")
-                label_counts = df['label_predict'].value_counts()
-                st.bar_chart(label_counts)
-                
-                # Show sample results
-                st.markdown("**Sample Results (first 10 rows):**")
-                display_cols = [product_column, 'product_clean', 'label_predict']
-                available_cols = [col for col in display_cols if col in df.columns]
-                st.dataframe(df[available_cols].head(10), width='stretch')
-                
-                # Download button
-                st.markdown("---")
-                st.subheader("📥 Step 3: Download Results")
-                
-                filename = f"predictions_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                
-                st.download_button(
-                    label="⬇️ Download Excel File with Predictions",
-                    data=output,
-                    file_name=filename,
-                    mime="application/vnd.openpyxl.formats-officedocument.spreadsheetml.sheet",
-                    type="primary",
-                    width='stretch'
+                show_results(
+                    df,
+                    product_column,
+                    filtered_count,
+                    dedup_stats,
+                    output,
+                    "💡 The downloaded file contains all original columns plus the new 'label_predict' column."
                 )
-                
-                st.info("💡 The downloaded file contains all original columns plus the new 'label_predict' column.")
         
         except Exception as e:
             st.error(f"❌ Error processing file: {str(e)}")
             st.exception(e)
     else:
-        st.info("👆 Please upload an Excel file to get started.")
+        st.info("👆 Please upload a file to get started.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,215 @@
+"""
+Batch-size autotuner for local inference (app.py, cpu_pool.py) and the GPU API server (api_server.py).
+
+autotune() runs the real inference pipeline (inference.predict_labels) over a sample of product-like
+texts at several batch sizes - or, with token budgets, at several padded-token caps per batch - on the
+device the model is loaded on, and measures throughput and peak memory of each probe. The smallest
+setting within 3% of the best throughput (and within the memory limit) wins: same speed, less memory
+and latency. Results are stored per device, model and settings in a JSON file, so the probe runs once
+per machine; the server reports them in /health and clients seed their chunk size from the throughput.
+
+On demand: python autotune.py [--token-budget] [--texts sample.txt]
+Keep this file free of Streamlit imports; upload it next to api_server.py (CPU servers also need low_memory.py
+and pandas for the memory measurement).
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from contextlib import nullcontext
+
+import torch
+
+from inference import predict_labels
+
+AUTOTUNE_PATH = os.getenv("AUTOTUNE_PATH", ".cache/autotune.json")
+DEFAULT_BATCH_SIZES = (8, 16, 32, 64, 128, 256)
+DEFAULT_TOKEN_BUDGETS = (1024, 2048, 4096, 8192, 16384)
+# Settings within this share of the best throughput count as equally fast
+THROUGHPUT_TOLERANCE = 0.03
+
+_WORDS = (
+    "vải dệt thoi dệt kim sợi xơ polyester cotton nylon spandex khổ 1.5m 100% 65% 35% màu trắng đen "
+    "áo quần jacket nữ nam trẻ em nhãn mác dây kéo khóa nút cúc chỉ may cuộn kg mét tấm hàng mới"
+).split()
+
+
+def sample_texts(count, seed=0, min_words=3, max_words=40):
+    """Product-like texts with a spread of lengths, for probing when no real sample is given"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))) for _ in range(count)]
+
+
+def device_description(device):
+    """What a tuning result depends on besides the model: the GPU model or the CPU thread budget"""
+    if device.type == 'cuda':
+        return f"cuda:{torch.cuda.get_device_name(device)}"
+    return f"cpu:{os.cpu_count()}cores:{torch.get_num_threads()}threads"
+
+
+def tuning_key(device, model_name, revision, backend, max_length):
+    return f"{device_description(device)}|{model_name}@{revision}|{backend}|{max_length}"
+
+
+def load_settings(key, path=AUTOTUNE_PATH):
+    """Stored result for key, or None"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+
+
+def save_settings(key, settings, path=AUTOTUNE_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    stored[key] = settings
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stored, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _is_out_of_memory(error):
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+def _probe(texts, tokenizer, model, labels, batch_size, max_length, max_tokens, device):
+    """(texts per second, peak memory MB above the starting point) of one setting"""
+    # One untimed pass so kernel selection / allocator growth are not counted
+    predict_labels(texts[:batch_size], tokenizer, model, labels, batch_size=batch_size, max_length=max_length,
+                   length_bucketing=True, max_tokens=max_tokens)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        start_memory = torch.cuda.memory_allocated(device)
+        measure = nullcontext()
+    else:
+        from low_memory import StageMemory  # needs pandas, so only imported where RSS is the measure
+
+        tracker = StageMemory()
+        measure = tracker.stage("probe")
+    start_time = time.perf_counter()
+    with measure:
+        predict_labels(texts, tokenizer, model, labels, batch_size=batch_size, max_length=max_length,
+                       length_bucketing=True, max_tokens=max_tokens)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+    seconds = time.perf_counter() - start_time
+    if device.type == 'cuda':
+        peak_mb = (torch.cuda.max_memory_allocated(device) - start_memory) / 2**20
+    else:
+        stage = tracker.report()[0]
+        peak_mb = stage['peak_mb'] - stage['start_mb']
+    return len(texts) / seconds, round(peak_mb, 1)
+
+
+def autotune(tokenizer, model, labels, max_length=128, texts=None, batch_sizes=DEFAULT_BATCH_SIZES,
+             token_budgets=None, max_memory_mb=None, texts_per_probe=None, log=print):
+    """
+    Probe batch sizes (or, with token_budgets, padded-token caps at the largest batch size) on the model's
+    device and return the chosen settings:
+    {"batch_size", "max_tokens", "texts_per_second", "peak_memory_mb", "probes": [...], "tuned_at"}.
+    Probing stops at the first out-of-memory error or once a setting goes over max_memory_mb.
+    """
+    device = model.device
+    if device.type == 'cuda' and max_memory_mb is None:
+        max_memory_mb = 0.9 * torch.cuda.get_device_properties(device).total_memory / 2**20
+    if token_budgets:
+        candidates = [(max(batch_sizes), budget) for budget in sorted(token_budgets)]
+    else:
+        candidates = [(batch_size, None) for batch_size in sorted(batch_sizes)]
+    count = texts_per_probe or max(512, 4 * candidates[-1][0])
+    texts = list(texts or sample_texts(count))
+    texts = (texts * (count // max(len(texts), 1) + 1))[:count]
+
+    probes = []
+    for batch_size, max_tokens in candidates:
+        try:
+            texts_per_second, peak_mb = _probe(texts, tokenizer, model, labels, batch_size, max_length, max_tokens, device)
+        except (RuntimeError, MemoryError) as e:
+            if not _is_out_of_memory(e):
+                raise
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+            log(f"   batch {batch_size}, max_tokens {max_tokens}: out of memory, stopping")
+            break
+        probes.append({
+            'batch_size': batch_size,
+            'max_tokens': max_tokens,
+            'texts_per_second': round(texts_per_second, 1),
+            'peak_memory_mb': peak_mb
+        })
+        log(f"   batch {batch_size}, max_tokens {max_tokens}: {texts_per_second:,.0f} texts/s, {peak_mb:,.0f} MB")
+        if max_memory_mb is not None and peak_mb > max_memory_mb:
+            probes[-1]['over_memory'] = True
+            break
+
+    usable = [probe for probe in probes if not probe.get('over_memory')]
+    if not usable:
+        raise RuntimeError("No batch setting fits in memory")
+    best = max(probe['texts_per_second'] for probe in usable)
+    chosen = next(probe for probe in usable if probe['texts_per_second'] >= (1 - THROUGHPUT_TOLERANCE) * best)
+    return dict(chosen, probes=probes, device=device_description(device), tuned_at=time.time())
+
+
+def main(argv=None):
+    from inference import load_pretrained
+
+    parser = argparse.ArgumentParser(description="Probe batch sizes on this machine and store the fastest setting")
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH") or os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric"))
+    parser.add_argument("--revision", default=os.getenv("MODEL_REVISION", "main"))
+    parser.add_argument("--backend", default=os.getenv("INFERENCE_BACKEND", "pytorch").lower())
+    parser.add_argument("--max-length", type=int, default=int(os.getenv("MAX_LENGTH", "128")))
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads (the budget the app will run with)")
+    parser.add_argument("--token-budget", action="store_true", help="Probe padded-token caps instead of batch sizes")
+    parser.add_argument("--texts", help="Text file with one sample product description per line")
+    parser.add_argument("--max-memory-mb", type=float, default=None)
+    parser.add_argument("--path", default=AUTOTUNE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    texts = None
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    labels = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+    tokenizer, model = load_pretrained(args.model, args.revision)
+    if args.backend in ("onnx", "onnx-int8"):
+        from onnx_backend import load_onnx_classifier
+
+        pytorch_model = model
+        model = load_onnx_classifier(tokenizer, lambda: pytorch_model, args.model, args.revision,
+                                     quantize=args.backend == "onnx-int8")
+    else:
+        model = model.to(torch.device(args.device))
+
+    key = tuning_key(model.device, args.model, args.revision, args.backend, args.max_length)
+    print(f"🔧 Autotuning {key}")
+    settings = autotune(
+        tokenizer,
+        model,
+        labels,
+        max_length=args.max_length,
+        texts=texts,
+        token_budgets=DEFAULT_TOKEN_BUDGETS if args.token_budget else None,
+        max_memory_mb=args.max_memory_mb
+    )
+    save_settings(key, settings, args.path)
+    print(f"✅ batch_size={settings['batch_size']}, max_tokens={settings['max_tokens']}: "
+          f"{settings['texts_per_second']:,.0f} texts/s, saved to {args.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
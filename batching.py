@@ -0,0 +1,282 @@
+"""
+Batch scheduling helpers shared by the Streamlit app (app.py) and the GPU API server (api_server.py).
+Keep this file free of Streamlit imports so it can be uploaded to the GPU server next to api_server.py.
+"""
+
+import bisect
+import queue
+import threading
+import time
+
+
+def dedupe_texts(texts):
+    """
+    Collapse identical texts to unique ones (first-seen order).
+    Returns (unique_texts, inverse) where unique_texts[inverse[i]] == texts[i].
+    """
+    positions = {}
+    unique_texts = []
+    inverse = []
+    for text in texts:
+        pos = positions.get(text)
+        if pos is None:
+            pos = len(unique_texts)
+            positions[text] = pos
+            unique_texts.append(text)
+        inverse.append(pos)
+    return unique_texts, inverse
+
+
+def expand_predictions(unique_predictions, inverse):
+    """Map predictions for unique texts back to the original row order"""
+    return [unique_predictions[pos] for pos in inverse]
+
+
+def dedup_ratio(total_count, unique_count):
+    """Fraction of rows that did not need a forward pass (0.0 = no duplicates)"""
+    if total_count == 0:
+        return 0.0
+    return 1.0 - unique_count / total_count
+
+
+def length_bucketed_batches(lengths, batch_size=None, max_tokens=None):
+    """
+    Group row indices into batches of similar token length.
+    Rows are sorted longest first, then cut greedily so a batch never exceeds batch_size rows
+    and, if max_tokens is set, never exceeds max_tokens padded tokens (rows * longest row).
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    current = []
+    current_max = 0
+    for i in order:
+        row_max = max(current_max, lengths[i])
+        too_many_rows = batch_size and len(current) >= batch_size
+        too_many_tokens = max_tokens and current and (len(current) + 1) * row_max > max_tokens
+        if too_many_rows or too_many_tokens:
+            batches.append(current)
+            current = []
+            row_max = lengths[i]
+        current.append(i)
+        current_max = row_max
+    if current:
+        batches.append(current)
+    return batches
+
+
+def snap_length(length, buckets):
+    """Smallest padded length bucket that fits length (buckets sorted ascending, last = max_length)"""
+    return buckets[bisect.bisect_left(buckets, length, hi=len(buckets) - 1)]
+
+
+def batch_shapes(buckets, batch_size, max_tokens=None):
+    """Fixed (rows, padded length) shape per length bucket: batch_size rows, fewer if max_tokens caps it"""
+    return {
+        length: max(1, min(batch_size, max_tokens // length)) if max_tokens else batch_size
+        for length in sorted(buckets)
+    }
+
+
+def shape_bucketed_batches(lengths, shapes):
+    """
+    Group row indices by the length bucket they snap to and cut each group into batches of that
+    bucket's row count. Returns (batches, batch_lengths) with the padded length of every batch.
+    """
+    buckets = sorted(shapes)
+    groups = {}
+    for i, length in enumerate(lengths):
+        groups.setdefault(snap_length(length, buckets), []).append(i)
+    batches = []
+    batch_lengths = []
+    for length in sorted(groups, reverse=True):
+        rows = shapes[length]
+        group = groups[length]
+        for start in range(0, len(group), rows):
+            batches.append(group[start:start + rows])
+            batch_lengths.append(length)
+    return batches, batch_lengths
+
+
+def schedule_batches(texts, tokenizer, batch_size, max_length, length_bucketing=False, max_tokens=None, shapes=None):
+    """
+    Plan the inference batches for texts.
+    Returns (batches, collate): batches is a list of row-index lists and collate(indices)
+    returns padded model inputs (PyTorch tensors) for that batch. Callers scatter results
+    back with the indices, so the original order is always restored.
+
+    Without length_bucketing texts are sliced in upload order (one tokenizer call per batch).
+    With length_bucketing all texts are tokenized up front, sorted by token length and cut
+    into batches of similar length, optionally capped by a max_tokens padded-token budget.
+    Rows may also be token id sequences (pre-tokenized by an API client); those skip the
+    tokenizer and are only truncated to max_length.
+
+    With shapes ({padded_length: rows}, see batch_shapes) every batch is snapped to one of those
+    fixed shapes, for compiled/traced models that should never see a new shape: rows are padded
+    to the bucket length and short batches are filled up by repeating their first row. Only the
+    first len(indices) rows of a batch's output belong to the indices.
+    """
+    if not texts:
+        return [], None
+
+    if shapes:
+        features = encode_rows(texts, tokenizer, max_length)
+        batches, batch_lengths = shape_bucketed_batches([len(row['input_ids']) for row in features], shapes)
+        padded_length = {tuple(indices): length for indices, length in zip(batches, batch_lengths)}
+
+        def collate(indices):
+            length = padded_length[tuple(indices)]
+            rows = [features[i] for i in indices]
+            rows += [rows[0]] * (shapes[length] - len(rows))
+            return tokenizer.pad(rows, padding='max_length', max_length=length, return_tensors="pt")
+
+        return batches, collate
+
+    pretokenized = any(not isinstance(text, str) for text in texts)
+    if not length_bucketing and not pretokenized:
+        batches = [list(range(start, min(start + batch_size, len(texts)))) for start in range(0, len(texts), batch_size)]
+
+        def collate(indices):
+            return tokenizer(
+                texts[indices[0]:indices[-1] + 1],
+                padding=True,  # 'longest' padding is faster than 'max_length'
+                truncation=True,
+                max_length=max_length,
+                return_tensors="pt"
+            )
+
+        return batches, collate
+
+    features = encode_rows(texts, tokenizer, max_length)
+    if length_bucketing:
+        batches = length_bucketed_batches([len(row['input_ids']) for row in features], batch_size, max_tokens)
+    else:
+        batches = [list(range(start, min(start + batch_size, len(texts)))) for start in range(0, len(texts), batch_size)]
+
+    def collate(indices):
+        return tokenizer.pad([features[i] for i in indices], padding=True, return_tensors="pt")
+
+    return batches, collate
+
+
+def encode_rows(texts, tokenizer, max_length):
+    """
+    Tokenizer features (dict per row) for texts; rows that are already token id sequences get
+    the same keys, truncated to max_length keeping the final special token.
+    """
+    strings = [i for i, text in enumerate(texts) if isinstance(text, str)]
+    features = [None] * len(texts)
+    keys = ('input_ids', 'attention_mask')
+    if strings:
+        encodings = tokenizer([texts[i] for i in strings], truncation=True, max_length=max_length)
+        keys = tuple(encodings.keys())
+        for pos, i in enumerate(strings):
+            features[i] = {key: encodings[key][pos] for key in keys}
+    for i, ids in enumerate(texts):
+        if features[i] is not None:
+            continue
+        ids = list(ids)
+        if len(ids) > max_length:
+            ids = ids[:max_length - 1] + ids[-1:]
+        row = {'input_ids': ids, 'attention_mask': [1] * len(ids)}
+        if 'token_type_ids' in keys:
+            row['token_type_ids'] = [0] * len(ids)
+        features[i] = row
+    return features
+
+
+class PrefetchingBatches:
+    """
+    Iterate (indices, inputs) for planned batches while a background thread tokenizes/collates
+    up to `depth` batches ahead into a bounded queue, so tokenization of batch N+1 overlaps the
+    forward pass of batch N (the fast tokenizer releases the GIL). depth=0 collates inline.
+
+    Per-stage seconds are kept in stage_seconds: 'collate' (producer busy time), 'wait' (consumer
+    blocked on the queue) plus anything the caller adds with add_stage (e.g. 'model', or 'encode' for
+    tokenization done up front by schedule_batches, which nothing overlaps).
+    If observer is given, observer('tokenize', seconds) is called for every collated batch.
+    """
+
+    _DONE = object()
+
+    def __init__(self, batches, collate, depth=2, observer=None):
+        self.batches = batches
+        self.collate = collate
+        self.depth = depth
+        self.observer = observer
+        self.stage_seconds = {'collate': 0.0, 'wait': 0.0}
+
+    def _collate(self, indices):
+        start = time.perf_counter()
+        inputs = self.collate(indices)
+        elapsed = time.perf_counter() - start
+        self.stage_seconds['collate'] += elapsed
+        if self.observer is not None:
+            self.observer('tokenize', elapsed)
+        return inputs
+
+    def add_stage(self, stage, seconds):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for indices in self.batches:
+                yield indices, self._collate(indices)
+            return
+
+        ready = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item):
+            # Give up if the consumer stopped iterating early
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for indices in self.batches:
+                    if not put((indices, self._collate(indices))):
+                        return
+                put(self._DONE)
+            except BaseException as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, name="batch-prefetch", daemon=True)
+        producer.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = ready.get()
+                self.stage_seconds['wait'] += time.perf_counter() - start
+                if item is self._DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join(timeout=1)
+
+    def timings(self):
+        """
+        Stage seconds, tokenize_seconds (up-front 'encode' plus 'collate') and the share of that
+        tokenization hidden behind the consumer (1.0 = fully overlapped)
+        """
+        collate_seconds = self.stage_seconds['collate']
+        tokenize_seconds = collate_seconds + self.stage_seconds.get('encode', 0.0)
+        if self.depth <= 0 or tokenize_seconds == 0:
+            overlap = 0.0
+        else:
+            hidden = max(0.0, collate_seconds - self.stage_seconds['wait'])
+            overlap = min(1.0, hidden / tokenize_seconds)
+        timings = {f"{stage}_seconds": round(seconds, 4) for stage, seconds in self.stage_seconds.items()}
+        timings['tokenize_seconds'] = round(tokenize_seconds, 4)
+        timings['overlap_ratio'] = round(overlap, 4)
+        return timings
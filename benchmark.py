@@ -0,0 +1,316 @@
+"""
+Reproducible benchmark for the classification pipeline.
+
+Generates a seeded synthetic corpus of fabric / yarn / fiber descriptions (customs-style #&VN
+suffixes, NPL codes, heavy duplication, skewed lengths) and times each stage:
+  clean      clean_product_string row by row, and clean_product_series
+  tokenize   tokenizer over the cleaned corpus
+  forward    model forward passes (inference.predict_labels)
+  end2end    classify.predict_batch on the raw corpus (clean + dedupe + predict)
+  http       POST /predict against a running api_server.py
+
+Results are written as JSON and can be compared against a stored baseline:
+  python benchmark.py --rows 20000 --output bench.json
+  python benchmark.py --rows 20000 --baseline bench.json --fail-threshold 0.10
+  python benchmark.py --stages clean,http --server http://localhost:5000
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from preprocessing import clean_product_series, clean_product_string
+
+VALID_LABELS = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+ALL_STAGES = ("clean", "tokenize", "forward", "end2end", "http")
+
+_MATERIALS = ["cotton", "polyester", "nylon", "spandex", "rayon", "viscose", "acrylic", "wool", "linen", "modal"]
+_COLORS = ["trắng", "đen", "xanh navy", "đỏ", "xám", "be", "nhiều màu"]
+_TEMPLATES = [
+    "Vải dệt thoi {pct}% {mat} khổ {width}cm",
+    "Vải dệt kim {pct}% {mat} {rest}% {mat2}, định lượng {gsm}g/m2, màu {color}",
+    "Vải không dệt {mat} khổ {width}cm",
+    "Sợi {mat} {den}D/{fil}F",
+    "Sợi se {mat} chi số {ne}/1, màu {color}",
+    "Sợi pha {pct}% {mat} {rest}% {mat2}",
+    "Xơ staple {mat} {dtex}D x {mm}mm",
+    "Xơ {mat} tái chế {dtex}D",
+    "Áo sơ mi nam {pct}% {mat}, size {size}",
+    "Quần jean nữ {pct}% {mat} {rest}% {mat2}, size {size}",
+    "Nhãn vải dệt in logo, kích thước {mm}x{width}mm",
+    "Dây kéo nhựa size {size}, dài {width}cm",
+    "Cúc nhựa 4 lỗ đường kính {mm}mm",
+    "Chỉ may {mat} {ne}/2, cuộn {gsm}m",
+]
+_EXTRA_CLAUSES = [
+    "hàng mới 100%",
+    "dùng trong sản xuất hàng may mặc",
+    "nguyên liệu gia công xuất khẩu",
+    "theo tờ khai số {code}",
+    "đóng gói {gsm} cuộn/kiện",
+    "xuất xứ Việt Nam",
+    "[hàng mẫu] {{không thanh toán}}",
+]
+
+
+def _fill(template, rng):
+    pct = rng.choice([95, 80, 65, 60, 50]) if "{rest}" in template else rng.choice([100, 95, 80, 65])
+    return template.format(
+        pct=pct,
+        rest=100 - pct,
+        mat=rng.choice(_MATERIALS),
+        mat2=rng.choice(_MATERIALS),
+        width=rng.choice([58, 60, 110, 150, 160]),
+        gsm=rng.randint(80, 400),
+        color=rng.choice(_COLORS),
+        den=rng.choice([20, 40, 70, 75, 150, 300]),
+        fil=rng.choice([24, 36, 48, 72, 144]),
+        ne=rng.choice([20, 30, 40, 60]),
+        dtex=rng.choice([1.2, 1.4, 1.5, 3, 6, 15]),
+        mm=rng.choice([5, 10, 32, 38, 51, 64]),
+        size=rng.choice(["S", "M", "L", "XL", "3", "5", "8"]),
+        code=rng.randint(10**9, 10**10)
+    )
+
+
+def synthetic_corpus(rows, duplicate_ratio=0.7, seed=42):
+    """
+    Raw product strings as they come out of customs exports.
+    About duplicate_ratio of the rows repeat an earlier string (Zipf-like popularity), and
+    lengths are skewed: most rows are short, a long tail carries several extra clauses.
+    """
+    rng = random.Random(seed)
+    unique_count = max(1, int(rows * (1 - duplicate_ratio)))
+    uniques = []
+    for i in range(unique_count):
+        text = _fill(rng.choice(_TEMPLATES), rng)
+        extra = min(len(_EXTRA_CLAUSES), int(rng.lognormvariate(0, 1.0)))
+        for clause in rng.sample(_EXTRA_CLAUSES, extra):
+            text += ", " + _fill(clause, rng)
+        roll = rng.random()
+        if roll < 0.3:
+            text = f"NPL{rng.randint(1, 999):03d}#&{text}"
+        if roll < 0.6:
+            text += rng.choice(["#&VN", " #&CN", "#&KR", " #&vn #&JP"])
+        elif roll < 0.7:
+            text += " @"
+        uniques.append(text)
+    weights = [1 / (rank + 1) for rank in range(unique_count)]
+    return uniques + rng.choices(uniques, weights=weights, k=rows - unique_count)
+
+
+def _timed(fn, repeat):
+    """Run fn repeat times; returns (median seconds, last result)"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def _entry(seconds, items):
+    return {'seconds': round(seconds, 4), 'items': items, 'items_per_sec': round(items / seconds, 1) if seconds else None}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def _start_local_server(url, timeout=600):
+    """
+    Start api_server.py in the background and wait until /health answers.
+    The prediction cache and job API are off, so every repeat times real inference.
+    """
+    import requests
+
+    env = {**os.environ, 'PREDICTION_CACHE_PATH': '', 'JOB_DIR': ''}
+    process = subprocess.Popen([sys.executable, "api_server.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("api_server.py exited during startup")
+        try:
+            if requests.get(f"{url}/health", timeout=2).status_code == 200:
+                return process
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    process.terminate()
+    raise RuntimeError("api_server.py did not become healthy in time")
+
+
+def run_benchmark(args):
+    raw = synthetic_corpus(args.rows, duplicate_ratio=args.duplicate_ratio, seed=args.seed)
+    raw_series = pd.Series(raw, dtype=object)
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    results = {}
+
+    cleaned = clean_product_series(raw_series).tolist()
+    cleaned = [t for t in cleaned if t]
+
+    if "clean" in stages:
+        seconds, _ = _timed(lambda: raw_series.apply(clean_product_string), args.repeat)
+        results['clean.clean_product_string'] = _entry(seconds, len(raw))
+        seconds, _ = _timed(lambda: clean_product_series(raw_series), args.repeat)
+        results['clean.clean_product_series'] = _entry(seconds, len(raw))
+
+    tokenizer = model = None
+    if any(s in stages for s in ("tokenize", "forward", "end2end")):
+        from inference import load_pretrained
+
+        tokenizer, model = load_pretrained(args.model, args.revision)
+
+    if "tokenize" in stages:
+        def tokenize():
+            for i in range(0, len(cleaned), args.batch_size):
+                tokenizer(cleaned[i:i + args.batch_size], padding=True, truncation=True, max_length=args.max_length, return_tensors="pt")
+        seconds, _ = _timed(tokenize, args.repeat)
+        results['tokenize'] = _entry(seconds, len(cleaned))
+
+    if "forward" in stages:
+        from inference import predict_labels
+
+        for bucketing in (False, True):
+            timings = {}
+            seconds, _ = _timed(
+                lambda: predict_labels(
+                    cleaned, tokenizer, model, VALID_LABELS,
+                    batch_size=args.batch_size, max_length=args.max_length,
+                    length_bucketing=bucketing, timings=timings
+                ),
+                args.repeat
+            )
+            name = 'forward.bucketed' if bucketing else 'forward.upload_order'
+            results[name] = _entry(seconds, len(cleaned))
+            results[name]['timings'] = timings
+
+    if "end2end" in stages:
+        from classify import predict_batch
+
+        def end_to_end():
+            texts = [t for t in clean_product_series(raw_series).tolist() if t]
+            return predict_batch(texts, tokenizer, model, batch_size=args.batch_size, dedupe=True)
+        seconds, _ = _timed(end_to_end, args.repeat)
+        results['end2end.predict_batch'] = _entry(seconds, len(raw))
+
+    if "http" in stages:
+        import requests
+
+        server = None
+        url = args.server or "http://127.0.0.1:5000"
+        if not args.server:
+            server = _start_local_server(url)
+        try:
+            session = requests.Session()
+
+            def post_all():
+                for i in range(0, len(cleaned), args.http_chunk_size):
+                    response = session.post(f"{url}/predict", json={'texts': cleaned[i:i + args.http_chunk_size], 'dedupe': True}, timeout=600)
+                    response.raise_for_status()
+            seconds, _ = _timed(post_all, args.repeat)
+            results['http.predict'] = _entry(seconds, len(cleaned))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    meta = {
+        'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'rows': args.rows,
+        'unique_rows': len(set(raw)),
+        'duplicate_ratio': args.duplicate_ratio,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'batch_size': args.batch_size,
+        'max_length': args.max_length,
+        'model': args.model if model is not None else None
+    }
+    if model is not None:
+        import torch
+
+        meta['torch'] = torch.__version__
+        meta['device'] = str(model.device)
+    return {'meta': meta, 'results': results}
+
+
+def compare(report, baseline, fail_threshold=None):
+    """Print a stage-by-stage comparison; returns the names of stages slower than fail_threshold"""
+    regressions = []
+    print(f"{'stage':<32}{'baseline s':>12}{'current s':>12}{'change':>10}")
+    for name, entry in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('seconds'):
+            print(f"{name:<32}{'-':>12}{entry['seconds']:>12.4f}{'new':>10}")
+            continue
+        change = entry['seconds'] / base['seconds'] - 1
+        flag = ""
+        if fail_threshold is not None and change > fail_threshold:
+            regressions.append(name)
+            flag = " ❌"
+        print(f"{name:<32}{base['seconds']:>12.4f}{entry['seconds']:>12.4f}{change*100:>9.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the fabric classification pipeline")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage (median is reported)")
+    parser.add_argument("--stages", default="clean,tokenize,forward,end2end", help=f"Comma-separated subset of: {','.join(ALL_STAGES)}")
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH") or os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric"))
+    parser.add_argument("--revision", default=os.getenv("MODEL_REVISION", "main"))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-length", type=int, default=int(os.getenv("MAX_LENGTH", "128")))
+    parser.add_argument("--server", help="Base URL of a running api_server.py (default: start one locally)")
+    parser.add_argument("--http-chunk-size", type=int, default=2000)
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON")
+    parser.add_argument("--fail-threshold", type=float, help="Exit 1 if a stage is slower than baseline by more than this fraction")
+    parser.add_argument("--dump-corpus", help="Write the synthetic corpus (one text per line) and exit")
+    args = parser.parse_args(argv)
+
+    if args.dump_corpus:
+        with open(args.dump_corpus, "w", encoding="utf-8") as f:
+            f.writelines(f"{text}\n" for text in synthetic_corpus(args.rows, args.duplicate_ratio, args.seed))
+        return 0
+
+    unknown = set(s.strip() for s in args.stages.split(",") if s.strip()) - set(ALL_STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.fail_threshold)
+        if regressions:
+            print(f"❌ Slower than baseline: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
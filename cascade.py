@@ -0,0 +1,312 @@
+"""
+Confidence-gated cascade: a cheap classifier answers the rows it is sure about and only the rest
+are escalated to the transformer.
+
+The cheap model is a linear classifier over hashed character n-grams, distilled from the
+transformer's own labels (e.g. the label_predict column of a results file downloaded from the app).
+Prediction needs only numpy; training needs torch.
+
+    python cascade.py train results.xlsx --column product_clean --label-column label_predict
+    python cascade.py train raw.xlsx --column "Mô tả" --raw    # clean, then label with the local transformer
+    python cascade.py evaluate results.xlsx --column product_clean --label-column label_predict
+
+Keep this file free of Streamlit imports so the API server and headless jobs can use it.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_MODEL_PATH = ".cache/cascade.npz"
+DEFAULT_NUM_BUCKETS = 2 ** 18
+NGRAM_RANGE = (2, 4)
+PREDICT_CHUNK_SIZE = 20_000  # texts featurized at once (bounds the gathered weight matrix)
+
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+def hashed_ngrams(texts, num_buckets, ngram_range=NGRAM_RANGE):
+    """
+    Hashed character n-grams of every text (lowercased, padded with one space on each side).
+    Returns (ids, offsets) in torch.nn.EmbeddingBag layout: the n-gram bucket ids of text i are
+    ids[offsets[i]:offsets[i + 1]]. Every text has at least one n-gram. Hashing is vectorized
+    over all texts and stable across processes.
+    """
+    padded = [f" {text.lower().replace(chr(0), ' ')} " for text in texts]
+    lengths = np.fromiter((len(text) for text in padded), dtype=np.int64, count=len(padded))
+    codes = np.frombuffer("\x00".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    row_of = np.repeat(np.arange(len(padded)), lengths + 1)[:len(codes)]
+    separators = np.concatenate(([0], np.cumsum(codes == 0)))
+
+    all_ids = []
+    all_rows = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        count = len(codes) - n + 1
+        if count <= 0:
+            continue
+        hashes = np.full(count, 0xCBF29CE484222325 ^ n, dtype=np.uint64)
+        for k in range(n):
+            hashes = (hashes ^ codes[k:k + count]) * _HASH_MULTIPLIER
+        hashes ^= hashes >> np.uint64(29)
+        inside = separators[n:n + count] == separators[:count]  # window does not cross a text boundary
+        all_ids.append((hashes[inside] % np.uint64(num_buckets)).astype(np.int64))
+        all_rows.append(row_of[:count][inside])
+
+    rows = np.concatenate(all_rows)
+    order = np.argsort(rows, kind="stable")
+    counts = np.bincount(rows, minlength=len(padded))
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.concatenate(all_ids)[order], offsets
+
+
+class NgramClassifier:
+    """Linear model over hashed character n-grams: softmax(mean of n-gram weight rows + bias)"""
+
+    def __init__(self, weights, bias, labels, threshold=0.95, report=None, ngram_range=NGRAM_RANGE):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = list(labels)
+        self.threshold = threshold
+        self.report = report or {}
+        self.ngram_range = tuple(ngram_range)
+
+    def predict_proba(self, texts):
+        """Label probabilities, shape [len(texts), len(labels)]"""
+        probabilities = np.empty((len(texts), len(self.labels)), dtype=np.float32)
+        for start in range(0, len(texts), PREDICT_CHUNK_SIZE):
+            chunk = texts[start:start + PREDICT_CHUNK_SIZE]
+            ids, offsets = hashed_ngrams(chunk, len(self.weights), self.ngram_range)
+            counts = np.diff(np.append(offsets, len(ids)))
+            logits = np.add.reduceat(self.weights[ids], offsets, axis=0) / counts[:, None] + self.bias
+            logits -= logits.max(axis=1, keepdims=True)
+            exp = np.exp(logits)
+            probabilities[start:start + len(chunk)] = exp / exp.sum(axis=1, keepdims=True)
+        return probabilities
+
+    def predict(self, texts):
+        """Returns (labels, confidences)"""
+        probabilities = self.predict_proba(texts)
+        label_ids = probabilities.argmax(axis=1)
+        return [self.labels[i] for i in label_ids], probabilities[np.arange(len(texts)), label_ids]
+
+    def fingerprint(self):
+        """Short digest of the weights and labels, so results of different cascade models can be told apart"""
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(self.weights.tobytes())
+        digest.update(self.bias.tobytes())
+        digest.update(json.dumps([self.labels, list(self.ngram_range)], ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            weights=self.weights,
+            bias=self.bias,
+            meta=np.array(json.dumps({
+                'labels': self.labels,
+                'threshold': self.threshold,
+                'report': self.report,
+                'ngram_range': list(self.ngram_range)
+            }, ensure_ascii=False))
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(data['weights'], data['bias'], meta['labels'], meta['threshold'], meta['report'], meta['ngram_range'])
+
+    @classmethod
+    def train(cls, texts, labels, label_names, num_buckets=DEFAULT_NUM_BUCKETS, epochs=5, batch_size=512,
+              learning_rate=0.2, seed=0):
+        """Fit on (text, transformer label) pairs with torch (Adagrad on sparse n-gram embeddings)"""
+        import torch
+
+        torch.manual_seed(seed)
+        label_ids = {label: i for i, label in enumerate(label_names)}
+        targets = torch.tensor([label_ids[label] for label in labels])
+        ids, offsets = hashed_ngrams(texts, num_buckets)
+        ids = torch.from_numpy(ids)
+        offsets = torch.from_numpy(np.append(offsets, len(ids)))
+
+        embedding = torch.nn.EmbeddingBag(num_buckets, len(label_names), mode="mean", sparse=True)
+        torch.nn.init.zeros_(embedding.weight)
+        bias = torch.nn.Parameter(torch.zeros(len(label_names)))
+        optimizer = torch.optim.Adagrad([embedding.weight, bias], lr=learning_rate)
+        rng = random.Random(seed)
+        starts = list(range(0, len(texts), batch_size))
+        for _ in range(epochs):
+            rng.shuffle(starts)
+            for start in starts:
+                end = min(start + batch_size, len(texts))
+                batch_ids = ids[offsets[start]:offsets[end]]
+                batch_offsets = offsets[start:end] - offsets[start]
+                loss = torch.nn.functional.cross_entropy(embedding(batch_ids, batch_offsets) + bias, targets[start:end])
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+        return cls(embedding.weight.detach().numpy(), bias.detach().numpy(), label_names)
+
+
+def calibrate_threshold(confidences, agree, target_agreement):
+    """
+    Lowest confidence threshold at which the rows answered by the cheap model still agree with the
+    transformer at least target_agreement of the time (1.0 = escalate everything if none does).
+    """
+    order = np.argsort(-confidences, kind="stable")
+    running_agreement = np.cumsum(agree[order]) / np.arange(1, len(order) + 1)
+    ok = np.nonzero(running_agreement >= target_agreement)[0]
+    if len(ok) == 0:
+        return 1.0
+    return float(confidences[order][ok[-1]])
+
+
+def evaluate(classifier, texts, labels, threshold=None):
+    """Agreement with the transformer labels overall and on the rows the cascade would answer"""
+    threshold = classifier.threshold if threshold is None else threshold
+    predictions, confidences = classifier.predict(texts)
+    agree = np.array([p == label for p, label in zip(predictions, labels)])
+    answered = confidences >= threshold
+    return {
+        'rows': len(texts),
+        'threshold': round(float(threshold), 4),
+        'agreement_all': round(float(agree.mean()), 4) if len(agree) else None,
+        'escalation_rate': round(float(1 - answered.mean()), 4) if len(agree) else None,
+        'agreement_answered': round(float(agree[answered].mean()), 4) if answered.any() else None
+    }
+
+
+def train_cascade(texts, labels, label_names, target_agreement=0.99, holdout=0.1, seed=0, **train_kwargs):
+    """
+    Train on the pairs minus a held-out slice, pick the threshold on the held-out slice for target_agreement,
+    then refit on everything. The held-out numbers are kept in classifier.report.
+    """
+    pairs = list(zip(texts, labels))
+    random.Random(seed).shuffle(pairs)
+    split = max(1, int(len(pairs) * (1 - holdout))) if len(pairs) > 1 else len(pairs)
+    train_texts, train_labels = [p[0] for p in pairs[:split]], [p[1] for p in pairs[:split]]
+    holdout_texts, holdout_labels = [p[0] for p in pairs[split:]], [p[1] for p in pairs[split:]]
+
+    classifier = NgramClassifier.train(train_texts, train_labels, label_names, seed=seed, **train_kwargs)
+    threshold = 1.0
+    report = {'train_rows': len(train_texts), 'holdout_rows': len(holdout_texts), 'target_agreement': target_agreement}
+    if holdout_texts:
+        predictions, confidences = classifier.predict(holdout_texts)
+        agree = np.array([p == label for p, label in zip(predictions, holdout_labels)])
+        threshold = calibrate_threshold(confidences, agree, target_agreement)
+        report.update({'holdout_' + key: value for key, value in evaluate(classifier, holdout_texts, holdout_labels, threshold).items()})
+
+    classifier = NgramClassifier.train([p[0] for p in pairs], [p[1] for p in pairs], label_names, seed=seed, **train_kwargs)
+    classifier.threshold = threshold
+    classifier.report = report
+    return classifier
+
+
+def summarize(counts):
+    """Add escalation_rate and agreement to cascade counts (rows, escalated, audited, agreed)"""
+    summary = dict(counts)
+    summary['escalation_rate'] = round(counts['escalated'] / counts['rows'], 4) if counts['rows'] else 0.0
+    summary['agreement'] = round(counts['agreed'] / counts['audited'], 4) if counts['audited'] else None
+    return summary
+
+
+def run_cascade(texts, classifier, escalate_fn, threshold=None, audit_rate=0.0, stats=None, seed=0):
+    """
+    Answer texts whose cheap-model confidence reaches threshold; send the rest to escalate_fn(texts) -> labels.
+    A random audit_rate share of the answered rows is also sent to escalate_fn: they get the transformer
+    label and measure agreement between the two models. Fills stats['cascade'] (see summarize).
+    """
+    threshold = classifier.threshold if threshold is None else threshold
+    predictions, confidences = classifier.predict(texts)
+    escalated = [i for i, confidence in enumerate(confidences) if confidence < threshold]
+    answered = [i for i, confidence in enumerate(confidences) if confidence >= threshold]
+    audited = random.Random(seed).sample(answered, int(len(answered) * audit_rate)) if audit_rate else []
+
+    to_send = escalated + audited
+    agreed = 0
+    if to_send:
+        transformer_predictions = escalate_fn([texts[i] for i in to_send])
+        for i, label in zip(audited, transformer_predictions[len(escalated):]):
+            agreed += predictions[i] == label
+        for i, label in zip(to_send, transformer_predictions):
+            predictions[i] = label
+
+    if stats is not None:
+        stats['cascade'] = summarize({
+            'rows': len(texts),
+            'escalated': len(escalated),
+            'audited': len(audited),
+            'agreed': agreed,
+            'threshold': round(float(threshold), 4)
+        })
+    return predictions
+
+
+def _load_pairs(args, label_names):
+    from ingestion import read_table
+    from preprocessing import clean_product_series
+
+    with open(args.input, "rb") as f:
+        df = read_table(f, args.input)
+    texts = df[args.column].astype(str)
+    if args.raw:
+        texts = clean_product_series(texts)
+    keep = (texts.str.len() > 0) & ~texts.str.contains(r'\?', na=False)
+    if args.label_column:
+        keep &= df[args.label_column].isin(label_names)
+        return texts[keep].tolist(), df.loc[keep, args.label_column].tolist()
+
+    from inference import load_pretrained, predict_labels
+
+    texts = texts[keep].tolist()
+    print(f"🏷️ Labelling {len(texts)} texts with {args.model}...", file=sys.stderr)
+    tokenizer, model = load_pretrained(args.model, args.revision)
+    return texts, predict_labels(texts, tokenizer, model, label_names, length_bucketing=True)
+
+
+def main(argv=None):
+    label_names = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+    parser = argparse.ArgumentParser(description="Train or evaluate the cascade's n-gram classifier")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("input", help="xlsx/csv/parquet with the product texts")
+    parser.add_argument("--column", default="product_clean", help="Column with the product texts")
+    parser.add_argument("--label-column", help="Column with transformer labels (default: label with the local model)")
+    parser.add_argument("--raw", action="store_true", help="The column holds raw strings; clean them first")
+    parser.add_argument("--model-path", default=os.getenv("CASCADE_MODEL_PATH", DEFAULT_MODEL_PATH))
+    parser.add_argument("--target-agreement", type=float, default=0.99, help="Agreement the answered rows must keep")
+    parser.add_argument("--threshold", type=float, help="evaluate: override the stored threshold")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH") or os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric"))
+    parser.add_argument("--revision", default=os.getenv("MODEL_REVISION", "main"))
+    args = parser.parse_args(argv)
+
+    texts, labels = _load_pairs(args, label_names)
+    if not texts:
+        print("❌ No labelled rows found", file=sys.stderr)
+        return 1
+
+    if args.command == "evaluate":
+        report = evaluate(NgramClassifier.load(args.model_path), texts, labels, args.threshold)
+        print(json.dumps(report, indent=2))
+        return 0
+
+    start_time = time.time()
+    classifier = train_cascade(texts, labels, label_names, target_agreement=args.target_agreement, epochs=args.epochs)
+    classifier.save(args.model_path)
+    print(json.dumps(classifier.report, indent=2))
+    print(f"✅ Trained on {len(texts)} rows in {time.time() - start_time:.1f}s, threshold {classifier.threshold:.4f} "
+          f"-> {args.model_path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,733 @@
+"""
+Headless batch classification: the model loading and prediction path of app.py without Streamlit.
+
+app.py imports its configuration, load_model and predict_batch from here, so the UI, nightly jobs and
+benchmark.py all run the same code (GPU API endpoints with failover, local CPU / ONNX / worker pool,
+prediction cache, dedupe, cascade). Cleaning is preprocessing.clean_product_string / clean_product_series.
+
+Command line (scheduled jobs):
+    python classify.py products.xlsx labeled.xlsx --column "Tên hàng"
+    python classify.py products.parquet labeled.csv --column name --stream --endpoints http://a:5000,http://b:5000
+    python classify.py products.csv labeled.parquet --column name --backend onnx-int8 --workers 4
+--stream reads only the product column in chunks and writes each chunk as soon as it is labeled (source row,
+product column, product_clean, label_predict), so memory stays flat for very large inputs. A throughput
+summary is printed at the end.
+Keep this file free of Streamlit imports.
+"""
+
+import argparse
+import functools
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+from batching import dedupe_texts, expand_predictions, dedup_ratio
+from prediction_cache import PredictionCache
+from preprocessing import clean_product_series
+from api_client import GpuApiError, MultiEndpointClient, is_ready, parse_endpoints, wait_until_ready
+from cascade import NgramClassifier, run_cascade, summarize
+from ingestion import count_rows, file_format, iter_column_chunks, read_table
+# torch/transformers (and inference.py, cpu_pool.py) are imported only when local inference is needed,
+# so GPU API sessions never pay for them
+
+# Try to load .env file if it exists (for local development)
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # dotenv not required on HF Spaces
+
+# Model configuration
+MODEL_NAME = os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric")
+MODEL_PATH = os.getenv("MODEL_PATH", None)
+VALID_LABELS = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "128"))
+MODEL_REVISION = os.getenv("MODEL_REVISION", "main")
+
+# Local inference batching: sort texts by token length so short texts are not padded to the longest one.
+# MAX_BATCH_TOKENS (0 = off) caps each batch by padded tokens instead of a fixed row count.
+LENGTH_BUCKETING = os.getenv("LENGTH_BUCKETING", "1").lower() in ("1", "true", "yes")
+MAX_BATCH_TOKENS = int(os.getenv("MAX_BATCH_TOKENS", "0"))
+# Batches tokenized ahead by a background thread while the model runs (0 = tokenize inline)
+PREFETCH_BATCHES = int(os.getenv("PREFETCH_BATCHES", "2"))
+
+# Worker processes for preprocessing very large files (1 = single process)
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "1"))
+
+# Rows per chunk in large file mode (streaming ingestion)
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "50000"))
+
+# Local CPU inference worker processes (1 = run in the app process) and torch threads per worker (0 = auto)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "1"))
+CPU_THREADS_PER_WORKER = int(os.getenv("CPU_THREADS_PER_WORKER", "0"))
+
+# Local inference backend: "pytorch" (default), "onnx" or "onnx-int8" (ONNX Runtime on CPU, see onnx_backend.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "pytorch").lower()
+
+# Local batch size/token cap come from autotune.py's stored result for this machine (default 32);
+# AUTOTUNE=1 probes once on first use when nothing is stored
+AUTOTUNE = os.getenv("AUTOTUNE", "0").lower() in ("1", "true", "yes")
+
+# GPU API client: chunks kept in flight at once, initial chunk size (adapted to observed latency),
+# target seconds per chunk and retries per chunk
+API_MAX_IN_FLIGHT = int(os.getenv("API_MAX_IN_FLIGHT", "2"))
+API_CHUNK_SIZE = int(os.getenv("API_CHUNK_SIZE", "2000"))
+API_TARGET_CHUNK_SECONDS = float(os.getenv("API_TARGET_CHUNK_SECONDS", "10"))
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+# Wire format ("auto" = binary when the server offers it, see wire_protocol.py) and whether to send
+# token ids instead of texts (moves tokenization from the GPU server to this machine)
+API_WIRE_FORMAT = os.getenv("API_WIRE_FORMAT", "auto").lower()
+API_PRETOKENIZE = os.getenv("API_PRETOKENIZE", "0").lower() in ("1", "true", "yes")
+# Uploads with at least this many rows go through the server's resumable job API (0 disables)
+API_JOB_MIN_ROWS = int(os.getenv("API_JOB_MIN_ROWS", "50000"))
+# With several endpoints in GPU_API_ENDPOINT: chunks slower than this latency percentile are re-sent to
+# another endpoint (0 disables hedging), and a failed endpoint gets no chunks for this many seconds
+API_HEDGE_PERCENTILE = float(os.getenv("API_HEDGE_PERCENTILE", "95"))
+API_FAILOVER_COOLDOWN = float(os.getenv("API_FAILOVER_COOLDOWN", "30"))
+
+# Persistent prediction cache (set PREDICTION_CACHE_PATH to an empty string to disable)
+PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH", ".cache/prediction_cache.sqlite3")
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "1000000"))
+
+# Cascade: n-gram classifier trained with `python cascade.py train` answers confident rows,
+# the rest go to the transformer. Threshold 0 uses the one calibrated at training time;
+# the audit rate is the share of answered rows re-checked by the transformer to measure agreement.
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH", ".cache/cascade.npz")
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0"))
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", "0.02"))
+
+# GPU API configuration (for vast.ai GPU server)
+# Set GPU_API_ENDPOINT environment variable in Streamlit Cloud to enable GPU acceleration
+# Example: GPU_API_ENDPOINT=http://143.55.45.86:5000
+# Several endpoints (comma separated) share the work: GPU_API_ENDPOINT=http://host-a:5000,http://host-b:5000
+# When renting new GPU, update this value in Streamlit Cloud Secrets
+# Current GPU: ssh -p 54754 root@143.55.45.86
+GPU_API_ENDPOINT = os.getenv("GPU_API_ENDPOINT", None)
+HEALTH_TTL_SECONDS = float(os.getenv("HEALTH_TTL_SECONDS", "30"))  # Reuse the last /health result this long
+API_WARMUP_WAIT_SECONDS = float(os.getenv("API_WARMUP_WAIT_SECONDS", "300"))  # Wait this long for a warming-up server before using the local model
+
+def notify(message):
+    """User-facing warnings and errors; printed here, app.py shows them on the page instead"""
+    print(message, file=sys.stderr)
+
+def apply_inference_backend(tokenizer, model):
+    """Swap the PyTorch model for an ONNX Runtime session if INFERENCE_BACKEND asks for it"""
+    if INFERENCE_BACKEND == "pytorch":
+        return model
+    if INFERENCE_BACKEND not in ("onnx", "onnx-int8"):
+        notify(f"⚠️ Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}', using PyTorch")
+        return model
+    try:
+        from onnx_backend import load_onnx_classifier
+        return load_onnx_classifier(
+            tokenizer,
+            lambda: model,
+            MODEL_PATH if MODEL_PATH and Path(MODEL_PATH).exists() else MODEL_NAME,
+            MODEL_REVISION,
+            quantize=INFERENCE_BACKEND == "onnx-int8"
+        )
+    except Exception as e:
+        notify(f"⚠️ ONNX backend unavailable ({str(e)}), using PyTorch")
+        return model
+
+# Loaded once per process (the app and the on-demand CPU fallback share this copy)
+@functools.lru_cache(maxsize=None)
+def load_model():
+    """Load the model and tokenizer from Hugging Face or local path"""
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    
+    # Try loading from local path first if specified
+    if MODEL_PATH and Path(MODEL_PATH).exists():
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+            model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
+            model.eval()
+            return tokenizer, apply_inference_backend(tokenizer, model)
+        except Exception as e:
+            notify(f"⚠️ Failed to load from local path: {str(e)}")
+            notify("🔄 Trying to load from Hugging Face instead...")
+    
+    # Try loading from Hugging Face with multiple fallback methods
+    try:
+        # Load tokenizer first
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+        
+        # Try different methods to load the model
+        model = None
+        last_error = None
+        
+        # Method 1: Standard AutoModel load
+        try:
+            model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+        except Exception as e1:
+            last_error = e1
+            # Method 2: With trust_remote_code
+            try:
+                model = AutoModelForSequenceClassification.from_pretrained(
+                    MODEL_NAME, 
+                    revision=MODEL_REVISION,
+                    trust_remote_code=True
+                )
+            except Exception as e2:
+                last_error = e2
+                # Method 3: Load with explicit XLM-RoBERTa class
+                try:
+                    from transformers import XLMRobertaForSequenceClassification
+                    model = XLMRobertaForSequenceClassification.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+                except Exception as e3:
+                    last_error = e3
+                    # Method 4: Load base model and configure
+                    try:
+                        from transformers import XLMRobertaConfig
+                        config = XLMRobertaConfig.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+                        config.num_labels = len(VALID_LABELS)
+                        from transformers import XLMRobertaForSequenceClassification
+                        model = XLMRobertaForSequenceClassification.from_pretrained(
+                            MODEL_NAME,
+                            revision=MODEL_REVISION,
+                            config=config,
+                            ignore_mismatched_sizes=True
+                        )
+                    except Exception as e4:
+                        last_error = e4
+        
+        if model is None:
+            raise last_error
+        
+        model.eval()
+        return tokenizer, apply_inference_backend(tokenizer, model)
+        
+    except Exception as e:
+        raise RuntimeError(f"Error loading model: {e}") from e
+
+@functools.lru_cache(maxsize=None)
+def get_prediction_cache():
+    """Open the persistent prediction cache (None if disabled or unavailable)"""
+    if not PREDICTION_CACHE_PATH:
+        return None
+    try:
+        return PredictionCache(
+            PREDICTION_CACHE_PATH,
+            model_name=MODEL_NAME,
+            revision=MODEL_REVISION,
+            backend=INFERENCE_BACKEND,
+            max_length=MAX_LENGTH,
+            max_entries=PREDICTION_CACHE_MAX_ENTRIES
+        )
+    except Exception:
+        # The cache is an optimization only - never block predictions on it
+        return None
+
+@functools.lru_cache(maxsize=None)
+def get_cascade_classifier():
+    """Load the cascade's n-gram classifier (None if it has not been trained)"""
+    if not CASCADE_MODEL_PATH or not Path(CASCADE_MODEL_PATH).exists():
+        return None
+    try:
+        return NgramClassifier.load(CASCADE_MODEL_PATH)
+    except Exception:
+        return None
+
+_cpu_pools = []  # every pool get_cpu_pool started, for close_cpu_pools
+
+@functools.lru_cache(maxsize=None)
+def get_cpu_pool(tokenizer, model):
+    """Worker processes, each with its own model copy and slice of the cores (started once per app process)"""
+    from cpu_pool import CpuInferencePool
+    
+    pool = CpuInferencePool(
+        tokenizer,
+        model,
+        labels=VALID_LABELS,
+        workers=CPU_WORKERS,
+        threads_per_worker=CPU_THREADS_PER_WORKER or None,
+        model_name=MODEL_PATH if MODEL_PATH and Path(MODEL_PATH).exists() else MODEL_NAME,
+        revision=MODEL_REVISION,
+        max_length=MAX_LENGTH,
+        length_bucketing=LENGTH_BUCKETING,
+        max_tokens=MAX_BATCH_TOKENS,
+        prefetch=PREFETCH_BATCHES
+    )
+    _cpu_pools.append(pool)
+    return pool
+
+def close_cpu_pools():
+    """Stop the worker processes of every pool get_cpu_pool started"""
+    while _cpu_pools:
+        _cpu_pools.pop().close()
+    get_cpu_pool.cache_clear()
+
+@functools.lru_cache(maxsize=None)
+def get_local_tuning(tokenizer, model):
+    """Batch settings autotune.py stored for this machine and model (probed once with AUTOTUNE=1), or None"""
+    try:
+        from autotune import autotune, load_settings, save_settings, tuning_key
+        
+        model_name = MODEL_PATH if MODEL_PATH and Path(MODEL_PATH).exists() else MODEL_NAME
+        key = tuning_key(model.device, model_name, MODEL_REVISION, INFERENCE_BACKEND, MAX_LENGTH)
+        settings = load_settings(key)
+        if settings is None and AUTOTUNE:
+            notify("🔧 Tuning the batch size for this machine (first run only)...")
+            settings = autotune(tokenizer, model, VALID_LABELS, max_length=MAX_LENGTH, log=lambda message: None)
+            save_settings(key, settings)
+        return settings
+    except Exception:
+        # Tuning is an optimization only - fall back to the default batch size
+        return None
+
+@functools.lru_cache(maxsize=None)
+def get_api_client(api_endpoint):
+    """Pooled GPU API client for every endpoint in api_endpoint, kept across reruns so connections are reused"""
+    return MultiEndpointClient(
+        parse_endpoints(api_endpoint),
+        hedge_percentile=API_HEDGE_PERCENTILE,
+        failover_cooldown=API_FAILOVER_COOLDOWN,
+        health_ttl=HEALTH_TTL_SECONDS,
+        max_in_flight=API_MAX_IN_FLIGHT,
+        chunk_size=API_CHUNK_SIZE,
+        target_chunk_seconds=API_TARGET_CHUNK_SECONDS,
+        max_retries=API_MAX_RETRIES,
+        wire_format=API_WIRE_FORMAT
+    )
+
+def predict_batch_api(texts, api_endpoint, progress_callback=None, tokenizer=None, fallback=None):
+    """
+    Predict using GPU API endpoint(s) (vast.ai).
+    Chunks are pipelined over pooled sessions, sized from observed server latency,
+    retried with backoff on failure and reassembled in order (see api_client.py).
+    With several endpoints, chunks are routed by health and throughput, a failed
+    endpoint's unanswered rows move to the others and slow chunks are hedged;
+    fallback(texts) classifies only the rows no endpoint answered.
+    The wire format is negotiated from the last health check; with a tokenizer and
+    API_PRETOKENIZE enabled, texts are sent as token ids.
+    Inputs of API_JOB_MIN_ROWS rows or more run as a server-side job, so a rerun after a
+    disconnect re-attaches to the same job instead of starting over.
+    """
+    client = get_api_client(api_endpoint)
+    try:
+        if API_JOB_MIN_ROWS and len(texts) >= API_JOB_MIN_ROWS and client.jobs_available:
+            return client.run_job(texts, progress_callback)
+        return client.predict(
+            texts,
+            progress_callback,
+            tokenizer=tokenizer if API_PRETOKENIZE else None,
+            fallback=fallback
+        )
+    except GpuApiError as e:
+        # Re-check the endpoint on the next call instead of trusting the cached health state
+        client.invalidate_health()
+        # Hide IP addresses from error messages
+        error_msg = re.sub(r'\d+\.\d+\.\d+\.\d+', '[IP_HIDDEN]', str(e))
+        notify(f"❌ {error_msg}")
+        raise GpuApiError(error_msg, e.partial_predictions)
+
+def predict_batch(texts, tokenizer, model, batch_size=None, progress_callback=None, use_gpu_api=False, gpu_api_endpoint=None, dedupe=False, stats=None, cache=None, length_bucketing=LENGTH_BUCKETING, max_tokens=MAX_BATCH_TOKENS, cascade=None):
+    """
+    Predict labels for a batch of texts.
+    Uses GPU API if available, otherwise falls back to local model (CPU).
+
+    With dedupe=True only unique texts are classified and labels are mapped back
+    to the original order. If a stats dict is passed, it receives total/unique
+    counts and the dedup ratio.
+    If a PredictionCache is passed, cached texts are answered from disk and only
+    the misses are classified (and then written back to the cache). The cache is keyed by
+    the local backend, so it is skipped while the GPU API answers: the server keeps its own
+    cache under the backend it runs.
+    For local inference, length_bucketing groups texts of similar token length
+    into the same batch (optionally capped by max_tokens padded tokens) and
+    restores the original order afterwards. Without a batch_size, the settings
+    autotune.py stored for this machine are used (32 if there are none).
+    With a cascade classifier, rows it is confident about are answered by it and only the
+    rest (plus a small audit sample) go through the cache/dedupe/model path below;
+    stats['cascade'] receives the escalation rate and the audited agreement.
+    """
+    if cascade is not None:
+        def escalate(escalated_texts):
+            return predict_batch(
+                escalated_texts,
+                tokenizer,
+                model,
+                batch_size=batch_size,
+                progress_callback=progress_callback,
+                use_gpu_api=use_gpu_api,
+                gpu_api_endpoint=gpu_api_endpoint,
+                dedupe=dedupe,
+                stats=stats,
+                cache=cache,
+                length_bucketing=length_bucketing,
+                max_tokens=max_tokens
+            )
+        return run_cascade(
+            texts,
+            cascade,
+            escalate,
+            threshold=CASCADE_THRESHOLD or None,
+            audit_rate=CASCADE_AUDIT_RATE,
+            stats=stats
+        )
+    
+    if cache is not None and use_gpu_api and gpu_api_endpoint:
+        if is_ready(get_api_client(gpu_api_endpoint).health_state(HEALTH_TTL_SECONDS)):
+            cache = None
+    
+    if cache is not None:
+        cached = cache.get_many(texts)
+        missing_texts = [text for text in texts if text not in cached]
+        if stats is not None:
+            stats['cache_hits'] = len(texts) - len(missing_texts)
+        if missing_texts:
+            missing_predictions = predict_batch(
+                missing_texts,
+                tokenizer,
+                model,
+                batch_size=batch_size,
+                progress_callback=progress_callback,
+                use_gpu_api=use_gpu_api,
+                gpu_api_endpoint=gpu_api_endpoint,
+                dedupe=dedupe,
+                stats=stats,
+                length_bucketing=length_bucketing,
+                max_tokens=max_tokens
+            )
+            cache.put_many(zip(missing_texts, missing_predictions))
+            cached.update(zip(missing_texts, missing_predictions))
+        return [cached[text] for text in texts]
+    
+    if dedupe:
+        unique_texts, inverse = dedupe_texts(texts)
+        if stats is not None:
+            stats['total'] = len(texts)
+            stats['unique'] = len(unique_texts)
+            stats['dedup_ratio'] = dedup_ratio(len(texts), len(unique_texts))
+        unique_predictions = predict_batch(
+            unique_texts,
+            tokenizer,
+            model,
+            batch_size=batch_size,
+            progress_callback=progress_callback,
+            use_gpu_api=use_gpu_api,
+            gpu_api_endpoint=gpu_api_endpoint,
+            stats=stats,
+            length_bucketing=length_bucketing,
+            max_tokens=max_tokens
+        )
+        return expand_predictions(unique_predictions, inverse)
+    
+    # Priority: GPU API > Local Model
+    if use_gpu_api and gpu_api_endpoint:
+        try:
+            # Test API connection first (cached for HEALTH_TTL_SECONDS)
+            if is_ready(get_api_client(gpu_api_endpoint).health_state(HEALTH_TTL_SECONDS)):
+                def predict_locally(remaining_texts):
+                    # Only rows no endpoint could answer; the model is loaded on demand
+                    local_tokenizer, local_model = (tokenizer, model) if model is not None else load_model()
+                    return predict_batch(
+                        remaining_texts,
+                        local_tokenizer,
+                        local_model,
+                        batch_size=batch_size,
+                        progress_callback=progress_callback,
+                        length_bucketing=length_bucketing,
+                        max_tokens=max_tokens
+                    )
+                # Silently use GPU - no message to users
+                return predict_batch_api(texts, gpu_api_endpoint, progress_callback, tokenizer, fallback=predict_locally)
+            else:
+                # Silently fallback to CPU
+                pass
+        except GpuApiError as e:
+            # Keep the rows the API already answered, only the rest falls back to CPU (loaded on demand)
+            partial_predictions = e.partial_predictions
+            local_tokenizer, local_model = (tokenizer, model) if model is not None else load_model()
+            return partial_predictions + predict_batch(
+                texts[len(partial_predictions):],
+                local_tokenizer,
+                local_model,
+                batch_size=batch_size,
+                progress_callback=progress_callback,
+                length_bucketing=length_bucketing,
+                max_tokens=max_tokens
+            )
+        except (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError, Exception):
+            # Silently fallback to CPU - don't show errors to users
+            pass
+    
+    # Fallback to local model (CPU) - model must be loaded
+    if model is None or tokenizer is None:
+        raise ValueError("Model and tokenizer must be loaded when GPU API is not available")
+    
+    if batch_size is None:
+        tuning = get_local_tuning(tokenizer, model)
+        batch_size = tuning['batch_size'] if tuning else 32
+        if tuning and tuning.get('max_tokens') and not max_tokens:
+            max_tokens = tuning['max_tokens']
+    
+    if CPU_WORKERS > 1:
+        # Sharded across worker processes, each with its own slice of the cores
+        return get_cpu_pool(tokenizer, model).predict(
+            texts,
+            progress_callback,
+            batch_size=batch_size,
+            max_tokens=max_tokens,
+            length_bucketing=length_bucketing
+        )
+    
+    from inference import predict_labels
+    
+    timings = {}
+    predictions = predict_labels(
+        texts,
+        tokenizer,
+        model,
+        VALID_LABELS,
+        batch_size=batch_size,
+        max_length=MAX_LENGTH,
+        length_bucketing=length_bucketing,
+        max_tokens=max_tokens,
+        prefetch=PREFETCH_BATCHES,
+        progress_callback=progress_callback,
+        timings=timings
+    )
+    if stats is not None:
+        stats['pipeline'] = timings
+    return predictions
+
+def valid_rows(clean):
+    """Rows worth classifying: cleaned text is non-empty and has no '?' (unreadable characters)"""
+    return (clean.str.len() > 0) & ~clean.str.contains(r'\?', na=False)
+
+class TableWriter:
+    """Writes DataFrame chunks one after another into a single .xlsx, .csv or .parquet file"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.format = file_format(path)
+        if self.format == 'xls':
+            raise ValueError("Writing .xls is not supported, use .xlsx")
+        self.rows = 0
+        self._workbook = None
+        self._sheet = None
+        self._parquet = None
+    
+    def write(self, df):
+        if self.format == 'csv':
+            df.to_csv(self.path, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        elif self.format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table.cast(self._parquet.schema))
+        else:
+            if self._workbook is None:
+                from openpyxl import Workbook
+                
+                # Write-only: rows go to a temporary file instead of staying in memory as cell objects
+                self._workbook = Workbook(write_only=True)
+                self._sheet = self._workbook.create_sheet()
+                self._sheet.append([str(column) for column in df.columns])
+            values = df.astype(object)
+            for row in values.where(values.notna(), None).itertuples(index=False, name=None):
+                self._sheet.append(row)
+        self.rows += len(df)
+    
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._workbook is not None:
+            self._workbook.save(self.path)
+
+def _print_progress(progress, batch_idx, total_batches, processed, total):
+    if batch_idx % 10 == 0 or batch_idx == total_batches:
+        print(f"   Predicted {processed:,}/{total:,} texts ({progress*100:.0f}%)")
+
+def _add_stats(totals, chunk_stats):
+    for key in ('total', 'unique', 'cache_hits'):
+        totals[key] += chunk_stats.get(key, 0)
+    if 'cascade' in chunk_stats:
+        for key in ('rows', 'escalated', 'audited', 'agreed'):
+            totals['cascade'][key] += chunk_stats['cascade'][key]
+        totals['cascade']['threshold'] = chunk_stats['cascade']['threshold']
+
+def classify_file(input_path, output_path, column, tokenizer, model, use_gpu_api, gpu_api_endpoint,
+                  dedupe=True, cascade=None, cache=None, stream=False, chunk_size=STREAM_CHUNK_SIZE,
+                  preprocess_workers=PREPROCESS_WORKERS):
+    """
+    Clean, filter and classify column of input_path and write the labeled rows to output_path.
+    Without stream, all columns are kept plus 'product_clean' and 'label_predict'; with stream only the
+    column is read, chunk by chunk, and each chunk is written as soon as it is labeled.
+    Returns stats: rows read/labeled, label counts and the summed dedupe/cache/cascade counters.
+    """
+    stats = {
+        'rows_read': 0,
+        'rows_labeled': 0,
+        'labels': {},
+        'total': 0,
+        'unique': 0,
+        'cache_hits': 0,
+        'cascade': {'rows': 0, 'escalated': 0, 'audited': 0, 'agreed': 0}
+    }
+    if stream:
+        total_rows = count_rows(input_path, input_path)
+        chunks = iter_column_chunks(input_path, input_path, column, chunk_size=chunk_size)
+    else:
+        df = read_table(input_path, input_path)
+        if column not in df.columns:
+            raise KeyError(f"Column '{column}' not found in the file")
+        total_rows = len(df)
+        chunks = [df]
+    
+    writer = TableWriter(output_path)
+    try:
+        for chunk in chunks:
+            values = chunk if stream else chunk[column]
+            stats['rows_read'] += len(values)
+            
+            clean = clean_product_series(values.astype(str), n_jobs=preprocess_workers)
+            valid = valid_rows(clean)
+            texts = clean[valid].tolist()
+            chunk_stats = {}
+            predictions = predict_batch(
+                texts,
+                tokenizer,
+                model,
+                progress_callback=None if stream else _print_progress,
+                use_gpu_api=use_gpu_api,
+                gpu_api_endpoint=gpu_api_endpoint,
+                dedupe=dedupe,
+                stats=chunk_stats,
+                cache=cache,
+                cascade=cascade
+            ) if texts else []
+            _add_stats(stats, chunk_stats)
+            
+            if stream:
+                labeled = pd.DataFrame({
+                    'source_row': values.index[valid] + 2,  # 1-based file row, after the header
+                    column: values[valid].astype(str).to_numpy(),
+                    'product_clean': texts,
+                    'label_predict': predictions
+                })
+                print(f"   Processed {stats['rows_read']:,}{f'/{total_rows:,}' if total_rows else ''} rows "
+                      f"({stats['rows_labeled'] + len(texts):,} labeled)")
+            else:
+                labeled = chunk[valid.to_numpy()].copy()
+                labeled['product_clean'] = texts
+                labeled['label_predict'] = predictions
+            writer.write(labeled)
+            stats['rows_labeled'] += len(texts)
+            for label, count in pd.Series(predictions, dtype=object).value_counts().items():
+                stats['labels'][label] = stats['labels'].get(label, 0) + int(count)
+    finally:
+        writer.close()
+    return stats
+
+def main(argv=None):
+    global INFERENCE_BACKEND, CPU_WORKERS, CPU_THREADS_PER_WORKER
+    
+    parser = argparse.ArgumentParser(description="Classify the product column of a file without the Streamlit UI")
+    parser.add_argument("input", help="Input .xlsx, .xls, .csv or .parquet file")
+    parser.add_argument("output", help="Output .xlsx, .csv or .parquet file")
+    parser.add_argument("--column", required=True, help="Column with the product descriptions")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=("pytorch", "onnx", "onnx-int8"),
+                        help="Local inference backend (used when no endpoint answers)")
+    parser.add_argument("--workers", type=int, default=CPU_WORKERS, help="Local CPU inference worker processes")
+    parser.add_argument("--threads-per-worker", type=int, default=CPU_THREADS_PER_WORKER, help="torch threads per worker (0 = auto)")
+    parser.add_argument("--endpoints", default=GPU_API_ENDPOINT,
+                        help="Comma-separated GPU API endpoints (default: GPU_API_ENDPOINT); empty for local only")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read only the product column in chunks and write each chunk as soon as it is labeled")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE, help="Rows per chunk with --stream")
+    parser.add_argument("--preprocess-workers", type=int, default=PREPROCESS_WORKERS)
+    parser.add_argument("--no-dedupe", action="store_true", help="Classify duplicate texts separately")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the persistent prediction cache")
+    parser.add_argument("--cascade", action="store_true", help="Answer confident rows with the n-gram model first")
+    args = parser.parse_args(argv)
+    
+    INFERENCE_BACKEND = args.backend
+    CPU_WORKERS = args.workers
+    CPU_THREADS_PER_WORKER = args.threads_per_worker
+    for path in (args.input, args.output):
+        try:
+            file_format(path)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    start_time = time.perf_counter()
+    gpu_api_endpoint = args.endpoints or None
+    health = get_api_client(gpu_api_endpoint).health_state(HEALTH_TTL_SECONDS) if gpu_api_endpoint else None
+    if health is not None and not is_ready(health):
+        print(f"⏳ GPU API is warming up, waiting up to {API_WARMUP_WAIT_SECONDS:.0f}s...")
+        health = wait_until_ready(get_api_client(gpu_api_endpoint), API_WARMUP_WAIT_SECONDS, HEALTH_TTL_SECONDS)
+    use_gpu_api = health is not None
+    tokenizer, model = None, None
+    if use_gpu_api:
+        print(f"🚀 GPU API: {health['healthy_endpoints']}/{len(health['endpoints'])} endpoints healthy")
+    else:
+        if gpu_api_endpoint:
+            print("⚠️ GPU API not responding, using the local model")
+        print(f"🔄 Loading model ({INFERENCE_BACKEND}, {CPU_WORKERS} worker{'s' if CPU_WORKERS != 1 else ''})...")
+        tokenizer, model = load_model()
+    cascade = get_cascade_classifier() if args.cascade else None
+    if args.cascade and cascade is None:
+        print(f"⚠️ No cascade model at {CASCADE_MODEL_PATH}, classifying every row with the transformer")
+    setup_seconds = time.perf_counter() - start_time
+    
+    print(f"📄 Classifying '{args.column}' of {args.input}{' (streaming)' if args.stream else ''}")
+    try:
+        stats = classify_file(
+            args.input,
+            args.output,
+            args.column,
+            tokenizer,
+            model,
+            use_gpu_api,
+            gpu_api_endpoint,
+            dedupe=not args.no_dedupe,
+            cascade=cascade,
+            cache=None if args.no_cache else get_prediction_cache(),
+            stream=args.stream,
+            chunk_size=args.chunk_size,
+            preprocess_workers=args.preprocess_workers
+        )
+    except (KeyError, ValueError) as e:
+        print(f"❌ {e.args[0] if e.args else e}")
+        return 1
+    finally:
+        close_cpu_pools()
+    seconds = time.perf_counter() - start_time - setup_seconds
+    
+    rows_read, rows_labeled = stats['rows_read'], stats['rows_labeled']
+    print(f"\n✅ {rows_labeled:,} of {rows_read:,} rows labeled ({rows_read - rows_labeled:,} invalid) -> {args.output}")
+    print(f"⏱️ {seconds:.1f}s ({rows_read / max(seconds, 1e-9):,.0f} rows/s read, "
+          f"{rows_labeled / max(seconds, 1e-9):,.0f} rows/s labeled), setup {setup_seconds:.1f}s")
+    if stats['total']:
+        print(f"   Unique texts: {stats['unique']:,}/{stats['total']:,} "
+              f"({dedup_ratio(stats['total'], stats['unique'])*100:.0f}% duplicates)")
+    if stats['cache_hits']:
+        print(f"   Prediction cache hits: {stats['cache_hits']:,}")
+    if stats['cascade']['rows']:
+        cascade_stats = summarize(stats['cascade'])
+        print(f"   Cascade: {cascade_stats['escalation_rate']*100:.1f}% escalated to the transformer")
+    if use_gpu_api:
+        client = get_api_client(gpu_api_endpoint)
+        for endpoint in client.stats()['endpoints']:
+            print(f"   Endpoint {endpoint['endpoint']}: {endpoint['rows']:,} rows, {endpoint['failures']} failures")
+        if client.fallback_rows:
+            print(f"   Local fallback: {client.fallback_rows:,} rows")
+    for label, count in sorted(stats['labels'].items(), key=lambda item: -item[1]):
+        print(f"   {label}: {count:,}")
+    if rows_labeled == 0:
+        print("❌ No valid rows after preprocessing!")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
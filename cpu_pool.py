@@ -0,0 +1,161 @@
+"""
+Multi-process CPU inference pool.
+
+Intra-op threading in a single PyTorch process stops scaling after a few cores, so this shards the
+work across N worker processes, each running its own model with a small torch.set_num_threads budget.
+Workers start from a clean forkserver (spawn where that is unavailable) and load the model themselves:
+forking a multithreaded parent - the Streamlit server, or torch after its first forward pass - can
+deadlock the children. CPU_POOL_START_METHOD=fork shares the parent's weights copy-on-write instead,
+for single-threaded parents that create the pool before running any inference.
+
+Headless use: python cpu_pool.py texts.txt --workers 8 [--output labels.txt]
+Keep this file free of Streamlit imports.
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import torch
+
+from inference import load_pretrained, predict_labels
+
+# Set in the parent right before the workers are forked, inherited copy-on-write
+_inherited = {}
+# Per-process worker state
+_worker = {}
+
+
+def _init_worker(num_threads, model_name, revision, onnx_path, settings):
+    torch.set_num_threads(num_threads)
+    if onnx_path:
+        from onnx_backend import OnnxClassifier
+
+        tokenizer = _inherited.get('tokenizer') or load_pretrained(model_name, revision)[0]
+        model = OnnxClassifier(onnx_path, num_threads=num_threads)
+    elif 'model' in _inherited:
+        tokenizer, model = _inherited['tokenizer'], _inherited['model']
+    else:
+        tokenizer, model = load_pretrained(model_name, revision)
+    _worker.update(tokenizer=tokenizer, model=model, settings=settings)
+
+
+def _predict_chunk(task):
+    texts, overrides = task
+    return predict_labels(texts, _worker['tokenizer'], _worker['model'], **{**_worker['settings'], **overrides})
+
+
+class CpuInferencePool:
+    """N worker processes, each holding the model; predict() splits texts into chunks and merges results in order"""
+
+    def __init__(self, tokenizer, model, labels, workers=None, threads_per_worker=None, model_name=None,
+                 revision="main", batch_size=32, max_length=128, length_bucketing=True, max_tokens=None,
+                 prefetch=2, chunk_size=512, start_method=None):
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or max(1, cpu_count // 4)
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // self.workers)
+        self.chunk_size = chunk_size
+
+        start_method = start_method or os.getenv("CPU_POOL_START_METHOD") or (
+            "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        )
+        onnx_path = getattr(model, 'path', None) if hasattr(model, 'session') else None
+        if start_method == "fork":
+            _inherited['tokenizer'] = tokenizer
+            if onnx_path is None:
+                _inherited['model'] = model
+        elif model_name is None:
+            raise ValueError("model_name is required when workers cannot be forked")
+
+        settings = {
+            'labels': labels,
+            'batch_size': batch_size,
+            'max_length': max_length,
+            'length_bucketing': length_bucketing,
+            'max_tokens': max_tokens,
+            'prefetch': prefetch
+        }
+        context = mp.get_context(start_method)
+        self._pool = context.Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, model_name, revision, onnx_path, settings)
+        )
+        _inherited.clear()
+
+    def predict(self, texts, progress_callback=None, **settings):
+        """
+        Predict labels for texts across the workers, in input order.
+        settings (batch_size, max_tokens, length_bucketing, ...) override the pool's defaults for this call;
+        None values are ignored.
+        progress_callback(progress, chunk_idx, total_chunks, processed, total) is called per finished chunk.
+        """
+        overrides = {key: value for key, value in settings.items() if value is not None}
+        chunks = [(texts[i:i + self.chunk_size], overrides) for i in range(0, len(texts), self.chunk_size)]
+        predictions = []
+        for chunk_idx, chunk_predictions in enumerate(self._pool.imap(_predict_chunk, chunks), 1):
+            predictions.extend(chunk_predictions)
+            if progress_callback:
+                progress_callback(chunk_idx / len(chunks), chunk_idx, len(chunks), len(predictions), len(texts))
+        return predictions
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+def main(argv=None):
+    import pandas as pd
+
+    from preprocessing import clean_product_series
+
+    parser = argparse.ArgumentParser(description="Classify product texts (one per line) with a multi-process CPU pool")
+    parser.add_argument("input", help="Text file with one product description per line")
+    parser.add_argument("--output", help="Write one label per line here (default: stdout)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CPU_WORKERS", "0")) or None)
+    parser.add_argument("--threads-per-worker", type=int, default=int(os.getenv("CPU_THREADS_PER_WORKER", "0")) or None)
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH") or os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric"))
+    parser.add_argument("--revision", default=os.getenv("MODEL_REVISION", "main"))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-length", type=int, default=int(os.getenv("MAX_LENGTH", "128")))
+    args = parser.parse_args(argv)
+
+    labels = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+    with open(args.input, encoding="utf-8") as f:
+        texts = clean_product_series(pd.Series([line.rstrip("\n") for line in f], dtype=object)).tolist()
+
+    tokenizer, model = load_pretrained(args.model, args.revision)
+    pool = CpuInferencePool(
+        tokenizer,
+        model,
+        labels,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        model_name=args.model,
+        revision=args.revision,
+        batch_size=args.batch_size,
+        max_length=args.max_length
+    )
+    start_time = time.time()
+    try:
+        predictions = pool.predict(texts)
+    finally:
+        pool.close()
+    elapsed_time = time.time() - start_time
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for label in predictions:
+            output.write(f"{label}\n")
+    finally:
+        if args.output:
+            output.close()
+    print(f"✅ {len(texts)} texts in {elapsed_time:.2f}s ({len(texts)/max(elapsed_time, 1e-9):.1f} texts/sec) "
+          f"with {pool.workers} workers x {pool.threads_per_worker} threads", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
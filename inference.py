@@ -0,0 +1,104 @@
+"""
+Local model inference shared by the Streamlit app (app.py), the GPU API server (api_server.py)
+and the multi-process CPU pool (cpu_pool.py).
+Keep this file free of Streamlit imports so it can run in worker processes and headless jobs.
+"""
+
+import time
+
+import torch
+
+from batching import PrefetchingBatches, schedule_batches
+
+
+def load_pretrained(model_name_or_path, revision="main"):
+    """Load tokenizer and classifier from the Hub or a local path (no Streamlit, raises on failure)"""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, revision=revision)
+    try:
+        model = AutoModelForSequenceClassification.from_pretrained(model_name_or_path, revision=revision)
+    except Exception:
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_name_or_path,
+            revision=revision,
+            trust_remote_code=True
+        )
+    model.eval()
+    return tokenizer, model
+
+
+def predict_labels(texts, tokenizer, model, labels, batch_size=32, max_length=128, length_bucketing=False,
+                   max_tokens=None, prefetch=2, progress_callback=None, timings=None, observer=None,
+                   probabilities=None, shapes=None):
+    """
+    Run the model over texts and return labels in input order.
+    Batches are planned by schedule_batches (optionally length-bucketed) and tokenized ahead
+    by PrefetchingBatches. progress_callback(progress, batch_idx, total_batches, processed, total)
+    is called after every batch; if a timings dict is passed it receives the per-stage seconds.
+    observer(stage, seconds) is called per batch for 'tokenize', 'transfer' and 'forward'.
+    If a probabilities list is passed it receives one float32 numpy row per text, in input order.
+    Texts may also be token id sequences (see batching.schedule_batches).
+    With shapes every batch is snapped to a fixed (rows, padded length) shape for compiled models.
+    """
+    device = model.device
+    predictions = [None] * len(texts)
+    if probabilities is not None:
+        probabilities[:] = [None] * len(texts)
+    encode_start = time.perf_counter()
+    batches, collate = schedule_batches(
+        texts,
+        tokenizer,
+        batch_size=batch_size,
+        max_length=max_length,
+        length_bucketing=length_bucketing,
+        max_tokens=max_tokens,
+        shapes=shapes
+    )
+    total_batches = len(batches)
+    processed = 0
+
+    # Batches are tokenized (padding='longest' within the batch) by a background thread
+    pipeline = PrefetchingBatches(batches, collate, depth=prefetch, observer=observer)
+    # Length bucketing and fixed shapes tokenize every text before the first batch: not overlapped
+    encode_seconds = time.perf_counter() - encode_start
+    pipeline.add_stage('encode', encode_seconds)
+    if observer is not None:
+        observer('tokenize', encode_seconds)
+    for batch_idx, (indices, inputs) in enumerate(pipeline, 1):
+        model_start = time.perf_counter()
+
+        # Move to device (with non_blocking for faster transfer if CUDA)
+        if device.type == 'cuda':
+            inputs = {k: v.to(device, non_blocking=True) for k, v in inputs.items()}
+        else:
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+        forward_start = time.perf_counter()
+
+        # Predict
+        with torch.no_grad():
+            outputs = model(**inputs)
+            logits = outputs.logits
+            probs = torch.nn.functional.softmax(logits, dim=-1)
+            pred_ids = torch.argmax(probs, dim=-1).cpu().numpy()
+        model_end = time.perf_counter()
+        pipeline.add_stage('model', model_end - model_start)
+        if observer is not None:
+            # non_blocking copies finish inside the forward pass, so on CUDA part of the transfer is counted there
+            observer('transfer', forward_start - model_start)
+            observer('forward', model_end - forward_start)
+
+        # Convert to labels and scatter back to input order (rows beyond indices are shape padding)
+        for row_idx, pred_id in zip(indices, pred_ids):
+            predictions[row_idx] = labels[pred_id]
+        if probabilities is not None:
+            for row_idx, row in zip(indices, probs.float().cpu().numpy()):
+                probabilities[row_idx] = row
+        processed += len(indices)
+
+        if progress_callback:
+            progress_callback(batch_idx / total_batches, batch_idx, total_batches, processed, len(texts))
+
+    if timings is not None:
+        timings.update(pipeline.timings())
+    return predictions
@@ -0,0 +1,150 @@
+"""
+File ingestion for the classifier: whole-table reads for small files and streaming, column-only
+chunked reads for very large ones.
+
+iter_column_chunks reads just the selected column, chunk by chunk (openpyxl read-only mode for .xlsx,
+chunked readers for .csv and .parquet), so memory stays flat regardless of file size and cleaning /
+prediction can start on the first chunk before the rest of the file is parsed.
+Keep this file free of Streamlit imports so headless jobs can use it.
+"""
+
+import numpy as np
+import pandas as pd
+
+SUPPORTED_EXTENSIONS = ('xlsx', 'xls', 'csv', 'parquet')
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+def file_format(filename):
+    """Lower-case extension without the dot ('xlsx', 'csv', ...)"""
+    extension = str(filename).rsplit('.', 1)[-1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Unsupported file type '.{extension}' (expected one of: {', '.join(SUPPORTED_EXTENSIONS)})")
+    return extension
+
+
+def _rewind(file):
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+
+def read_table(file, filename):
+    """Read the whole file into a DataFrame"""
+    fmt = file_format(filename)
+    _rewind(file)
+    if fmt in ('xlsx', 'xls'):
+        return pd.read_excel(file)
+    if fmt == 'csv':
+        return pd.read_csv(file)
+    return pd.read_parquet(file)
+
+
+def read_preview(file, filename, nrows=10):
+    """First nrows rows (all columns) without parsing the rest of the file"""
+    fmt = file_format(filename)
+    _rewind(file)
+    if fmt in ('xlsx', 'xls'):
+        df = pd.read_excel(file, nrows=nrows)
+    elif fmt == 'csv':
+        df = pd.read_csv(file, nrows=nrows)
+    else:
+        import pyarrow.parquet as pq
+
+        batch = next(pq.ParquetFile(file).iter_batches(batch_size=nrows), None)
+        df = batch.to_pandas() if batch is not None else pd.DataFrame()
+    _rewind(file)
+    return df
+
+
+def read_columns(file, filename):
+    """Column names only"""
+    fmt = file_format(filename)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        _rewind(file)
+        names = pq.ParquetFile(file).schema_arrow.names
+        _rewind(file)
+        return names
+    return read_preview(file, filename, nrows=0).columns.tolist()
+
+
+def _xlsx_column_chunks(file, column, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        # pandas names unnamed headers "Unnamed: N" - accept both spellings
+        names = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+        if str(column) not in names:
+            raise KeyError(f"Column '{column}' not found in the file")
+        col = names.index(str(column)) + 1
+
+        chunk = []
+        for (value,) in sheet.iter_rows(min_row=2, min_col=col, max_col=col, values_only=True):
+            chunk.append(value)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def iter_column_chunks(file, filename, column, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the selected column as consecutive pd.Series chunks of up to chunk_size rows.
+    The index is the 0-based data row position in the file, so chunks can be merged back
+    in order. Empty cells come through as NaN, as with pd.read_excel.
+    """
+    fmt = file_format(filename)
+    _rewind(file)
+    start = 0
+
+    if fmt == 'xlsx':
+        chunks = _xlsx_column_chunks(file, column, chunk_size)
+    elif fmt == 'xls':
+        # xlrd has no streaming mode: read the one column, then slice it
+        values = pd.read_excel(file, usecols=[column])[column].tolist()
+        chunks = (values[i:i + chunk_size] for i in range(0, len(values), chunk_size))
+    elif fmt == 'csv':
+        chunks = (df[column].tolist() for df in pd.read_csv(file, usecols=[column], chunksize=chunk_size))
+    else:
+        import pyarrow.parquet as pq
+
+        chunks = (
+            batch.column(0).to_pylist()
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size, columns=[column])
+        )
+
+    for values in chunks:
+        series = pd.Series(values, index=pd.RangeIndex(start, start + len(values)), name=column, dtype=object)
+        series[series.isna()] = np.nan
+        start += len(values)
+        yield series
+
+
+def count_rows(file, filename):
+    """Cheap data-row count where the format stores it (None if unknown without a full scan)"""
+    fmt = file_format(filename)
+    _rewind(file)
+    try:
+        if fmt == 'xlsx':
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(file, read_only=True)
+            try:
+                max_row = workbook.worksheets[0].max_row
+            finally:
+                workbook.close()
+            return max_row - 1 if max_row else None
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+
+            return pq.ParquetFile(file).metadata.num_rows
+        return None
+    finally:
+        _rewind(file)
@@ -0,0 +1,240 @@
+"""
+Asynchronous, resumable classification jobs for the GPU API server (api_server.py).
+
+A job is a directory under JOB_DIR holding the submitted texts, a meta.json with status and progress,
+and one checkpoint file per finished chunk of predictions. A single background worker processes
+queued jobs chunk by chunk; after a server restart every queued or running job is picked up again
+and only the chunks without a checkpoint are classified.
+Keep this file free of Streamlit and torch imports so it can be uploaded next to api_server.py.
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _write_json(path, payload):
+    """Write JSON atomically (temp file + rename) so a crash never leaves a half-written checkpoint"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class JobStore:
+    """On-disk layout of jobs: <root>/<job_id>/{meta.json, input.json, chunks/<index>.json}"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _job_dir(self, job_id):
+        if not job_id or not all(c.isalnum() or c == '-' for c in job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.root, job_id)
+
+    def _chunk_path(self, job_id, index):
+        return os.path.join(self._job_dir(job_id), "chunks", f"{index:06d}.json")
+
+    def create(self, texts, chunk_size, dedupe=True, key=None):
+        """Persist a new job (input first, then meta) and return its meta"""
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(os.path.join(job_dir, "chunks"))
+        _write_json(os.path.join(job_dir, "input.json"), texts)
+        now = time.time()
+        meta = {
+            'job_id': job_id,
+            'key': key,
+            'status': QUEUED,
+            'total': len(texts),
+            'chunk_size': chunk_size,
+            'total_chunks': (len(texts) + chunk_size - 1) // chunk_size,
+            'completed_chunks': 0,
+            'processed': 0,
+            'dedupe': dedupe,
+            'created_at': now,
+            'updated_at': now,
+            'error': None
+        }
+        self.save_meta(meta)
+        return meta
+
+    def save_meta(self, meta):
+        meta['updated_at'] = time.time()
+        with self._lock:
+            _write_json(os.path.join(self._job_dir(meta['job_id']), "meta.json"), meta)
+
+    def meta(self, job_id):
+        """Meta of a job; raises KeyError if it does not exist"""
+        path = os.path.join(self._job_dir(job_id), "meta.json")
+        try:
+            with self._lock:
+                return _read_json(path)
+        except FileNotFoundError:
+            raise KeyError(job_id)
+
+    def jobs(self):
+        """Meta of every job on disk (oldest first)"""
+        metas = []
+        for job_id in os.listdir(self.root):
+            try:
+                metas.append(self.meta(job_id))
+            except (KeyError, ValueError, OSError):
+                continue  # half-created or foreign directory
+        return sorted(metas, key=lambda meta: meta['created_at'])
+
+    def find_by_key(self, key):
+        """Latest job submitted with this client key that has not failed, or None"""
+        matches = [meta for meta in self.jobs() if meta.get('key') == key and meta['status'] != FAILED]
+        return matches[-1] if matches else None
+
+    def texts(self, job_id):
+        return _read_json(os.path.join(self._job_dir(job_id), "input.json"))
+
+    def has_chunk(self, job_id, index):
+        return os.path.exists(self._chunk_path(job_id, index))
+
+    def save_chunk(self, job_id, index, predictions):
+        _write_json(self._chunk_path(job_id, index), predictions)
+
+    def load_chunk(self, job_id, index):
+        return _read_json(self._chunk_path(job_id, index))
+
+    def delete(self, job_id):
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+
+class JobManager:
+    """
+    Background worker running jobs from a JobStore with predict_fn(texts, dedupe) -> predictions.
+    Call start() once; it re-queues every job a previous process left queued or running.
+    """
+
+    def __init__(self, store, predict_fn, chunk_size=5000, retention_seconds=24 * 3600):
+        self.store = store
+        self.predict_fn = predict_fn
+        self.chunk_size = chunk_size
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="job-worker", daemon=True)
+
+    def start(self):
+        resumed = 0
+        for meta in self.store.jobs():
+            if meta['status'] in (QUEUED, RUNNING):
+                self._queue.put(meta['job_id'])
+                resumed += 1
+        self._thread.start()
+        return resumed
+
+    def submit(self, texts, dedupe=True, key=None, chunk_size=None):
+        """
+        Queue a job and return its meta. With a key, an existing queued/running/done job submitted
+        under the same key is returned instead, so a client that lost its job id can pick it up again.
+        """
+        self.cleanup()
+        if key:
+            existing = self.store.find_by_key(key)
+            if existing is not None and existing['total'] == len(texts):
+                return existing
+        meta = self.store.create(texts, chunk_size or self.chunk_size, dedupe=dedupe, key=key)
+        self._queue.put(meta['job_id'])
+        return meta
+
+    def status(self, job_id):
+        meta = self.store.meta(job_id)
+        meta['progress'] = round(meta['processed'] / meta['total'], 4) if meta['total'] else 1.0
+        return meta
+
+    def results(self, job_id, offset=0, limit=None):
+        """
+        Predictions of the finished prefix of the job from offset (up to limit rows).
+        Available while the job is still running, so clients can page through completed rows.
+        """
+        meta = self.store.meta(job_id)
+        chunk_size = meta['chunk_size']
+        end = meta['processed'] if limit is None else min(meta['processed'], offset + limit)
+        predictions = []
+        for index in range(offset // chunk_size, (end + chunk_size - 1) // chunk_size):
+            chunk = self.store.load_chunk(job_id, index)
+            start = index * chunk_size
+            predictions.extend(chunk[max(offset - start, 0):end - start])
+        return predictions
+
+    def delete(self, job_id):
+        self.store.meta(job_id)
+        self.store.delete(job_id)
+
+    def cleanup(self):
+        """Delete finished or failed jobs older than retention_seconds"""
+        if not self.retention_seconds:
+            return
+        cutoff = time.time() - self.retention_seconds
+        for meta in self.store.jobs():
+            if meta['status'] in (DONE, FAILED) and meta['updated_at'] < cutoff:
+                self.store.delete(meta['job_id'])
+
+    def stats(self):
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for meta in self.store.jobs():
+            counts[meta['status']] = counts.get(meta['status'], 0) + 1
+        return {'queue_depth': self._queue.qsize(), 'chunk_size': self.chunk_size, 'jobs': counts}
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run_job(job_id)
+            except KeyError:
+                continue  # deleted while queued
+            except Exception as e:
+                traceback.print_exc()
+                try:
+                    meta = self.store.meta(job_id)
+                except KeyError:
+                    continue  # deleted while running
+                meta['status'] = FAILED
+                meta['error'] = str(e)
+                self.store.save_meta(meta)
+
+    def _run_job(self, job_id):
+        meta = self.store.meta(job_id)
+        if meta['status'] in (DONE, FAILED):
+            return
+        texts = self.store.texts(job_id)
+        chunk_size = meta['chunk_size']
+        meta['status'] = RUNNING
+        self.store.save_meta(meta)
+        print(f"🗂️ Job {job_id}: {meta['total']} texts in {meta['total_chunks']} chunks")
+
+        for index in range(meta['total_chunks']):
+            start = index * chunk_size
+            chunk = texts[start:start + chunk_size]
+            if not self.store.has_chunk(job_id, index):
+                self.store.save_chunk(job_id, index, self.predict_fn(chunk, meta['dedupe']))
+            meta['completed_chunks'] = index + 1
+            meta['processed'] = start + len(chunk)
+            self.store.save_meta(meta)
+
+        meta['status'] = DONE
+        self.store.save_meta(meta)
+        print(f"✅ Job {job_id} done")
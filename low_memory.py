@@ -0,0 +1,147 @@
+"""
+Memory-bounded processing helpers for million-row files (app.py low-memory mode).
+
+StageMemory measures the peak resident memory of each processing stage: on Linux the kernel's peak
+counter (VmHWM) is reset at the start of a stage and read at the end, elsewhere a sampler thread polls
+the current RSS. optimize_dtypes turns low-cardinality text columns into categoricals and downcasts
+integers in place, and write_xlsx streams rows (optionally only those selected by a boolean mask) into
+a write-only openpyxl workbook instead of building a cell object per value like DataFrame.to_excel.
+RSS is per process, so on a shared Streamlit server the figures include other sessions.
+Keep this file free of Streamlit imports so headless jobs can use it.
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Object columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def rss_bytes():
+    """Current resident set size of this process (peak RSS where the current value is not available)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_kernel_peak():
+    """Reset VmHWM (Linux >= 4.0); False where that is not supported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _kernel_peak():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class StageMemory:
+    """Peak and end RSS per named stage: with tracker.stage("clean"): ..."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval  # sampler period where the kernel peak counter cannot be reset
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start_rss = rss_bytes()
+        exact = _reset_kernel_peak()
+        peak = [start_rss]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.interval):
+                peak[0] = max(peak[0], rss_bytes())
+
+        sampler = None
+        if not exact:
+            sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+            sampler.start()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            if sampler is not None:
+                stop.set()
+                sampler.join()
+            end_rss = rss_bytes()
+            stage_peak = max(peak[0], end_rss, _kernel_peak() if exact else 0)
+            self.stages.append({
+                'stage': name,
+                'start_mb': round(start_rss / 2**20, 1),
+                'peak_mb': round(stage_peak / 2**20, 1),
+                'end_mb': round(end_rss / 2**20, 1),
+                'seconds': round(seconds, 2),
+                'exact': exact
+            })
+
+    def report(self):
+        return list(self.stages)
+
+    def peak_mb(self):
+        return max((stage['peak_mb'] for stage in self.stages), default=0.0)
+
+
+def compact_strings(series, max_unique_ratio=CATEGORY_MAX_UNIQUE_RATIO):
+    """series as a categorical if it has few distinct values, else unchanged"""
+    if len(series) and series.nunique(dropna=True) <= max_unique_ratio * len(series):
+        return series.astype('category')
+    return series
+
+
+def optimize_dtypes(df, max_unique_ratio=CATEGORY_MAX_UNIQUE_RATIO):
+    """
+    In place: low-cardinality object columns become categoricals and integer columns are downcast.
+    Floats are left alone so the output file keeps their exact values. Returns df.
+    """
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+            df[column] = compact_strings(series, max_unique_ratio)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast='integer')
+    return df
+
+
+def write_xlsx(df, output, rows=None, chunk_size=50_000):
+    """
+    Stream df (only the rows where the boolean mask rows is True, if given) into an .xlsx file or buffer
+    with a write-only workbook. Rows are converted chunk by chunk, so no full copy of the frame is made.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([str(column) for column in df.columns])
+    positions = np.arange(len(df)) if rows is None else np.flatnonzero(rows)
+    for start in range(0, len(positions), chunk_size):
+        chunk = df.iloc[positions[start:start + chunk_size]].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+        del chunk
+    workbook.save(output)
@@ -0,0 +1,117 @@
+"""
+Row-fingerprint manifests for incremental re-classification of re-uploaded files (app.py).
+
+A manifest remembers, for one file name + product column, a 64-bit fingerprint of every raw product value
+of the last run together with its cleaned text and label. On re-upload the fingerprints of the new file are
+diffed against it in one vectorized pass: unchanged rows take their cleaned text and label from the manifest,
+and only new or changed rows are cleaned and classified. The model identity (model name, revision, the inference
+backend that produced the labels, max length and the cascade model and threshold, if one answered) is part of the
+manifest, so a new model, backend or cascade setting never reuses stale labels.
+Keep this file free of Streamlit imports so headless jobs can use it.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# Label id of rows that have no label (filtered out by preprocessing)
+NO_LABEL = 255
+
+
+def row_fingerprints(values):
+    """64-bit fingerprint per value (pandas' keyed SipHash, stable across runs and processes)"""
+    return pd.util.hash_pandas_object(pd.Series(values, dtype=object), index=False).to_numpy(dtype=np.uint64)
+
+
+def model_identity(model_name, revision, backend, max_length, cascade=None):
+    return f"{model_name}\0{revision}\0{backend}\0{max_length}\0{cascade or ''}"
+
+
+def _pack_texts(texts):
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_texts(blob, offsets, positions):
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in positions.tolist()]
+
+
+class RowManifest:
+    """Fingerprint -> (cleaned text, label) of the unique product values of a previous run"""
+
+    def __init__(self, fingerprints, clean_blob, clean_offsets, label_ids, labels):
+        self.fingerprints = fingerprints
+        self.clean_blob = clean_blob
+        self.clean_offsets = clean_offsets
+        self.label_ids = label_ids
+        self.labels = list(labels)
+        self._index = pd.Index(fingerprints)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    @staticmethod
+    def path(root, file_name, column):
+        digest = hashlib.blake2b(f"{file_name}\0{column}".encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(root, f"{digest}.npz")
+
+    @classmethod
+    def load(cls, root, file_name, column, model_id):
+        """Manifest of the last run of this file/column, or None if there is none for this model"""
+        try:
+            with np.load(cls.path(root, file_name, column)) as data:
+                if str(data['model_id']) != model_id:
+                    return None
+                return cls(
+                    data['fingerprints'],
+                    data['clean_blob'],
+                    data['clean_offsets'],
+                    data['label_ids'],
+                    data['labels'].tolist()
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def lookup(self, fingerprints):
+        """
+        Diff fingerprints against the manifest.
+        Returns (found mask, cleaned texts of found rows, labels of found rows - None where the row had no label).
+        """
+        positions = self._index.get_indexer(fingerprints)
+        found = positions >= 0
+        positions = positions[found]
+        clean = _unpack_texts(self.clean_blob, self.clean_offsets, positions)
+        labels = [self.labels[i] if i != NO_LABEL else None for i in self.label_ids[positions].tolist()]
+        return found, clean, labels
+
+    @staticmethod
+    def save(root, file_name, column, model_id, fingerprints, clean_texts, labels, label_names):
+        """
+        Write the manifest of this run (one entry per unique fingerprint, labels None for filtered rows).
+        Replaces the previous manifest of the file/column atomically.
+        """
+        label_ids = {label: label_id for label_id, label in enumerate(label_names)}
+        ids = np.fromiter((label_ids.get(label, NO_LABEL) for label in labels), dtype=np.uint8, count=len(labels))
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        _, first = np.unique(fingerprints, return_index=True)
+        first.sort()
+        blob, offsets = _pack_texts([clean_texts[i] for i in first.tolist()])
+
+        os.makedirs(root, exist_ok=True)
+        path = RowManifest.path(root, file_name, column)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            model_id=np.array(model_id),
+            fingerprints=fingerprints[first],
+            clean_blob=blob,
+            clean_offsets=offsets,
+            label_ids=ids[first],
+            labels=np.array(list(label_names))
+        )
+        os.replace(tmp_path, path)
@@ -0,0 +1,155 @@
+"""
+Dynamic micro-batching for the GPU API server (api_server.py).
+
+Request handlers submit their texts and wait on a Future. A single worker thread coalesces
+pending texts from all concurrent requests into one batch (up to max_batch_size texts, or
+whatever arrived within max_wait seconds) and runs the model once for all of them, so the
+device is never contended by several Flask threads and tail latency stays bounded.
+Requests are queued per lane; batches are filled from the first lane before the next one, so
+small interactive requests overtake the rest of a large bulk request already in the queue.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _PendingRequest:
+    """Texts of one request plus how far the worker has got through them"""
+
+    def __init__(self, texts, future):
+        self.texts = texts
+        self.future = future
+        self.results = [None] * len(texts)
+        self.offset = 0  # next text to hand to the worker
+        self.completed = 0  # texts with results
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """Central inference queue: submit(texts) -> Future resolving to predictions in input order"""
+
+    def __init__(self, predict_fn, max_batch_size=512, max_wait=0.005, on_batch=None, lanes=("default",)):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # on_batch(texts, fill_ratio, queue_waits) is called for every batch taken; queue_waits holds the
+        # seconds each request waited before its first texts reached the model
+        self.on_batch = on_batch
+
+        self.lanes = tuple(lanes)  # in priority order; submit() without a lane uses the first
+        self._pending = {lane: collections.deque() for lane in self.lanes}
+        self._pending_texts = 0
+        self._cond = threading.Condition()
+
+        self.batches_run = 0
+        self.texts_run = 0
+        self.last_fill_ratio = 0.0
+        self.max_queue_wait = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts, lane=None):
+        """Enqueue texts in lane; the returned Future resolves to their predictions"""
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        with self._cond:
+            self._pending[lane or self.lanes[0]].append(_PendingRequest(list(texts), future))
+            self._pending_texts += len(texts)
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        """Block until work arrives, wait up to max_wait to fill the batch, then take up to max_batch_size texts"""
+        with self._cond:
+            while not self._pending_texts:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_texts < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            now = time.monotonic()
+            parts = []
+            taken = 0
+            queue_waits = []
+            for queue in self._pending.values():
+                while queue and taken < self.max_batch_size:
+                    item = queue[0]
+                    count = min(len(item.texts) - item.offset, self.max_batch_size - taken)
+                    parts.append((item, item.offset, count))
+                    self.max_queue_wait = max(self.max_queue_wait, now - item.enqueued_at)
+                    if item.offset == 0:
+                        queue_waits.append(now - item.enqueued_at)
+                    item.offset += count
+                    taken += count
+                    if item.offset == len(item.texts):
+                        queue.popleft()
+            self._pending_texts -= taken
+        if self.on_batch is not None:
+            self.on_batch(taken, taken / self.max_batch_size, queue_waits)
+        return parts, taken
+
+    def _fail(self, parts, error):
+        """Fail every request in the batch and drop their unprocessed remainder from the queue"""
+        failed = {id(item) for item, _, _ in parts}
+        with self._cond:
+            for queue in self._pending.values():
+                for item in [item for item in queue if id(item) in failed]:
+                    queue.remove(item)
+                    self._pending_texts -= len(item.texts) - item.offset
+        for item, _, _ in parts:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    def _run(self):
+        while True:
+            parts, taken = self._next_batch()
+            texts = [text for item, start, count in parts for text in item.texts[start:start + count]]
+            try:
+                predictions = self.predict_fn(texts)
+            except Exception as e:
+                self._fail(parts, e)
+                continue
+
+            pos = 0
+            for item, start, count in parts:
+                item.results[start:start + count] = predictions[pos:pos + count]
+                pos += count
+                item.completed += count
+                if item.completed == len(item.texts) and not item.future.done():
+                    item.future.set_result(item.results)
+
+            self.batches_run += 1
+            self.texts_run += taken
+            self.last_fill_ratio = taken / self.max_batch_size
+
+    def stats(self):
+        """Queue depth and batch fill ratio for /health"""
+        with self._cond:
+            lanes = {
+                lane: {
+                    'queue_requests': len(queue),
+                    'queue_texts': sum(len(item.texts) - item.offset for item in queue)
+                }
+                for lane, queue in self._pending.items()
+            }
+            queue_texts = self._pending_texts
+        return {
+            'queue_requests': sum(lane['queue_requests'] for lane in lanes.values()),
+            'queue_texts': queue_texts,
+            'lanes': lanes,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+            'batches_run': self.batches_run,
+            'texts_run': self.texts_run,
+            'avg_fill_ratio': round(self.texts_run / (self.batches_run * self.max_batch_size), 4) if self.batches_run else 0.0,
+            'last_fill_ratio': round(self.last_fill_ratio, 4),
+            'max_queue_wait_ms': round(self.max_queue_wait * 1000, 2)
+        }
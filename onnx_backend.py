@@ -0,0 +1,187 @@
+"""
+ONNX Runtime inference backend (optionally dynamic int8 quantized) for CPU serving.
+
+The PyTorch classifier is exported once to ONNX_MODEL_DIR and reused on later starts.
+OnnxClassifier mimics the part of the Hugging Face model interface our inference loops use
+(model(**inputs).logits and model.device), so app.py and api_server.py only swap the model object.
+
+Select it with INFERENCE_BACKEND=onnx or INFERENCE_BACKEND=onnx-int8 (default: pytorch).
+Check label agreement against PyTorch with: python onnx_backend.py [--quantize] [--texts file.txt]
+
+Requires: pip install onnx onnxruntime
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import torch
+
+BACKENDS = ("pytorch", "onnx", "onnx-int8")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", ".cache/onnx")
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Export wrapper: plain tensor in, logits out (no ModelOutput dict)"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def onnx_model_path(model_name, revision, quantize=False, model_dir=ONNX_MODEL_DIR):
+    """Where the exported model for this name/revision lives"""
+    safe_name = model_name.strip("/").replace("/", "--")
+    suffix = "-int8" if quantize else ""
+    return Path(model_dir) / f"{safe_name}-{revision}{suffix}.onnx"
+
+
+def export_onnx(model, tokenizer, output_path, opset=14):
+    """Export a PyTorch sequence classifier to ONNX with dynamic batch and sequence axes"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    wrapper = _LogitsOnly(model.float().cpu().eval())
+    dummy = tokenizer(["Vải dệt thoi 100% cotton khổ 58"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(output_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"}
+            },
+            opset_version=opset
+        )
+    return output_path
+
+
+def quantize_onnx(input_path, output_path):
+    """Dynamic int8 quantization of the linear layers (weights int8, activations quantized at runtime)"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(input_path), str(output_path), weight_type=QuantType.QInt8)
+    return Path(output_path)
+
+
+class OnnxClassifier:
+    """ONNX Runtime session with the model(**inputs).logits interface of a Hugging Face classifier"""
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.path = str(path)
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.device = torch.device("cpu")
+
+    def __call__(self, **inputs):
+        feed = {
+            name: tensor.cpu().numpy().astype("int64")
+            for name, tensor in inputs.items()
+            if name in self.input_names
+        }
+        logits = self.session.run(["logits"], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+    def eval(self):
+        return self
+
+
+def load_onnx_classifier(tokenizer, load_pytorch_model, model_name, revision, quantize=False, num_threads=None):
+    """
+    Load the ONNX (or int8) classifier, exporting it first if it is not on disk yet.
+    load_pytorch_model is only called when an export is needed.
+    """
+    fp32_path = onnx_model_path(model_name, revision, quantize=False)
+    target_path = onnx_model_path(model_name, revision, quantize=quantize)
+    if not target_path.exists():
+        if not fp32_path.exists():
+            print(f"📦 Exporting {model_name} to ONNX: {fp32_path}")
+            export_onnx(load_pytorch_model(), tokenizer, fp32_path)
+        if quantize:
+            print(f"📦 Quantizing ONNX model to int8: {target_path}")
+            quantize_onnx(fp32_path, target_path)
+    return OnnxClassifier(target_path, num_threads=num_threads)
+
+
+def check_parity(texts, tokenizer, reference_model, candidate_model, batch_size=32, max_length=128):
+    """
+    Run both models on texts and report label agreement and the largest logit difference.
+    Returns {'count', 'agreement', 'mismatches': [(text, reference_id, candidate_id), ...], 'max_abs_logit_diff'}.
+    """
+    mismatches = []
+    max_diff = 0.0
+    for start in range(0, len(texts), batch_size):
+        batch_texts = texts[start:start + batch_size]
+        inputs = tokenizer(batch_texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt")
+        with torch.no_grad():
+            reference_logits = reference_model(**inputs).logits.float()
+            candidate_logits = candidate_model(**inputs).logits.float()
+        max_diff = max(max_diff, (reference_logits - candidate_logits).abs().max().item())
+        reference_ids = reference_logits.argmax(dim=-1).tolist()
+        candidate_ids = candidate_logits.argmax(dim=-1).tolist()
+        for text, ref_id, cand_id in zip(batch_texts, reference_ids, candidate_ids):
+            if ref_id != cand_id:
+                mismatches.append((text, ref_id, cand_id))
+    count = len(texts)
+    return {
+        'count': count,
+        'agreement': round(1 - len(mismatches) / count, 6) if count else 1.0,
+        'mismatches': mismatches,
+        'max_abs_logit_diff': round(max_diff, 6)
+    }
+
+
+def main(argv=None):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    from preprocessing import SAMPLE_VALUES, clean_product_string
+
+    parser = argparse.ArgumentParser(description="Export the classifier to ONNX and check label parity with PyTorch")
+    parser.add_argument("--model", default=os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric"))
+    parser.add_argument("--revision", default=os.getenv("MODEL_REVISION", "main"))
+    parser.add_argument("--quantize", action="store_true", help="Check the dynamic int8 model instead of FP32")
+    parser.add_argument("--texts", help="Text file with one product description per line (cleaned before use)")
+    parser.add_argument("--max-length", type=int, default=int(os.getenv("MAX_LENGTH", "128")))
+    args = parser.parse_args(argv)
+
+    raw_texts = list(SAMPLE_VALUES)
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            raw_texts.extend(line.rstrip("\n") for line in f)
+    texts = [t for t in (clean_product_string(v) for v in raw_texts) if t]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, revision=args.revision)
+    reference_model = AutoModelForSequenceClassification.from_pretrained(args.model, revision=args.revision).eval()
+    candidate_model = load_onnx_classifier(
+        tokenizer,
+        lambda: reference_model,
+        args.model,
+        args.revision,
+        quantize=args.quantize
+    )
+
+    report = check_parity(texts, tokenizer, reference_model, candidate_model, max_length=args.max_length)
+    backend = "onnx-int8" if args.quantize else "onnx"
+    print(f"📊 {backend} vs pytorch on {report['count']} texts: "
+          f"{report['agreement']*100:.2f}% label agreement, max |Δlogit| = {report['max_abs_logit_diff']}")
+    for text, ref_id, cand_id in report['mismatches'][:20]:
+        print(f"  ❌ {text!r}: pytorch={ref_id} {backend}={cand_id}")
+    return 0 if not report['mismatches'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
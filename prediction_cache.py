@@ -0,0 +1,112 @@
+"""
+Persistent on-disk prediction cache shared by the Streamlit app (app.py) and the GPU API server (api_server.py).
+
+Predictions are stored in SQLite, keyed by a hash of the cleaned text plus the model identity
+(model name, revision, inference backend and max length), so a new model, backend or tokenizer setting
+never reuses stale labels.
+Keep this file free of Streamlit imports so it can be uploaded to the GPU server next to api_server.py.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class PredictionCache:
+    """Size-bounded SQLite cache of text -> label with LRU-style eviction and hit/miss counters"""
+
+    def __init__(self, path, model_name, revision, backend, max_length, max_entries=1_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._model_key = f"{model_name}\0{revision}\0{backend}\0{max_length}\0".encode("utf-8")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key BLOB PRIMARY KEY, label TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_last_used ON predictions(last_used)")
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (key BLOB PRIMARY KEY)")
+        self._conn.commit()
+
+    def _key(self, text):
+        return hashlib.blake2b(self._model_key + text.encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, texts):
+        """
+        Bulk lookup: returns {text: label} for every cached text.
+        All keys go through one temp table and one join, so a large batch costs a single query.
+        """
+        keys = {}
+        for text in texts:
+            keys.setdefault(self._key(text), text)
+        if not keys:
+            return {}
+
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("DELETE FROM lookup")
+            cur.executemany("INSERT INTO lookup (key) VALUES (?)", ((k,) for k in keys))
+            rows = cur.execute(
+                "SELECT p.key, p.label FROM predictions p JOIN lookup l ON p.key = l.key"
+            ).fetchall()
+            cur.execute(
+                "UPDATE predictions SET last_used = ? WHERE key IN (SELECT key FROM lookup)",
+                (time.time(),)
+            )
+            cur.execute("DELETE FROM lookup")
+            self._conn.commit()
+            found = {keys[key]: label for key, label in rows}
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (text, label) pairs, then evict the least recently used entries if over max_entries"""
+        now = time.time()
+        rows = [(self._key(text), label, now) for text, label in items]
+        if not rows:
+            return
+
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.executemany("INSERT OR REPLACE INTO predictions (key, label, last_used) VALUES (?, ?, ?)", rows)
+            count = cur.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            if count > self.max_entries:
+                # Evict down to 90% so we do not pay for eviction on every insert
+                excess = count - int(self.max_entries * 0.9)
+                cur.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY last_used ASC LIMIT ?)",
+                    (excess,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'path': self.path,
+            'entries': size,
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,192 @@
+"""
+Product text preprocessing (logic from preprocessing.ipynb).
+
+clean_product_string is the reference per-row implementation.
+clean_product_series is the batch engine used for whole columns: it cleans each distinct value once,
+uses precompiled patterns and pandas .str ops, skips the #& steps for rows without a #& marker and can
+fan out to worker processes for very large frames. Its output is identical to applying
+clean_product_string row by row - run `python preprocessing.py [file]` to check that on real data.
+Keep this file free of Streamlit imports so it can be used by worker processes and headless jobs.
+"""
+
+import argparse
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+# Preprocessing function from preprocessing.ipynb
+def clean_product_string(s):
+    """Clean product string based on preprocessing.ipynb logic"""
+    if pd.isna(s) or s == '':
+        return ''
+
+    s = str(s).strip()
+
+    # 1. Xóa @ ở cuối
+    s = re.sub(r'\s*@$', '', s).strip()
+
+    # 2. Xử lý các prefix/suffix có #&
+    for _ in range(3):
+        original_s = s
+        s = re.sub(r'\s*#&(?:VN|CN|KR|TW|IT|JP)\s*$', '', s, flags=re.IGNORECASE).strip()
+        if s == original_s:
+            break
+
+    s = re.sub(r'^[^\s]*#&\s*', '', s).strip()
+    s = re.sub(r'\s*#&\s*', ' ', s).strip()
+
+    # 3. Clean up ký tự đặc biệt thừa
+    s = s.strip('\"')
+    s = re.sub(r'[\s\.\,\-\']+$', '', s).strip()
+    s = re.sub(r'[\[\]\{\}]', ' ', s).strip()
+
+    # 4. Xóa dấu phẩy/chấm kép thừa
+    s = re.sub(r'[,\.]{2,}', ',', s).strip()
+
+    # 5. Xóa khoảng trắng thừa
+    s = re.sub(r'\s+', ' ', s).strip()
+
+    return s
+
+
+# Precompiled patterns - same expressions as clean_product_string, in the same order
+_TRAILING_AT = re.compile(r'\s*@$')
+_COUNTRY_SUFFIX = re.compile(r'\s*#&(?:VN|CN|KR|TW|IT|JP)\s*$', flags=re.IGNORECASE)
+_MARKER_PREFIX = re.compile(r'^[^\s]*#&\s*')
+_MARKER = re.compile(r'\s*#&\s*')
+_TRAILING_PUNCTUATION = re.compile(r'[\s\.\,\-\']+$')
+_BRACKETS = re.compile(r'[\[\]\{\}]')
+_REPEATED_PUNCTUATION = re.compile(r'[,\.]{2,}')
+_WHITESPACE = re.compile(r'\s+')
+
+# Below this many distinct values worker processes cost more than they save
+_PARALLEL_MIN_VALUES = 200_000
+
+
+def _clean_values(values):
+    """Clean a list of str values with vectorized .str ops (object dtype keeps Python re semantics)"""
+    s = pd.Series(values, dtype=object).str.strip()
+
+    # 1. Trailing @
+    s = s.str.replace(_TRAILING_AT, '', regex=True).str.strip()
+
+    # 2. #& prefix/suffix handling - only rows that contain a marker can change here
+    has_marker = s.str.contains('#&', regex=False)
+    if has_marker.any():
+        marked = s[has_marker]
+        # clean_product_string stops early once nothing changes; repeating is a no-op, so 3 passes are equivalent
+        for _ in range(3):
+            marked = marked.str.replace(_COUNTRY_SUFFIX, '', regex=True).str.strip()
+        marked = marked.str.replace(_MARKER_PREFIX, '', regex=True).str.strip()
+        marked = marked.str.replace(_MARKER, ' ', regex=True).str.strip()
+        s[has_marker] = marked
+
+    # 3. Extra special characters
+    s = s.str.strip('\"')
+    s = s.str.replace(_TRAILING_PUNCTUATION, '', regex=True).str.strip()
+    s = s.str.replace(_BRACKETS, ' ', regex=True).str.strip()
+
+    # 4. Repeated commas/dots
+    s = s.str.replace(_REPEATED_PUNCTUATION, ',', regex=True).str.strip()
+
+    # 5. Extra whitespace
+    s = s.str.replace(_WHITESPACE, ' ', regex=True).str.strip()
+
+    return s.tolist()
+
+
+def clean_product_series(series, n_jobs=1):
+    """
+    Batch equivalent of series.apply(clean_product_string).
+    Distinct values are cleaned once and mapped back, so repeated product strings cost nothing extra.
+    With n_jobs > 1 and many distinct values, cleaning is split across worker processes.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    values = [str(v) for v in uniques]
+
+    if n_jobs > 1 and len(values) >= _PARALLEL_MIN_VALUES:
+        chunk_size = (len(values) + n_jobs - 1) // n_jobs
+        chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            cleaned = [v for chunk in executor.map(_clean_values, chunks) for v in chunk]
+    else:
+        cleaned = _clean_values(values) if values else []
+
+    # Missing values get code -1, which indexes the trailing '' (clean_product_string returns '' for NA)
+    lookup = np.array(cleaned + [''], dtype=object)
+    return pd.Series(lookup[codes], index=series.index, name=series.name, dtype=object)
+
+
+def find_mismatches(values):
+    """Compare clean_product_series against clean_product_string; returns [(value, expected, actual), ...]"""
+    series = pd.Series(list(values), dtype=object)
+    expected = series.apply(clean_product_string).tolist()
+    actual = clean_product_series(series).tolist()
+    return [
+        (value, exp, act)
+        for value, exp, act in zip(series.tolist(), expected, actual)
+        if exp != act
+    ]
+
+
+# Edge cases seen in customs export files
+SAMPLE_VALUES = [
+    "Vải dệt thoi 100% cotton, khổ 58\"#&VN",
+    "Sợi polyester 150D/48F #&CN #&vn",
+    "ABC123#&Xơ staple polyester 1.4D x 38mm#&KR",
+    "NPL01#& Vải lót 100% polyester khổ 150cm @",
+    "Quần áo bảo hộ lao động [mới 100%] {hàng mẫu}..",
+    "\"Nhãn vải dệt, in logo\" - ",
+    "Dây kéo nhựa ,, size 5...",
+    "Vải không dệt #&TW ",
+    "#&JP",
+    "   ",
+    "",
+    "nan",
+    None,
+    float("nan"),
+    12345,
+    "Sợi nylon 70D #&IT #&JP #&CN #&VN",
+    "Vải   lưới\t\tpolyester\n",
+    "Cúc nhựa 4 lỗ'.'",
+    "Vải 100% cotton?",
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check that clean_product_series gives the same output as clean_product_string"
+    )
+    parser.add_argument("file", nargs="?", help="Optional .xlsx/.xls/.csv/.parquet file to check in addition to the built-in samples")
+    parser.add_argument("--column", help="Column to check (default: every column of the file)")
+    args = parser.parse_args(argv)
+
+    values = list(SAMPLE_VALUES)
+    if args.file:
+        if args.file.endswith((".xlsx", ".xls")):
+            df = pd.read_excel(args.file)
+        elif args.file.endswith(".parquet"):
+            df = pd.read_parquet(args.file)
+        else:
+            df = pd.read_csv(args.file)
+        columns = [args.column] if args.column else df.columns.tolist()
+        for column in columns:
+            values.extend(df[column].tolist())
+            values.extend(df[column].astype(str).tolist())
+
+    mismatches = find_mismatches(values)
+    if mismatches:
+        for value, expected, actual in mismatches[:20]:
+            print(f"❌ {value!r}: expected {expected!r}, got {actual!r}")
+        print(f"❌ {len(mismatches)}/{len(values)} values differ")
+        return 1
+    print(f"✅ clean_product_series matches clean_product_string on {len(values)} values")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
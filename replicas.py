@@ -0,0 +1,384 @@
+"""
+Multi-replica CPU serving for the API server (api_server.py) on one host.
+
+`gunicorn -w N api_server:app` loads the model N times and lets the kernel hand connections to
+whichever worker accepts first. This launcher instead:
+- loads the weights once and forks N replicas that share them copy-on-write ("fork", Linux), or has
+  every replica memory-map one local state dict file so they share the page cache ("mmap");
+- gives each replica its own torch thread budget (cpu_count // N by default) so they don't oversubscribe cores;
+- runs a small router on API_PORT that sends each request to the replica with the least outstanding
+  work (in-flight request bytes, then in-flight requests) and merges /health and /metrics.
+Replicas listen on 127.0.0.1:REPLICA_BASE_PORT + i. Async jobs (/jobs) all go to replica 0, the only one
+running the job worker. Aimed at CPU hosts; on a single GPU every replica would still hold its own copy.
+
+Run: python replicas.py --workers 4 [--threads-per-worker 2] [--weights mmap]
+Keep this file free of Streamlit imports; upload it next to api_server.py.
+"""
+
+import argparse
+import inspect
+import multiprocessing as mp
+import os
+import re
+import sys
+import threading
+import time
+
+MODEL_NAME = os.getenv("MODEL_NAME", "aluha501/xlm-roberta-base-fabric")
+MODEL_REVISION = os.getenv("MODEL_REVISION", "main")
+API_HOST = "0.0.0.0"
+API_PORT = int(os.getenv("API_PORT", "5000"))
+REPLICA_BASE_PORT = int(os.getenv("REPLICA_BASE_PORT", "5100"))
+REPLICA_WEIGHTS_PATH = os.getenv("REPLICA_WEIGHTS_PATH", ".cache/replica_weights.pt")  # State dict memory-mapped in "mmap" mode (model and revision are added to the name)
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))  # Seconds between replica health polls
+REPLICA_TIMEOUT = float(os.getenv("REPLICA_TIMEOUT", "300"))  # Read timeout of proxied requests
+WEIGHT_MODES = ("fork", "mmap")
+
+# Headers passed through the router in each direction
+_REQUEST_HEADERS = ("content-type", "content-encoding", "accept", "accept-encoding")
+_RESPONSE_HEADERS = ("content-type", "content-encoding", "retry-after")
+
+# Set in the parent right before the replicas are forked, picked up by api_server at import
+_preloaded = {}
+
+
+def take_preloaded():
+    """(tokenizer, model) handed over by the launcher, or None when api_server runs on its own"""
+    if 'model' not in _preloaded:
+        return None
+    return _preloaded.pop('tokenizer'), _preloaded.pop('model')
+
+
+def weights_file(path, model_name, revision):
+    """REPLICA_WEIGHTS_PATH with the model and revision in the file name, so a new model never reuses old weights"""
+    base, ext = os.path.splitext(path)
+    return f"{base}-{re.sub(r'[^A-Za-z0-9._-]+', '_', f'{model_name}@{revision}')}{ext or '.pt'}"
+
+
+def export_mmap_weights(model, path):
+    """Save the state dict once so replicas can memory-map it instead of loading their own copy"""
+    import torch
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_mmap_model(model_name, revision, path):
+    """
+    Build the classifier from its config and point its parameters at the memory-mapped state dict
+    (load_state_dict(assign=True) keeps the mapped storage), so replicas share the OS page cache.
+    torch < 2.1 has neither argument; there every replica loads its own copy of the file.
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+    config = AutoConfig.from_pretrained(model_name, revision=revision)
+    model = AutoModelForSequenceClassification.from_config(config)
+    if "mmap" in inspect.signature(torch.load).parameters:
+        state = torch.load(path, mmap=True, weights_only=True, map_location="cpu")
+        model.load_state_dict(state, assign=True)
+    else:
+        print("⚠️ torch < 2.1 cannot memory-map weights, loading a private copy per replica")
+        state = torch.load(path, weights_only=True, map_location="cpu")
+        model.load_state_dict(state)
+    model.eval()
+    return tokenizer, model
+
+
+def _replica_main(index, port, threads, weights_path, model_name, revision):
+    import torch
+
+    # api_server imports take_preloaded from "replicas"; when launched as a script this module is __main__
+    sys.modules.setdefault('replicas', sys.modules[__name__])
+    torch.set_num_threads(threads)
+    if weights_path:
+        tokenizer, model = load_mmap_model(model_name, revision, weights_path)
+        _preloaded.update(tokenizer=tokenizer, model=model)
+    if index != 0:
+        # One job worker per JOB_DIR: replica 0 owns the job API
+        os.environ['JOB_DIR'] = ""
+    print(f"🧩 Replica {index}: port {port}, {threads} threads")
+    import api_server
+    api_server.app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+class Replica:
+    def __init__(self, index, port, process=None):
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = process
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.requests = 0
+        self.healthy = False
+        self.health = None
+
+
+class ReplicaRouter:
+    """Least-loaded assignment of requests to replicas, plus a background health poller"""
+
+    def __init__(self, replicas, health_interval=REPLICA_HEALTH_INTERVAL, timeout=REPLICA_TIMEOUT):
+        import requests
+
+        self.replicas = replicas
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self, size=0, exclude=(), candidates=None):
+        """Pick the healthy replica with the least outstanding bytes/requests (round robin on ties)"""
+        with self._lock:
+            candidates = [r for r in candidates or self.replicas if r.healthy and r.index not in exclude]
+            if not candidates:
+                return None
+            offset = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+            replica = min(
+                candidates,
+                key=lambda r: (r.in_flight_bytes, r.in_flight, (r.index - offset) % len(self.replicas))
+            )
+            replica.in_flight += 1
+            replica.in_flight_bytes += size
+            replica.requests += 1
+            return replica
+
+    def release(self, replica, size=0):
+        with self._lock:
+            replica.in_flight -= 1
+            replica.in_flight_bytes -= size
+
+    def poll_health(self):
+        for replica in self.replicas:
+            if replica.process is not None and not replica.process.is_alive():
+                replica.healthy = False
+                replica.health = {'status': 'dead', 'exitcode': replica.process.exitcode}
+                continue
+            try:
+                response = self.session.get(f"{replica.url}/health", timeout=5)
+                replica.health = response.json()
+                replica.healthy = response.status_code == 200
+            except Exception as e:
+                replica.healthy = False
+                replica.health = {'status': 'unreachable', 'error': str(e)}
+
+    def start(self):
+        def run():
+            while True:
+                self.poll_health()
+                time.sleep(self.health_interval)
+
+        threading.Thread(target=run, name="replica-health", daemon=True).start()
+
+    def summary(self):
+        with self._lock:
+            return [
+                {
+                    'index': r.index,
+                    'port': r.port,
+                    'healthy': r.healthy,
+                    'status': (r.health or {}).get('status'),
+                    'in_flight': r.in_flight,
+                    'in_flight_bytes': r.in_flight_bytes,
+                    'requests': r.requests
+                }
+                for r in self.replicas
+            ]
+
+
+def merge_metrics(texts):
+    """
+    Merge the Prometheus text of several replicas into one exposition: samples get a replica="<i>"
+    label and each metric family keeps a single HELP/TYPE header.
+    """
+    families = {}
+    for index, text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, {'header': [], 'samples': []})
+                if len(family['header']) < 2 and line not in family['header']:
+                    family['header'].append(line)
+                continue
+            if not line or line.startswith("#") or name is None:
+                continue
+            label = f'replica="{index}"'
+            brace = line.find("{")
+            space = line.find(" ")
+            if brace != -1 and brace < space:
+                line = f"{line[:brace + 1]}{label},{line[brace + 1:]}"
+            else:
+                line = f"{line[:space]}{{{label}}}{line[space:]}"
+            families[name]['samples'].append(line)
+    lines = []
+    for family in families.values():
+        lines.extend(family['header'])
+        lines.extend(family['samples'])
+    return "\n".join(lines) + "\n"
+
+
+def create_router_app(router):
+    from flask import Flask, Response, jsonify, request
+    from flask_cors import CORS
+
+    app = Flask(__name__)
+    CORS(app)
+
+    def proxy(path, pinned=None):
+        import requests
+
+        body = request.get_data()
+        headers = {k: v for k, v in request.headers.items() if k.lower() in _REQUEST_HEADERS}
+        tried = set()
+        while True:
+            replica = router.acquire(len(body), exclude=tried, candidates=pinned)
+            if replica is None:
+                return jsonify({'error': 'No healthy replica available'}), 503
+            size = len(body)
+            try:
+                upstream = router.session.request(
+                    request.method,
+                    f"{replica.url}{path}",
+                    params=request.args,
+                    data=body,
+                    headers=headers,
+                    stream=True,
+                    timeout=(5, router.timeout)
+                )
+            except requests.ConnectionError:
+                # Replica died or restarted: retry the request on another one
+                router.release(replica, size)
+                replica.healthy = False
+                tried.add(replica.index)
+                continue
+            except Exception:
+                router.release(replica, size)
+                raise
+            break
+
+        def relay():
+            try:
+                # Raw bytes, so gzip bodies and NDJSON streams pass through untouched
+                yield from upstream.raw.stream(64 * 1024, decode_content=False)
+            finally:
+                upstream.close()
+                router.release(replica, size)
+
+        response_headers = {k: v for k, v in upstream.headers.items() if k.lower() in _RESPONSE_HEADERS}
+        response_headers['X-Replica'] = str(replica.index)
+        return Response(relay(), status=upstream.status_code, headers=response_headers)
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        return proxy('/predict')
+
+    @app.route('/jobs', methods=['POST'])
+    @app.route('/jobs/<path:rest>', methods=['GET', 'DELETE'])
+    def jobs(rest=None):
+        return proxy(f"/jobs/{rest}" if rest else "/jobs", pinned=router.replicas[:1])
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        replicas = router.summary()
+        ready = [r for r in router.replicas if r.healthy]
+        if not ready:
+            return jsonify({'status': 'warming_up', 'ready': False, 'replicas': replicas}), 503
+        # Clients negotiate wire format and job support from these fields; replicas are identical
+        payload = dict(router.replicas[0].health if router.replicas[0].healthy else ready[0].health)
+        payload.update(replicas=replicas, replicas_ready=len(ready))
+        return jsonify(payload)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        texts = []
+        for replica in router.replicas:
+            try:
+                texts.append((replica.index, router.session.get(f"{replica.url}/metrics", timeout=5).text))
+            except Exception:
+                continue
+        lines = ["# HELP classifier_replica_in_flight Requests in flight per replica", "# TYPE classifier_replica_in_flight gauge"]
+        lines.extend(f'classifier_replica_in_flight{{replica="{r["index"]}"}} {r["in_flight"]}' for r in router.summary())
+        return Response(merge_metrics(texts) + "\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    @app.route('/', methods=['GET'])
+    def index():
+        return jsonify({
+            'message': 'Fabric Product Classifier API (replicated)',
+            'replicas': len(router.replicas),
+            'endpoints': {
+                '/health': 'GET - Health of the replicas',
+                '/metrics': 'GET - Prometheus metrics of every replica',
+                '/predict': 'POST - Predict labels (least-loaded replica)',
+                '/jobs': 'POST/GET/DELETE - Async jobs (replica 0)'
+            }
+        })
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve api_server.py from N replicas sharing one copy of the weights")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("REPLICA_WORKERS", "0")) or None)
+    parser.add_argument("--threads-per-worker", type=int, default=int(os.getenv("REPLICA_THREADS", "0")) or None)
+    parser.add_argument("--weights", choices=WEIGHT_MODES, default=os.getenv("REPLICA_WEIGHTS") or (
+        "fork" if "fork" in mp.get_all_start_methods() else "mmap"))
+    parser.add_argument("--weights-path", default=REPLICA_WEIGHTS_PATH)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--base-port", type=int, default=REPLICA_BASE_PORT)
+    args = parser.parse_args(argv)
+
+    cpu_count = os.cpu_count() or 1
+    workers = args.workers or max(1, cpu_count // 4)
+    threads = args.threads_per_worker or max(1, cpu_count // workers)
+
+    from inference import load_pretrained
+
+    print(f"📥 Loading model once for {workers} replicas: {MODEL_NAME}")
+    if args.weights == "fork":
+        tokenizer, model = load_pretrained(MODEL_NAME, MODEL_REVISION)
+        _preloaded.update(tokenizer=tokenizer, model=model)
+        weights_path = None
+    else:
+        weights_path = weights_file(args.weights_path, MODEL_NAME, MODEL_REVISION)
+        if not os.path.exists(weights_path):
+            model = load_pretrained(MODEL_NAME, MODEL_REVISION)[1]
+            export_mmap_weights(model, weights_path)
+            del model
+            print(f"💾 Weights exported for memory-mapping: {weights_path}")
+
+    context = mp.get_context("fork" if args.weights == "fork" else "spawn")
+    replicas = []
+    for index in range(workers):
+        port = args.base_port + index
+        process = context.Process(
+            target=_replica_main,
+            args=(index, port, threads, weights_path, MODEL_NAME, MODEL_REVISION),
+            name=f"replica-{index}",
+            daemon=True
+        )
+        process.start()
+        replicas.append(Replica(index, port, process))
+    # The replicas hold the model now; drop the parent's references
+    _preloaded.clear()
+    if args.weights == "fork":
+        del tokenizer, model
+
+    router = ReplicaRouter(replicas)
+    router.start()
+    print(f"🌐 Router on {API_HOST}:{args.port} -> {workers} replicas x {threads} threads ({args.weights} weights)")
+    try:
+        create_router_app(router).run(host=API_HOST, port=args.port, threaded=True)
+    finally:
+        for replica in replicas:
+            replica.process.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Stand-in for the GPU API server, for exercising multi-endpoint routing, failover and hedging locally.
+
+Speaks the JSON side of api_server.py (/health, /predict with optional NDJSON streaming) without a model:
+the label of a text is a deterministic function of its bytes (stand_in_label), so answers can be checked.
+Latency, tail latency and failures are configurable.
+
+One server:  python stand_in_server.py --port 5101 --seconds-per-text 0.0005 --slow-rate 0.1
+Demo:        python stand_in_server.py --demo
+             (starts a fast, a slow-tailed and a dying stand-in, runs MultiEndpointClient over them with a
+             "local" fallback and checks every label comes back in input order)
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+VALID_LABELS = ["vải", "sợi", "xơ", "quần/áo", "phụ_trợ"]
+
+
+def stand_in_label(text):
+    return VALID_LABELS[sum(text.encode("utf-8")) % len(VALID_LABELS)]
+
+
+def create_app(seconds_per_text=0.0005, slow_rate=0.0, slow_factor=20.0, fail_after=None, name="stand-in"):
+    """
+    Flask app answering like api_server.py. A slow_rate share of requests takes slow_factor times longer;
+    after fail_after /predict requests every request fails with 503 (a dead or overloaded box).
+    """
+    from flask import Flask, Response, jsonify, request
+
+    app = Flask(name)
+    state = {'requests': 0}
+    lock = threading.Lock()
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        with lock:
+            dead = fail_after is not None and state['requests'] >= fail_after
+        if dead:
+            return jsonify({'status': 'unhealthy', 'ready': False}), 503
+        return jsonify({
+            'status': 'healthy',
+            'ready': True,
+            'device': name,
+            'micro_batching': None,
+            'jobs': None,
+            'wire': {'formats': ['json'], 'encodings': [], 'pretokenized': False, 'labels': VALID_LABELS}
+        })
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        with lock:
+            state['requests'] += 1
+            dead = fail_after is not None and state['requests'] > fail_after
+        if dead:
+            return jsonify({'error': f'{name} is down'}), 503
+        data = request.get_json()
+        texts = data['texts']
+        delay = seconds_per_text * len(texts)
+        if random.random() < slow_rate:
+            delay *= slow_factor
+        time.sleep(delay)
+        predictions = [stand_in_label(text) for text in texts]
+        if not data.get('stream'):
+            return jsonify({'predictions': predictions, 'count': len(predictions)})
+        lines = [json.dumps({'predictions': predictions}, ensure_ascii=False), json.dumps({'done': True})]
+        return Response("\n".join(lines) + "\n", mimetype='application/x-ndjson')
+
+    return app
+
+
+def serve(app, port):
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def demo(base_port=5101, rows=20000):
+    from api_client import MultiEndpointClient
+
+    servers = [
+        ('fast', create_app(seconds_per_text=0.0002, name='fast')),
+        ('slow-tail', create_app(seconds_per_text=0.0002, slow_rate=0.3, slow_factor=30.0, name='slow-tail')),
+        ('dying', create_app(seconds_per_text=0.0002, fail_after=3, name='dying'))
+    ]
+    endpoints = []
+    for offset, (name, app) in enumerate(servers):
+        port = base_port + offset
+        threading.Thread(target=serve, args=(app, port), name=name, daemon=True).start()
+        endpoints.append(f"http://127.0.0.1:{port}")
+    time.sleep(1.0)
+
+    texts = [f"vải dệt thoi {i} cotton {i % 97}" for i in range(rows)]
+    client = MultiEndpointClient(endpoints, chunk_size=250, max_chunk_size=500, target_chunk_seconds=0.1,
+                                 max_retries=1, backoff=0.1, failover_cooldown=60.0)
+
+    def local_fallback(remaining):
+        print(f"🖥️ Local fallback for {len(remaining)} rows")
+        return [stand_in_label(text) for text in remaining]
+
+    start_time = time.time()
+    predictions = client.predict(texts, fallback=local_fallback)
+    elapsed = time.time() - start_time
+    ok = predictions == [stand_in_label(text) for text in texts]
+    print(f"{'✅' if ok else '❌'} {len(predictions)} labels in {elapsed:.2f}s, in order: {ok}")
+    for name, endpoint in zip((name for name, _ in servers), client.stats()['endpoints']):
+        print(f"   {name}: {endpoint['rows']} rows in {endpoint['chunks']} chunks, "
+              f"{endpoint['failures']} failures, {endpoint['hedges']} hedges ({endpoint['hedges_won']} won)")
+    print(f"   fallback: {client.fallback_rows} rows")
+
+    # Only the dead endpoint left: everything goes to the fallback
+    client = MultiEndpointClient(endpoints[2:], chunk_size=250)
+    predictions = client.predict(texts[:1000], fallback=local_fallback)
+    fallback_ok = predictions == [stand_in_label(text) for text in texts[:1000]] and client.fallback_rows == 1000
+    print(f"{'✅' if fallback_ok else '❌'} All endpoints down: {client.fallback_rows} rows answered by the fallback")
+    return 0 if ok and fallback_ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in GPU API server for routing/failover tests")
+    parser.add_argument("--port", type=int, default=5101)
+    parser.add_argument("--seconds-per-text", type=float, default=0.0005)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests that are slow")
+    parser.add_argument("--slow-factor", type=float, default=20.0)
+    parser.add_argument("--fail-after", type=int, default=None, help="Answer 503 after this many /predict requests")
+    parser.add_argument("--demo", action="store_true", help="Run three stand-ins and a multi-endpoint client against them")
+    args = parser.parse_args(argv)
+
+    if args.demo:
+        return demo(args.port)
+    serve(create_app(args.seconds_per_text, args.slow_rate, args.slow_factor, args.fail_after, f"stand-in:{args.port}"), args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Startup warmup and shape-bucketed compiled graphs for the GPU API server (api_server.py).
+
+The first batches after a start are slow (kernel selection, cuBLAS/cuDNN autotuning, allocator
+growth), and torch.compile / TorchScript specialize on input shapes. With a fixed set of padded
+length buckets every batch is snapped to one of a few (rows, length) shapes
+(batching.schedule_batches(shapes=...)), so each shape is compiled/traced and warmed exactly
+once at startup and never again while serving.
+"""
+
+import time
+from types import SimpleNamespace
+
+import torch
+
+COMPILE_MODES = ("none", "compile", "trace")
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128)
+
+
+def parse_length_buckets(spec, max_length):
+    """'16,32,64' -> [16, 32, 64, max_length]: sorted, capped at max_length, always ending at max_length"""
+    buckets = {int(part) for part in str(spec).split(",") if part.strip()}
+    return sorted({min(bucket, max_length) for bucket in buckets if bucket > 0} | {max_length})
+
+
+def _example_inputs(tokenizer, rows, length, device):
+    """A (rows, length) batch of real token ids, so warmup runs the same kernels as serving"""
+    features = tokenizer(["vải dệt thoi 100% cotton"] * rows, truncation=True, max_length=length)
+    inputs = tokenizer.pad(features, padding='max_length', max_length=length, return_tensors="pt")
+    return {key: value.to(device) for key, value in inputs.items()}
+
+
+class TracedShapes:
+    """One TorchScript graph per fixed input shape; called like the HF model (returns .logits)"""
+
+    def __init__(self, model, graphs):
+        self.model = model
+        self.graphs = graphs  # (rows, length) -> traced module
+        self.device = model.device
+
+    def __call__(self, **inputs):
+        shape = tuple(inputs['input_ids'].shape)
+        graph = self.graphs.get(shape)
+        if graph is None:
+            # Shape outside the warmed set: fall back to eager rather than tracing while serving
+            return self.model(**inputs)
+        outputs = graph(**inputs)
+        logits = outputs['logits'] if isinstance(outputs, dict) else outputs[0]
+        return SimpleNamespace(logits=logits)
+
+    def eval(self):
+        return self
+
+
+def compile_model(model, tokenizer, mode, shapes, device):
+    """
+    Wrap model for mode: "compile" (torch.compile with static shapes), "trace" (torch.jit.trace per shape)
+    or "none". Returns the model to serve with.
+    """
+    if mode == "compile":
+        return torch.compile(model, dynamic=False)
+    if mode == "trace":
+        graphs = {}
+        with torch.no_grad():
+            for length, rows in shapes.items():
+                example = _example_inputs(tokenizer, rows, length, device)
+                graphs[(rows, length)] = torch.jit.trace(
+                    model,
+                    example_kwarg_inputs=example,
+                    strict=False,
+                    check_trace=False
+                )
+        return TracedShapes(model, graphs)
+    return model
+
+
+def warmup(model, tokenizer, shapes, device, repeats=2):
+    """
+    Run every (rows, length) shape repeats times (the first run compiles, later runs settle autotuning
+    and the allocator). Returns {"<rows>x<length>": seconds of the first run}.
+    """
+    report = {}
+    with torch.no_grad():
+        for length, rows in sorted(shapes.items()):
+            example = _example_inputs(tokenizer, rows, length, device)
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                model(**example).logits.float().cpu()
+                if repeat == 0:
+                    report[f"{rows}x{length}"] = round(time.perf_counter() - start, 3)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return report
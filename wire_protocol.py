@@ -0,0 +1,177 @@
+"""
+Compact binary /predict protocol shared by the GPU API server (api_server.py) and its client (api_client.py).
+
+JSON stays the default; clients switch to this format when /health lists "binary" in wire.formats.
+Request (Content-Type: application/x-fabric-batch, optionally Content-Encoding: gzip):
+    header  <4sBI   magic b"FBQ1", flags, row count
+    texts   uint32 byte length per row, then the UTF-8 texts back to back
+    tokens  (FLAG_TOKENS) uint16 token count per row, then int32 token ids back to back
+Response (Content-Type: application/x-fabric-labels):
+    header  <4sBIH  magic b"FBR1", flags, row count, meta length
+    meta    UTF-8 JSON: {"labels": [...], "count", "unique_count", "dedup_ratio", "cache_hits", "processing_time"}
+    ids     uint8 label id per row (index into meta["labels"])
+    probs   (FLAG_PROBABILITIES) float16 row-major [count, len(labels)]
+Streamed response (request FLAG_STREAM, Content-Type: application/x-fabric-label-stream):
+    frames  uint32 byte length, then one response as above, per finished segment of rows (meta["offset"]);
+            the last frame has no rows and meta {"done": true, ...}, or {"error", "offset"} if inference failed
+Keep this file free of Streamlit and torch imports so it can be uploaded next to api_server.py.
+"""
+
+import gzip
+import json
+import struct
+
+import numpy as np
+
+CONTENT_TYPE_BATCH = "application/x-fabric-batch"
+CONTENT_TYPE_LABELS = "application/x-fabric-labels"
+CONTENT_TYPE_LABEL_STREAM = "application/x-fabric-label-stream"
+WIRE_FORMATS = ("json", "binary")
+
+FLAG_TOKENS = 1  # rows are token id sequences (client already tokenized)
+FLAG_DEDUPE = 2
+FLAG_PROBABILITIES = 4  # request: send probabilities back / response: probabilities included
+FLAG_STREAM = 8  # request: answer with a frame per finished segment (CONTENT_TYPE_LABEL_STREAM)
+
+_REQUEST_MAGIC = b"FBQ1"
+_RESPONSE_MAGIC = b"FBR1"
+_REQUEST_HEADER = struct.Struct("<4sBI")
+_RESPONSE_HEADER = struct.Struct("<4sBIH")
+_FRAME_HEADER = struct.Struct("<I")
+
+
+def compress(body, encoding="gzip", level=1):
+    """Compress a body for the given Content-Encoding (level 1: most of the size win for little CPU)"""
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=level)
+    if encoding in (None, "", "identity"):
+        return body
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(body, encoding):
+    """Undo a request's Content-Encoding"""
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding in (None, "", "identity"):
+        return body
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def encode_request(texts=None, token_ids=None, dedupe=True, probabilities=False, stream=False):
+    """Encode either texts (list of str) or token_ids (list of int sequences) as a binary request body"""
+    flags = (FLAG_DEDUPE if dedupe else 0) | (FLAG_PROBABILITIES if probabilities else 0) | (FLAG_STREAM if stream else 0)
+    if token_ids is not None:
+        flags |= FLAG_TOKENS
+        lengths = np.fromiter((len(ids) for ids in token_ids), dtype="<u2", count=len(token_ids))
+        ids = np.fromiter((i for row in token_ids for i in row), dtype="<i4", count=int(lengths.sum(dtype=np.int64)))
+        parts = [lengths.tobytes(), ids.tobytes()]
+        count = len(token_ids)
+    else:
+        encoded = [text.encode("utf-8") for text in texts]
+        lengths = np.fromiter((len(data) for data in encoded), dtype="<u4", count=len(encoded))
+        parts = [lengths.tobytes(), b"".join(encoded)]
+        count = len(texts)
+    return _REQUEST_HEADER.pack(_REQUEST_MAGIC, flags, count) + b"".join(parts)
+
+
+def decode_request(body):
+    """
+    Decode a binary request body.
+    Returns {"texts": [...]} or {"token_ids": [tuple, ...]}, plus "dedupe", "probabilities" and "stream".
+    Raises ValueError on a malformed body.
+    """
+    if len(body) < _REQUEST_HEADER.size:
+        raise ValueError("Request body too short")
+    magic, flags, count = _REQUEST_HEADER.unpack_from(body)
+    if magic != _REQUEST_MAGIC:
+        raise ValueError("Not a binary predict request")
+    offset = _REQUEST_HEADER.size
+    request = {
+        'dedupe': bool(flags & FLAG_DEDUPE),
+        'probabilities': bool(flags & FLAG_PROBABILITIES),
+        'stream': bool(flags & FLAG_STREAM)
+    }
+
+    if flags & FLAG_TOKENS:
+        lengths = np.frombuffer(body, dtype="<u2", count=count, offset=offset)
+        offset += lengths.nbytes
+        ids = np.frombuffer(body, dtype="<i4", count=int(lengths.sum(dtype=np.int64)), offset=offset)
+        if offset + ids.nbytes != len(body):
+            raise ValueError("Token section length does not match the body")
+        bounds = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).tolist()
+        ids = ids.tolist()
+        request['token_ids'] = [tuple(ids[bounds[i]:bounds[i + 1]]) for i in range(count)]
+    else:
+        lengths = np.frombuffer(body, dtype="<u4", count=count, offset=offset)
+        offset += lengths.nbytes
+        bounds = (offset + np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))).tolist()
+        if bounds[-1] != len(body):
+            raise ValueError("Text section length does not match the body")
+        request['texts'] = [body[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(count)]
+    return request
+
+
+def encode_response(label_ids, labels, probabilities=None, meta=None):
+    """Encode label ids (ints < 256) and optional per-row probabilities (rows of len(labels) floats)"""
+    flags = FLAG_PROBABILITIES if probabilities is not None else 0
+    meta_bytes = json.dumps(dict(meta or {}, labels=list(labels)), ensure_ascii=False).encode("utf-8")
+    parts = [
+        _RESPONSE_HEADER.pack(_RESPONSE_MAGIC, flags, len(label_ids), len(meta_bytes)),
+        meta_bytes,
+        np.asarray(label_ids, dtype=np.uint8).tobytes()
+    ]
+    if probabilities is not None:
+        rows = np.asarray(probabilities, dtype="<f2").reshape(len(label_ids), len(labels))
+        parts.append(rows.tobytes())
+    return b"".join(parts)
+
+
+def decode_response(body):
+    """
+    Decode a binary response body.
+    Returns {"labels": [str per row], "label_ids": uint8 array, "probabilities": float16 array or None, "meta": dict}.
+    """
+    if len(body) < _RESPONSE_HEADER.size:
+        raise ValueError("Response body too short")
+    magic, flags, count, meta_length = _RESPONSE_HEADER.unpack_from(body)
+    if magic != _RESPONSE_MAGIC:
+        raise ValueError("Not a binary predict response")
+    offset = _RESPONSE_HEADER.size
+    meta = json.loads(body[offset:offset + meta_length].decode("utf-8"))
+    offset += meta_length
+    label_names = meta['labels']
+    label_ids = np.frombuffer(body, dtype=np.uint8, count=count, offset=offset)
+    offset += count
+    probabilities = None
+    if flags & FLAG_PROBABILITIES:
+        probabilities = np.frombuffer(body, dtype="<f2", count=count * len(label_names), offset=offset)
+        probabilities = probabilities.reshape(count, len(label_names))
+    return {
+        'labels': [label_names[i] for i in label_ids.tolist()],
+        'label_ids': label_ids,
+        'probabilities': probabilities,
+        'meta': meta
+    }
+
+
+def encode_frame(body):
+    """One frame of a streamed response: a response body (encode_response) prefixed with its length"""
+    return _FRAME_HEADER.pack(len(body)) + body
+
+
+def iter_frames(chunks):
+    """Decode the frames of a streamed response from an iterable of byte chunks, yielding decode_response dicts"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= _FRAME_HEADER.size:
+            (length,) = _FRAME_HEADER.unpack_from(buffer)
+            end = _FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+            frame = bytes(buffer[_FRAME_HEADER.size:end])
+            del buffer[:end]
+            yield decode_response(frame)
+    if buffer:
+        raise ValueError("Stream ended inside a frame")